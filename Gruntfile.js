@@ -200,7 +200,8 @@ module.exports = function(grunt) {
         command: 'tar czf ../dist/<%= build_name %>.tar.gz <%= build_name %>'
       },
       copy: {
-        command: 'cp -r src/* build/out/<%= build_name %>'
+        // config-state.json holds the configuration's secrets (see src/scripts/lib/configstate.py)
+        command: 'cp -r src/* build/out/<%= build_name %> && rm -f build/out/<%= build_name %>/config-state.json'
       },
       mkdir: {
         command: 'mkdir -p build/out/<%= build_name %>/logs build/out/<%= build_name %>/security build/dist'
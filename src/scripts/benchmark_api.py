@@ -0,0 +1,209 @@
+'''
+Benchmarks the entry, tag, session and login API endpoints of a running application
+
+Runs a weighted mix of requests (see lib/loadgen.py) against the application with the given concurrency for the given
+duration and reports the throughput and p50/p95/p99 latencies of each endpoint. The report can be written as JSON and
+compared to the report of an earlier run, e.g. from a previous commit, to catch performance regressions. With
+--start-server the application in an install directory is started on free ports (see lib/warmup.py), next to any
+running instance of it, for the benchmark and stopped afterwards.
+
+Assumptions:
+- That the database has been loaded with representative data, e.g. using seed.py
+- That the login scenario's local account exists, the login scenario is only run if --login-email is given
+'''
+
+#!/usr/bin/python
+
+import argparse as argparse
+import json as json
+import sys as sys
+import tempfile as tempfile
+import time as time
+
+import lib.loadgen as loadgen
+import lib.warmup as warmup
+
+def parse_mix(mix_string):
+  '''
+  Returns the scenario weights dict from a mix string like "entries_all=1,entries_by_tag=4"
+  '''
+  scenario_weights = {}
+  for mix_item in [item for item in mix_string.split(',') if item.strip()]:
+    (scenario_name, separator, weight) = mix_item.partition('=')
+    scenario_weights[scenario_name.strip()] = int(weight) if separator else 1
+  return scenario_weights
+
+def fetch_tag_strings(base_url, verify_tls):
+  '''
+  Returns the values of all of the application's tags, to pick the entries_by_tag scenario's tag strings from
+  '''
+  client = loadgen.Client(base_url, keep_alive=False, verify_tls=verify_tls)
+  client.connection = client.connect()
+  try:
+    client.connection.request('GET', '/api/tag')
+    response = client.connection.getresponse()
+    response_body = response.read()
+  finally:
+    client.close()
+  if response.status != 200:
+    raise Exception(
+      'Error:\n' +
+      'Could not fetch the tags to benchmark, GET /api/tag responded with ' + str(response.status)
+    )
+  return [tag['value'] for tag in json.loads(response_body)]
+
+
+
+def run_benchmark(base_url, scenario_weights, concurrency, duration_seconds, warmup_seconds, options):
+  '''
+  Runs the benchmark and returns its report dict
+  '''
+  if scenario_weights.get('entries_by_tag') and not options.get('tag_strings'):
+    options['tag_strings'] = fetch_tag_strings(base_url, options['verify_tls'])
+    if not options['tag_strings']:
+      print('There are no tags, not running the entries_by_tag scenario')
+      del scenario_weights['entries_by_tag']
+  print('Running ' + ', '.join([name + ' x' + str(weight) for (name, weight) in sorted(scenario_weights.items())]) +
+    ' against ' + base_url + ' with concurrency ' + str(concurrency) + ' for ' + str(duration_seconds) + 's' +
+    (' after a ' + str(warmup_seconds) + 's warmup' if warmup_seconds else ''))
+  (records, wall_seconds) = loadgen.run_load(base_url, scenario_weights, concurrency, duration_seconds, warmup_seconds,
+    options)
+  return {
+    'base_url': base_url,
+    'started_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    'concurrency': concurrency,
+    'duration_seconds': duration_seconds,
+    'warmup_seconds': warmup_seconds,
+    'keep_alive': options['keep_alive'],
+    'scenario_weights': scenario_weights,
+    'wall_seconds': wall_seconds,
+    'total_requests': len(records),
+    'total_throughput_rps': len(records) / wall_seconds if wall_seconds > 0 else None,
+    'endpoints': loadgen.summarise_records(records, wall_seconds)
+  }
+
+def format_milliseconds(milliseconds):
+  return '%9.1f' % milliseconds if milliseconds is not None else '        -'
+
+def format_rps(requests_per_second):
+  return '%10.1f' % requests_per_second if requests_per_second is not None else '         -'
+
+def print_report(report):
+  print('endpoint           requests  errors     req/s      p50ms      p95ms      p99ms')
+  for (name, summary) in sorted(report['endpoints'].items()):
+    percentiles = [summary['latency_ms']['p' + str(percent)] for percent in loadgen.CONST_PERCENTILES]
+    print(name.ljust(16) + str(summary['requests']).rjust(10) + str(summary['errors']).rjust(8) +
+      format_rps(summary['throughput_rps']) + '  ' + '  '.join([format_milliseconds(value) for value in percentiles]))
+  print('total            ' + str(report['total_requests']).rjust(9) + '        ' +
+    format_rps(report['total_throughput_rps']))
+
+def compare_reports(report, baseline_report, max_regression_percent=None):
+  '''
+  Prints the change in throughput and p95 latency of each endpoint from baseline_report to report. Returns a list of
+  the endpoints whose p95 latency is more than max_regression_percent higher than the baseline
+  '''
+  regressions = []
+  print('endpoint          req/s change  p95ms change')
+  for (name, summary) in sorted(report['endpoints'].items()):
+    baseline_summary = baseline_report['endpoints'].get(name)
+    if baseline_summary is None:
+      print(name.ljust(16) + '  not in baseline')
+      continue
+    p95_change = 100.0 * (summary['latency_ms']['p95'] / baseline_summary['latency_ms']['p95'] - 1)
+    if summary['throughput_rps'] is None or not baseline_summary['throughput_rps']:
+      throughput_change_string = '-'.rjust(13)
+    else:
+      throughput_change = 100.0 * (summary['throughput_rps'] / baseline_summary['throughput_rps'] - 1)
+      throughput_change_string = '%+12.1f%%' % throughput_change
+    print(name.ljust(16) + throughput_change_string + ('%+13.1f%%' % p95_change))
+    if max_regression_percent is not None and p95_change > max_regression_percent:
+      regressions.append(name)
+  return regressions
+
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Benchmarks the entry, tag, session and login API endpoints')
+  parser.add_argument('--url', help='Base URL of the application, read from the install directory if not given')
+  parser.add_argument('--install-dir', help='Application install directory, to read the server host and port from')
+  parser.add_argument('--start-server', action='store_true', help='Start the application in --install-dir for the run')
+  parser.add_argument('--concurrency', type=int, default=8, help='Number of concurrent clients')
+  parser.add_argument('--duration', type=float, default=30, help='Seconds to measure for')
+  parser.add_argument('--warmup', type=float, default=5, help='Seconds to run for before measuring')
+  parser.add_argument('--no-keep-alive', action='store_true', help='Open a new connection for every request')
+  parser.add_argument('--verify-tls', action='store_true', help='Verify the server\'s TLS certificate')
+  parser.add_argument('--mix', default=','.join([name + '=' + str(weight) for (name, weight) in
+    sorted(loadgen.CONST_DEFAULT_SCENARIO_WEIGHTS.items())]), help='Scenario weights, e.g. entries_by_tag=4,tags=1')
+  parser.add_argument('--tags', help='Comma separated tag strings for entries_by_tag, all tags are used if not given')
+  parser.add_argument('--login-email', help='Local account email for the login scenario')
+  parser.add_argument('--login-password', default='', help='Local account password for the login scenario')
+  parser.add_argument('--random-seed', type=int, default=0, help='Seed for the scenario mix, for repeatable runs')
+  parser.add_argument('--output', help='File to write the JSON report to')
+  parser.add_argument('--compare', help='JSON report of an earlier run to compare this run to')
+  parser.add_argument('--max-regression', type=float,
+    help='With --compare, exit with an error if any endpoint\'s p95 latency rose by more than this percentage')
+  args = parser.parse_args()
+
+  if args.url is None and args.install_dir is None:
+    parser.error('one of --url or --install-dir is required')
+  if args.start_server and (args.install_dir is None or args.url is not None):
+    parser.error('--start-server requires --install-dir and cannot be used with --url')
+  base_url = args.url
+  if base_url is None:
+    (host, port) = warmup.read_server_configuration(args.install_dir)
+    if args.start_server:
+      (http_port, port) = warmup.free_ports(host, 2)
+    base_url = 'https://' + host + ':' + str(port)
+
+  scenario_weights = parse_mix(args.mix)
+  if scenario_weights.get('login') and args.login_email is None:
+    print('No --login-email given, not running the login scenario')
+    del scenario_weights['login']
+  options = {
+    'keep_alive': not args.no_keep_alive,
+    'verify_tls': args.verify_tls,
+    'random_seed': args.random_seed,
+    'tag_strings': args.tags.split(',') if args.tags else None,
+    'login_email': args.login_email,
+    'login_password': args.login_password
+  }
+
+  print('******************************************************************')
+  print('  BENCHMARKING API')
+  print('******************************************************************')
+  server_process = None
+  server_log_file = None
+  try:
+    if args.start_server:
+      server_log_file = tempfile.NamedTemporaryFile(prefix='login-fiddle-benchmark-', suffix='.log', delete=False)
+      server_process = warmup.start_server(args.install_dir, host, port, server_log_file,
+        warmup.side_server_env(http_port, port))
+    report = run_benchmark(base_url, scenario_weights, args.concurrency, args.duration, args.warmup, options)
+    if server_process is not None and server_process.poll() is not None:
+      raise Exception(
+        'Error:\n' +
+        'Server exited with status ' + str(server_process.returncode) + ' during the benchmark, see ' +
+          server_log_file.name
+      )
+  finally:
+    if server_process is not None:
+      print('Stopping server')
+      server_process.terminate()
+      server_process.wait()
+    if server_log_file is not None:
+      server_log_file.close()
+
+  print_report(report)
+  if args.output is not None:
+    with open(args.output, 'w') as output_file:
+      json.dump(report, output_file, indent=2, sort_keys=True)
+    print('Wrote: ' + args.output)
+  failed = any([summary['errors'] for summary in report['endpoints'].values()])
+  if args.compare is not None:
+    with open(args.compare, 'r') as baseline_file:
+      regressions = compare_reports(report, json.load(baseline_file), args.max_regression)
+    if regressions:
+      print('p95 latency regressed by more than ' + str(args.max_regression) + '% for: ' + ', '.join(regressions))
+      failed = True
+  if failed:
+    sys.exit(1)
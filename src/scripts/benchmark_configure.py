@@ -0,0 +1,209 @@
+'''
+Benchmarks the configuration tooling against synthetic manifests of growing size
+
+For each case - a number of inputs, outputs per input, files and file size - generates a fixture (see
+lib/configbench.py) and configures it headlessly with configure.configure_app, answering a new value for the first half
+of the inputs (the rest are read from the files), which reaches every file if there are at least twice as many inputs
+as files. The number of files written is reported with each case, so that a case that only writes some is visible. Each
+run is made in a new process, so that
+its peak memory is its own, and the runs of a case are summarised by their medians. The report gives the time, peak
+memory and file system calls of each case and the calls and time of load_manifest, build_input_dict,
+build_output_array, value_from_file_string etc. It can be written as JSON and compared to the report of an earlier
+run, e.g. from a previous commit, to catch the tooling slowing down as configure.yaml grows.
+
+By default the manifest cache is warm, as it is for every configure run but the first after configure.yaml changes;
+--cold-manifest removes it before each run to include parsing the YAML.
+'''
+
+#!/usr/bin/python
+
+import argparse as argparse
+import json as json
+import os as os
+import shutil as shutil
+import subprocess as subprocess
+import sys as sys
+import tempfile as tempfile
+import time as time
+
+import lib.answers as answers
+import lib.configbench as configbench
+import lib.configstate as configstate
+import lib.general as general
+import lib.manifest as manifest
+import configure as configure
+
+# The functions whose calls and cumulative time are reported, as (label, module, function name)
+CONST_TIMED_FUNCTIONS = [
+  ('configure_app', configure, 'configure_app'),
+  ('load_manifest', manifest, 'load_manifest'),
+  ('build_input_dict', configure, 'build_input_dict'),
+  ('build_output_array', configure, 'build_output_array'),
+  ('read_answers', configure, 'read_answers'),
+  ('value_from_file_string', general, 'value_from_file_string'),
+  ('write_outputs', configure, 'write_outputs'),
+  ('save_configuration_state', configure, 'save_configuration_state')
+]
+CONST_RESULT_NAME = 'run-result.json'
+
+def run_case(fixture_dir_path, input_count, result_path):
+  '''
+  Configures the fixture in fixture_dir_path (with input_count inputs) in this process, writing the measurements of the
+  run (see configbench.measure) to result_path. configure's output is discarded, it would only measure the terminal
+  '''
+  answers_dict = answers.answers_from_dict({'values': configbench.answer_values(input_count)}, environ={})
+  run_record = {}
+  timings = {}
+  stdout = sys.stdout
+  with open(os.devnull, 'w') as devnull:
+    sys.stdout = devnull
+    try:
+      with configbench.measure(run_record):
+        with configbench.time_functions(CONST_TIMED_FUNCTIONS, timings):
+          written_filepaths = configure.configure_app(fixture_dir_path, fixture_dir_path, answers_dict,
+            manifest_path=os.path.join(fixture_dir_path, configbench.CONST_MANIFEST_NAME))
+    finally:
+      sys.stdout = stdout
+  run_record['files_written'] = len(written_filepaths)
+  run_record['functions'] = timings
+  with open(result_path, 'w') as result_file:
+    json.dump(run_record, result_file, sort_keys=True)
+
+def run_once(case, fixture_dir_path, cold_manifest):
+  '''
+  Generates the fixture of case afresh and configures it in a new process, returning the run's measurements
+  '''
+  manifest_path = configbench.generate_fixture(fixture_dir_path, case['inputs'], case['outputs'], case['files'],
+    case['file_kb'])
+  if os.path.isfile(configstate.state_path(fixture_dir_path)):
+    os.unlink(configstate.state_path(fixture_dir_path))
+  if cold_manifest:
+    if os.path.isfile(manifest.manifest_cache_path(manifest_path)):
+      os.unlink(manifest.manifest_cache_path(manifest_path))
+  else:
+    manifest.load_manifest(manifest_path)
+  result_path = os.path.join(fixture_dir_path, CONST_RESULT_NAME)
+  exit_status = subprocess.call([sys.executable, os.path.abspath(__file__), '--run-case', fixture_dir_path,
+    '--inputs', str(case['inputs']), '--result', result_path])
+  if exit_status != 0:
+    raise Exception(
+      'Error:\n' +
+      'Configuring the ' + case['name'] + ' fixture exited with status ' + str(exit_status)
+    )
+  with open(result_path, 'r') as result_file:
+    return json.load(result_file)
+
+
+
+def parse_counts(counts_string):
+  '''
+  Returns the list of ints in a comma separated string like "100,1000"
+  '''
+  return [int(count) for count in counts_string.split(',') if count.strip()]
+
+def build_cases(input_counts, outputs_per_input, file_count, file_kbs):
+  cases = []
+  for input_count in input_counts:
+    for file_kb in file_kbs:
+      output_count = input_count * outputs_per_input
+      cases.append({
+        'name': 'i' + str(input_count) + '-o' + str(output_count) + '-f' + str(file_count) + '-' + str(file_kb) + 'kB',
+        'inputs': input_count,
+        'outputs': output_count,
+        'files': file_count,
+        'file_kb': file_kb
+      })
+  return cases
+
+def run_benchmark(cases, repeat, cold_manifest):
+  '''
+  Runs every case repeat times and returns the report dict
+  '''
+  fixture_dir_path = tempfile.mkdtemp(prefix='login-fiddle-configbench-')
+  try:
+    for case in cases:
+      print('Running ' + case['name'] + ' x' + str(repeat))
+      case['runs'] = [run_once(case, os.path.join(fixture_dir_path, case['name']), cold_manifest)
+        for run_number in range(repeat)]
+      case['summary'] = configbench.summarise_runs(case['runs'])
+  finally:
+    shutil.rmtree(fixture_dir_path)
+  return {
+    'started_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    'python': sys.version.split()[0],
+    'repeat': repeat,
+    'cold_manifest': cold_manifest,
+    'cases': cases
+  }
+
+def print_report(report):
+  print('case                          wall s     cpu s   peak MB  grew MB    fs ops  scrape s   write s   written')
+  for case in report['cases']:
+    summary = case['summary']
+    print(case['name'].ljust(26) + ('%10.3f%10.3f%10.1f%9.1f' % (summary['wall_seconds'], summary['cpu_seconds'],
+      summary['peak_rss_kb'] / 1024.0, summary['rss_growth_kb'] / 1024.0)) +
+      str(sum(summary['fs_ops'].values())).rjust(10) +
+      ('%10.3f%10.3f' % (summary['functions'].get('value_from_file_string', {}).get('seconds', 0.0),
+      summary['functions'].get('write_outputs', {}).get('seconds', 0.0))) +
+      (str(summary['files_written']) + '/' + str(case['files'])).rjust(10))
+
+def compare_reports(report, baseline_report, max_regression_percent=None):
+  '''
+  Prints the change in wall time and peak memory of each case from baseline_report to report. Returns a list of the
+  cases whose wall time is more than max_regression_percent higher than the baseline
+  '''
+  regressions = []
+  if report['cold_manifest'] != baseline_report.get('cold_manifest'):
+    print('NB: only one of the reports was run with --cold-manifest, so their times include different work')
+  baseline_summaries = dict([(case['name'], case['summary']) for case in baseline_report['cases']])
+  print('case                      wall s change  peak MB change')
+  for case in report['cases']:
+    baseline_summary = baseline_summaries.get(case['name'])
+    if baseline_summary is None:
+      print(case['name'].ljust(26) + '  not in baseline')
+      continue
+    wall_change = 100.0 * (case['summary']['wall_seconds'] / baseline_summary['wall_seconds'] - 1)
+    rss_change = 100.0 * (float(case['summary']['peak_rss_kb']) / baseline_summary['peak_rss_kb'] - 1)
+    print(case['name'].ljust(26) + ('%+13.1f%%' % wall_change) + ('%+15.1f%%' % rss_change))
+    if max_regression_percent is not None and wall_change > max_regression_percent:
+      regressions.append(case['name'])
+  return regressions
+
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Benchmarks the configuration tooling against synthetic manifests')
+  parser.add_argument('--inputs', default='100,500,1000,2000', help='Comma separated numbers of inputs to run with')
+  parser.add_argument('--outputs-per-input', type=int, default=2, help='Number of outputs per input')
+  parser.add_argument('--files', type=int, default=8, help='Number of configuration files to spread them across')
+  parser.add_argument('--file-kb', default='16,256', help='Comma separated configuration file sizes in kB')
+  parser.add_argument('--repeat', type=int, default=3, help='Number of runs of each case')
+  parser.add_argument('--cold-manifest', action='store_true', help='Remove the manifest cache before each run')
+  parser.add_argument('--output', help='File to write the JSON report to')
+  parser.add_argument('--compare', help='JSON report of an earlier run to compare this run to')
+  parser.add_argument('--max-regression', type=float,
+    help='With --compare, exit with an error if any case\'s wall time rose by more than this percentage')
+  parser.add_argument('--run-case', help=argparse.SUPPRESS)
+  parser.add_argument('--result', help=argparse.SUPPRESS)
+  args = parser.parse_args()
+
+  if args.run_case is not None:
+    run_case(args.run_case, int(args.inputs), args.result)
+    sys.exit(0)
+
+  cases = build_cases(parse_counts(args.inputs), args.outputs_per_input, args.files, parse_counts(args.file_kb))
+  print('******************************************************************')
+  print('  BENCHMARKING CONFIGURE')
+  print('******************************************************************')
+  report = run_benchmark(cases, args.repeat, args.cold_manifest)
+  print_report(report)
+  if args.output is not None:
+    with open(args.output, 'w') as output_file:
+      output_file.write(json.dumps(report, indent=2, separators=(',', ': '), sort_keys=True) + '\n')
+    print('Wrote: ' + args.output)
+  if args.compare is not None:
+    with open(args.compare, 'r') as baseline_file:
+      regressions = compare_reports(report, json.load(baseline_file), args.max_regression)
+    if regressions:
+      print('Wall time regressed by more than ' + str(args.max_regression) + '% for: ' + ', '.join(regressions))
+      sys.exit(1)
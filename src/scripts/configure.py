@@ -1,18 +1,32 @@
 '''
 Application file configuration
 
-Guides user through configuration file changes, writing the changes to disk. Does not move, copy, backup or otherwise
-edit any files. Does not make any database changes. Does not restart the web application
+Guides user through configuration file changes, writing the changes to disk. Only files whose contents change are
+written, and --dry-run reports the changes without writing anything. Does not move, copy, backup or otherwise edit any
+files, except to refresh the precompressed copy and manifest entry of any static asset it writes (see lib/assets.py).
+Queries the DB server's connection limits (with psql, never prompting for a password) to check the DB pool against
+them, but does not make any database changes. Does not restart the web application
 '''
 
 #!/usr/bin/python
 
+import argparse as argparse
 import os.path as path
-import yaml as yaml
-import re as re
 
+import lib.answers as answers
+import lib.assets as assets
+import lib.configstate as configstate
+import lib.db as db
+import lib.dbpool as dbpool
+import lib.events as events
 import lib.general as general
 import lib.configure as configure
+import lib.manifest as manifest
+import lib.pm2 as pm2
+
+CONST_CONFIGURE_YAML_PATH = path.join(path.dirname(path.abspath(__file__)), 'configure.yaml')
+CONST_DB_POOL_VALKEYS = ['db_max_conn', 'db_min_conn', 'db_max_idle_time']
+CONST_DB_SERVER_VALKEYS = ['db_host', 'db_port']
 
 def prompt_for_configure_directories():
   current_value_install_dir = \
@@ -23,23 +37,26 @@ def prompt_for_configure_directories():
 
 
 
-def load_inputs_outputs(current_value_install_dir, output_value_install_dir):
+def load_inputs_outputs(current_value_install_dir, output_value_install_dir, file_set,
+  manifest_path=CONST_CONFIGURE_YAML_PATH):
   '''
-  Loads inputs and outputs to be used from configure.yaml
-  Outputs is a list and inputs is a dict of {valkey: Input}
+  Loads inputs and outputs to be used from the manifest at manifest_path (by default configure.yaml next to this script,
+  via the manifest cache), all reading from and writing to the ConfigFileSet file_set. Inputs' current values are the
+  values saved in current_value_install_dir's configuration state (see lib/configstate.py), or read from its files if
+  there are none. Outputs is a list and inputs is a dict of {valkey: Input}
   '''
-  configure_yaml = open('configure.yaml', 'r')
-  config_data = yaml.load(configure_yaml)
-  inputs = build_input_dict(config_data['inputs'], current_value_install_dir)
-  outputs = build_output_array(config_data['outputs'], inputs, output_value_install_dir)
+  config_data = manifest.load_manifest(manifest_path)
+  inputs = build_input_dict(config_data['inputs'], current_value_install_dir, file_set,
+    configstate.read_values(current_value_install_dir))
+  outputs = build_output_array(config_data['outputs'], inputs, output_value_install_dir, file_set)
   return (inputs, outputs)
 
-def build_input_dict(yaml_inputs, current_value_install_dir):
+def build_input_dict(manifest_inputs, current_value_install_dir, file_set, saved_values=None):
   '''
-  Builds a dict of valkey -> Input objects from a yaml object dict, checks no duplicate valkeys
+  Builds a dict of valkey -> Input objects from a manifest inputs list, checks no duplicate valkeys
   '''
   inputs = {}
-  for ival in yaml_inputs:
+  for ival in manifest_inputs:
     if ival['valkey'] in inputs:
       raise Exception(
         'Error:\n' +
@@ -49,28 +66,34 @@ def build_input_dict(yaml_inputs, current_value_install_dir):
       valkey = ival['valkey'],
       name = ival['name'],
       desc = ival['desc'],
-      current_val_filepath = current_value_install_dir + ival['current_val_rel_filepath'],
+      current_val_filepath = path.join(current_value_install_dir, ival['current_val_rel_filepath']),
       current_val_regex = ival['current_val_regex'],
-      validation_regex = ival['validation_regex']
+      validation_regex = ival['validation_regex'],
+      file_set = file_set,
+      saved_values = saved_values
     )
   return inputs
 
-def build_output_array(yaml_outputs, inputs_dict, output_value_install_dir):
+def build_output_array(manifest_outputs, inputs_dict, output_value_install_dir, file_set):
   '''
-  Builds a list of Output objects from a yaml object dict, checks all input_valkey's exist in inputs_dict
+  Builds a list of Output objects from a manifest outputs list, checks all input_valkey's exist in inputs_dict
   '''
   outputs = []
-  for oval in yaml_outputs:
-    check_inputs_dict_has_value_template_keys(oval['value_template'], inputs_dict)
+  for oval in manifest_outputs:
+    check_inputs_dict_has_value_template_keys(oval['valkeys'], inputs_dict)
     outputs.append(configure.Output(
-      output_filepath = output_value_install_dir + oval['output_rel_filepath'],
+      output_filepath = path.join(output_value_install_dir, oval['output_rel_filepath']),
       output_regex_string = oval['output_regex_string'],
-      value_template = oval['value_template']
+      value_template = oval['value_template'],
+      file_set = file_set,
+      state_valkey = oval.get('state_valkey')
     ))
   return outputs
 
-def check_inputs_dict_has_value_template_keys(value_template, inputs_dict):
-  input_keys_used = re.findall('%\(([a-zA-Z_]+)\)s', value_template)
+def check_inputs_dict_has_value_template_keys(input_keys_used, inputs_dict):
+  '''
+  Checks that every valkey in input_keys_used (resolved from a value_template by the manifest) exists in inputs_dict
+  '''
   for input_key_used in input_keys_used:
     if input_key_used not in inputs_dict:
       raise Exception(
@@ -82,49 +105,248 @@ def check_inputs_dict_has_value_template_keys(value_template, inputs_dict):
 
 def read_inputs(inputs_dict):
   '''
-  Reads inputs, returns dict of {valkey: value}
+  Reads inputs, returns dict of {valkey: value}. The DB pool inputs are read last, with recommended defaults
   '''
   input_values = {}
+  pool_inputs_used = has_db_pool_inputs(inputs_dict)
   for input in inputs_dict.values():
+    if pool_inputs_used and input.get_valkey() in CONST_DB_POOL_VALKEYS:
+      continue
     input_values[input.get_valkey()] = input.read_and_return_value()
     print ''
+  if pool_inputs_used:
+    read_db_pool_inputs(inputs_dict, input_values)
+  return input_values
+
+def read_answers(inputs_dict, answer_values):
+  '''
+  Reads inputs from the answer_values {valkey: value} dict without prompting, returns dict of {valkey: value}. Inputs
+  that are not answered keep their current value. Every value is validated before returning and all errors are
+  reported together in one exception
+  '''
+  input_values = {}
+  errors = []
+  for valkey in sorted(answer_values.keys()):
+    if valkey not in inputs_dict:
+      errors.append('Error: "' + valkey + '" is answered but is not a configuration input')
+  for valkey in sorted(inputs_dict.keys()):
+    input = inputs_dict[valkey]
+    if valkey in answer_values:
+      value = answer_values[valkey]
+    else:
+      try:
+        value = input.read_current_value()
+      except Exception as e:
+        errors.append(str(e).replace('\n', ' '))
+        continue
+    validation_error = input.validation_error(value)
+    if validation_error is not None:
+      errors.append(validation_error + ' (' + valkey + ')')
+    input_values[valkey] = value
+  if errors:
+    raise Exception(
+      'Error:\n' +
+      str(len(errors)) + ' configuration value(s) are invalid:\n' +
+      '\n'.join(errors)
+    )
   return input_values
 
 
 
-def write_outputs(input_values, outputs_list):
+def has_db_pool_inputs(inputs_dict):
+  return all([valkey in inputs_dict for valkey in CONST_DB_POOL_VALKEYS + CONST_DB_SERVER_VALKEYS])
+
+def worker_count(answers_dict=None):
+  '''
+  Returns the number of pm2 workers that will share the database, as install.configure_pm2 will configure them
+  '''
+  (cpu_count, memory_bytes) = pm2.host_resources()
+  settings = pm2.recommended_settings(cpu_count, memory_bytes)
+  if answers_dict is not None:
+    settings = pm2.settings_with_overrides(settings, answers.get_option(answers_dict, 'pm2', {}))
+  return int(settings['instances'])
+
+def advise_db_pool(input_values, answers_dict=None):
+  '''
+  Returns a DB pool advice dict of the number of workers, the DB server's connection limits and the recommended pool
+  input values (see lib/dbpool.py), for the DB server in input_values
+  '''
+  workers = worker_count(answers_dict)
+  (max_connections, reserved_connections, limits_source) = dbpool.server_connection_limits(
+    input_values['db_host'],
+    input_values['db_port'],
+    db.psql_command_from_answers(answers_dict)
+  )
+  rtt_ms = dbpool.measure_connect_rtt(input_values['db_host'], input_values['db_port'])
+  print('DB pool: ' + str(workers) + ' pm2 worker(s), ' + str(max_connections) + ' max_connections with ' +
+    str(reserved_connections) + ' reserved (' + limits_source + '), ' +
+    ('%.1fms' % rtt_ms if rtt_ms is not None else 'unmeasured') + ' connection round trip')
+  return {
+    'workers': workers,
+    'max_connections': max_connections,
+    'reserved_connections': reserved_connections,
+    'limits_source': limits_source,
+    'recommended_values': dbpool.recommend_pool(workers, max_connections, reserved_connections, rtt_ms)
+  }
+
+def db_pool_errors(input_values, db_pool_advice):
+  '''
+  Returns the reasons the DB pool in input_values is unsafe, only warning about them if the server's limits were
+  assumed (see dbpool.enforced_errors)
+  '''
+  return dbpool.enforced_errors(dbpool.pool_errors(
+    db_pool_advice['workers'],
+    int(input_values['db_max_conn']),
+    int(input_values['db_min_conn']),
+    db_pool_advice['max_connections'],
+    db_pool_advice['reserved_connections']
+  ), db_pool_advice['limits_source'])
+
+def read_db_pool_inputs(inputs_dict, input_values):
+  '''
+  Reads the DB pool inputs into input_values, offering the recommended values as defaults, until they are safe
+  '''
+  db_pool_advice = advise_db_pool(input_values)
+  while True:
+    for valkey in CONST_DB_POOL_VALKEYS:
+      input_values[valkey] = inputs_dict[valkey].read_and_return_value(db_pool_advice['recommended_values'][valkey])
+      print ''
+    errors = db_pool_errors(input_values, db_pool_advice)
+    if not errors:
+      return
+    print('\n'.join(errors))
+    print('Please enter the DB pool values again')
+
+def check_answered_db_pool(input_values, answers_dict):
+  '''
+  Raises an error if the DB pool values in input_values would exhaust the DB server's connections. If the answers file
+  sets recommend_db_pool, the pool values it does not answer are set to the recommended values first
+  '''
+  db_pool_advice = advise_db_pool(input_values, answers_dict)
+  if answers.get_option(answers_dict, 'recommend_db_pool', False):
+    for valkey in CONST_DB_POOL_VALKEYS:
+      if valkey not in answers_dict['values']:
+        input_values[valkey] = db_pool_advice['recommended_values'][valkey]
+  errors = db_pool_errors(input_values, db_pool_advice)
+  if errors:
+    raise Exception(
+      'Error:\n' +
+      'The DB pool configuration is unsafe:\n' +
+      '\n'.join(errors)
+    )
+
+
+
+def print_change_report(changes, file_set, dry_run=False):
   '''
-  Iterates over [Output] outputs_list, getting the value to write from the input_values {valkey: value string} dict
+  Prints the outputs whose values change (with secret values masked) and which files would be written or left untouched
   '''
+  changed_outputs = [change for change in changes if change['old_value'] != change['new_value']]
+  print('Configuration changes' + (' (dry run, nothing will be written)' if dry_run else '') + ':')
+  for change in changed_outputs:
+    if change['secret']:
+      (old_value, new_value) = ('********', '********')
+    else:
+      (old_value, new_value) = (change['old_value'], change['new_value'])
+    print('  ' + path.normpath(change['filepath']) + ' /' + change['output_regex_string'] + '/: \'' + old_value +
+      '\' -> \'' + new_value + '\'')
+  print('  ' + str(len(changed_outputs)) + ' of ' + str(len(changes)) + ' output(s) changed')
+  modified_filepaths = file_set.modified_filepaths()
+  for filepath in sorted(set([path.realpath(change['filepath']) for change in changes])):
+    print(('  Changed:   ' if filepath in modified_filepaths else '  Unchanged: ') + filepath)
+
+def write_outputs(input_values, outputs_list, file_set, dry_run=False):
+  '''
+  Iterates over [Output] outputs_list, getting the value to write from the input_values {valkey: value string} dict,
+  then prints a report of the changes and, unless dry_run, flushes the ConfigFileSet file_set so that each changed file
+  is written to disk once and unchanged files are not touched. Returns the list of file paths written
+  '''
+  changes = []
   for output in outputs_list:
-    output.write_output(input_values)
+    change = output.write_output(input_values)
+    change['secret'] = output.is_secret()
+    changes.append(change)
+  print_change_report(changes, file_set, dry_run)
+  if dry_run:
+    return []
+  written_filepaths = file_set.flush()
+  for written_filepath in written_filepaths:
+    print('Wrote: ' + written_filepath)
+  return written_filepaths
+
+def save_configuration_state(input_values, outputs_list, output_value_install_dir):
+  '''
+  Saves input_values, and the value written by each output with a state_valkey (e.g. db_user), as the configuration
+  state of output_value_install_dir (see lib/configstate.py), so that later reads of its configuration do not have to
+  scrape the files the outputs were written to
+  '''
+  output_rel_filepaths = [path.relpath(output.get_output_filepath(), output_value_install_dir)
+    for output in outputs_list]
+  state_values = dict(input_values)
+  for output in outputs_list:
+    if output.get_state_valkey() is not None:
+      state_values[output.get_state_valkey()] = output.get_value_template() % input_values
+  if configstate.write_state(output_value_install_dir, state_values, output_rel_filepaths):
+    print('Wrote: ' + configstate.state_path(output_value_install_dir))
 
 
 
-def configure_app(current_value_install_dir, output_value_install_dir):
+def configure_app(current_value_install_dir, output_value_install_dir, answers_dict=None, dry_run=False,
+  manifest_path=CONST_CONFIGURE_YAML_PATH):
   '''
-  Loads the inputs dictionary, reads the inputs, writes them to the configuration files
+  Loads the inputs dictionary, reads the inputs, checks the DB pool bounds against the DB server and writes them to the
+  configuration files, only writing files whose contents change, and saves them as the install's configuration state.
+  Static assets that were written are refreshed in the install's asset manifest, if it has one. If answers_dict (see
+  lib/answers.py) is given the inputs are read from its values rather than prompted for. If dry_run, the changes are
+  reported but not written. The inputs and outputs are read from the manifest at manifest_path, e.g. a synthetic one
+  (see benchmark_configure.py). Returns the list of file paths written
   '''
+  file_set = configure.ConfigFileSet()
   (inputs_dict, outputs_list) = load_inputs_outputs(
     current_value_install_dir=current_value_install_dir,
-    output_value_install_dir=output_value_install_dir
+    output_value_install_dir=output_value_install_dir,
+    file_set=file_set,
+    manifest_path=manifest_path
   )
-  input_values = read_inputs(inputs_dict)
-  write_outputs(input_values, outputs_list)
+  with events.step('read_inputs'):
+    if answers_dict is None:
+      input_values = read_inputs(inputs_dict)
+    else:
+      input_values = read_answers(inputs_dict, answers_dict['values'])
+      if has_db_pool_inputs(inputs_dict):
+        check_answered_db_pool(input_values, answers_dict)
+  with events.step('write_outputs'):
+    written_filepaths = write_outputs(input_values, outputs_list, file_set, dry_run)
+  if not dry_run:
+    save_configuration_state(input_values, outputs_list, output_value_install_dir)
+    for url_path in assets.refresh_assets(output_value_install_dir, written_filepaths):
+      print('Refreshed static asset: ' + url_path)
+  return written_filepaths
 
 
 
 if __name__ == '__main__':
-  (current_value_install_dir, output_value_install_dir) = prompt_for_configure_directories()
-  while not general.prompt_for_confirm('Is this correct?', False):
+  parser = argparse.ArgumentParser(description='Application file configuration')
+  parser.add_argument('--answers', help='YAML or JSON answers file to configure from without prompting')
+  parser.add_argument('--dry-run', action='store_true', help='Report the configuration changes without writing them')
+  args = parser.parse_args()
+
+  answers_dict = None
+  if args.answers is not None:
+    answers_dict = answers.load_answers(args.answers)
+    current_value_install_dir = answers.get_option(answers_dict, 'current_value_install_dir')
+    output_value_install_dir = answers.get_option(answers_dict, 'output_value_install_dir')
+  else:
     (current_value_install_dir, output_value_install_dir) = prompt_for_configure_directories()
+    while not general.prompt_for_confirm('Is this correct?', False):
+      (current_value_install_dir, output_value_install_dir) = prompt_for_configure_directories()
 
   print('\nYou have elected:')
   print('- to read default values from:           ' + current_value_install_dir)
   print('- to write the updated configuration to: ' + output_value_install_dir)
-  if general.prompt_for_confirm('Is this correct?', None):
+  if answers_dict is not None or general.prompt_for_confirm('Is this correct?', None):
     print('')
-    configure_app(current_value_install_dir, output_value_install_dir)
+    configure_app(current_value_install_dir, output_value_install_dir, answers_dict, args.dry_run)
     print('')
     print('')
     print('')
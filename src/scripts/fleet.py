@@ -0,0 +1,126 @@
+'''
+Configures or upgrades many application install directories at once
+
+Reads a manifest (YAML or JSON) listing the targets to upgrade and runs upgrade.upgrade_app (or configure.configure_app)
+for each of them without prompting, several at a time. The first targets are canaries: if any of them fail nothing
+else is changed. The remaining targets are upgraded in waves, stopping after any wave with a failure. Example manifest:
+
+  action: upgrade          # or configure, which configures each install_dir_path in place
+  concurrency: 8           # the maximum number of targets processed at once
+  canary: 1                # the number of targets processed (and required to succeed) before any others
+  wave_size: 10            # the number of targets per wave after the canaries, all of them if not set
+  build_indexes: false     # whether each upgrade builds missing indexes, only enable it for targets with separate DBs
+  values:                  # configuration values used for every target, as in an answers file
+    db_host: localhost
+  targets:
+    - install_dir_path: /srv/a/releases/1.1.0
+      app_symlink_path: /srv/a/app
+      values:              # configuration values for this target only
+        http_port: 27973
+
+Assumptions:
+- That the applications have been installed using install.py
+'''
+
+#!/usr/bin/python
+
+import argparse as argparse
+import json as json
+import sys as sys
+
+import lib.answers as answers
+import lib.fleet as fleet
+import configure as configure
+import upgrade as upgrade
+
+CONST_ACTIONS = ['upgrade', 'configure']
+
+def target_answers_dict(manifest_dict, target):
+  '''
+  Returns the answers dict for one target: the manifest-wide options and values, overridden by the target's own values
+  '''
+  target_answers = {'build_indexes': False}
+  target_answers.update([(key, value) for (key, value) in manifest_dict.items() if key not in ['targets', 'values']])
+  target_values = dict(manifest_dict.get('values') or {})
+  target_values.update(target.get('values') or {})
+  target_answers['values'] = target_values
+  return answers.answers_from_dict(target_answers)
+
+
+
+def build_task(manifest_dict, action):
+  '''
+  Returns a function that runs action for one target of manifest_dict
+  '''
+  def upgrade_target(target):
+    upgrade.upgrade_app(
+      install_dir_path=target['install_dir_path'],
+      app_symlink_path=target['app_symlink_path'],
+      answers_dict=target_answers_dict(manifest_dict, target)
+    )
+
+  def configure_target(target):
+    configure.configure_app(
+      current_value_install_dir=target['install_dir_path'],
+      output_value_install_dir=target['install_dir_path'],
+      answers_dict=target_answers_dict(manifest_dict, target)
+    )
+
+  if action == 'upgrade':
+    return upgrade_target
+  return configure_target
+
+
+
+def run_fleet(manifest_dict):
+  '''
+  Runs the manifest's action against each of its targets, returning a list of result dicts, one per target
+  '''
+  action = answers.get_option(manifest_dict, 'action', 'upgrade')
+  if action not in CONST_ACTIONS:
+    raise Exception(
+      'Error:\n' +
+      'Unknown fleet action "' + action + '", expected one of: ' + ', '.join(CONST_ACTIONS)
+    )
+  targets = answers.get_option(manifest_dict, 'targets')
+  for target in targets:
+    if 'install_dir_path' not in target or (action == 'upgrade' and 'app_symlink_path' not in target):
+      raise Exception(
+        'Error:\n' +
+        'Fleet target ' + repr(target) + ' does not have an install_dir_path and app_symlink_path'
+      )
+  return fleet.run_waves(
+    task=build_task(manifest_dict, action),
+    targets=targets,
+    concurrency=int(answers.get_option(manifest_dict, 'concurrency', 4)),
+    canary_count=int(answers.get_option(manifest_dict, 'canary', 1)),
+    wave_size=manifest_dict.get('wave_size')
+  )
+
+
+
+def print_results(results):
+  for result in results:
+    print(result['status'].upper().ljust(10) + ('%8.2fs  ' % result['seconds']) + result['target']['install_dir_path'])
+    if result['error'] is not None:
+      print('  ' + result['error'].replace('\n', '\n  '))
+
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Configures or upgrades many application install directories at once')
+  parser.add_argument('manifest', help='YAML or JSON fleet manifest')
+  parser.add_argument('--results', help='File to write the per-target results to as JSON')
+  args = parser.parse_args()
+
+  results = run_fleet(answers.load_data_file(args.manifest))
+  print('')
+  print('******************************************************************')
+  print('  FLEET RESULTS')
+  print('******************************************************************')
+  print_results(results)
+  if args.results is not None:
+    with open(args.results, 'w') as results_file:
+      json.dump(results, results_file, indent=2)
+  if any([result['status'] != fleet.CONST_SUCCEEDED for result in results]):
+    sys.exit(1)
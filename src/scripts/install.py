@@ -3,10 +3,15 @@ Installs the application to a server
 
 Installs the application to a server, using the current location of the extracted files as their final location (so
 extract the files from any install archive to where they should be installed first).
+- Restores the server and client dependencies from the dependency cache if they are missing
 - Guides user through configuration file changes
 - Sets up and configures the database and database schema
 - Executes further database-level tasks like index creation (optional)
+- Precompresses the static assets and writes their content-hash manifest
+- Generates the pm2 configuration from the host's CPUs and memory
+- Tunes the Postgres server's memory and parallelism settings for the host (optional)
 - Symlinks the desired application directory (e.g. /opt/login-fiddle/app) to the install location
+- Starts the application with pm2 (optional)
 
 Assumptions:
 - That the database engine is running and listening
@@ -14,27 +19,50 @@ Assumptions:
 
 #!/usr/bin/python
 
+import argparse as argparse
 import os as os
+import subprocess as subprocess
+import time as time
 import uuid as uuid
 
+import lib.answers as answers
+import lib.assets as assets
+import lib.checkpoints as checkpoints
+import lib.configstate as configstate
+import lib.db as db
+import lib.dbpool as dbpool
+import lib.depcache as depcache
+import lib.events as events
 import lib.general as general
+import lib.migrations as migrations
+import lib.pgtune as pgtune
+import lib.pm2 as pm2
+import lib.releases as releases
+import lib.seed as seed
 import configure as configure
 
+CONST_EVENT_LOG_REL_PATH = 'logs/deploy-events.jsonl'
+CONST_INSTALL_PHASE_IDS = [
+  'install_dependencies', 'configure', 'setup_database', 'initialise_schema', 'build_indexes', 'precompress_assets',
+  'configure_pm2', 'tune_database', 'create_app_symlink', 'register_pm2'
+]
 
 
-CONST_DB_CLEAR_COMMANDS = """
-sudo -u postgres dropdb {db.name}
-sudo -u postgres dropuser {db.user}
+
+CONST_DB_CLEAR_STATEMENTS = """
+DROP DATABASE IF EXISTS {db.name};
+DROP USER IF EXISTS {db.user};
 """
 
 
 
-CONST_DB_SETUP_COMMANDS_TEMPLATE = """
-sudo -u postgres psql -c "CREATE USER {db.user} WITH PASSWORD '{db.pw}';"
-sudo -u postgres psql -c "CREATE DATABASE {db.name} OWNER {db.user};"
-sudo -u postgres psql -c "GRANT ALL PRIVILEGES ON DATABASE {db.name} TO {db.user};"
-sudo -u postgres psql -c "CREATE SCHEMA {db.schema} AUTHORIZATION {db.user};" {db.name}
-sudo -u postgres psql -c 'CREATE EXTENSION "uuid-ossp" SCHEMA {db.schema};' {db.name}
+CONST_DB_SETUP_STATEMENTS_TEMPLATE = """
+CREATE USER {db.user} WITH PASSWORD '{db.pw}';
+CREATE DATABASE {db.name} OWNER {db.user};
+GRANT ALL PRIVILEGES ON DATABASE {db.name} TO {db.user};
+\\connect {db.name}
+CREATE SCHEMA {db.schema} AUTHORIZATION {db.user};
+CREATE EXTENSION "uuid-ossp" SCHEMA {db.schema};
 """
 
 CONST_INITIALISE_PR = """
@@ -90,11 +118,31 @@ pr.sq.sync({ force: true })
 .done();
 """
 
-CONST_DB_ADDITIONAL_COMMANDS = """
-sudo -u postgres psql -c "CREATE INDEX entry_tag_entry_ndx ON {db.schema}.entry_tag (entry_id);" {db.name}
-sudo -u postgres psql -c "CREATE INDEX entry_tag_tag_ndx ON {db.schema}.entry_tag (tag_id);" {db.name}
+CONST_SYNC_SCHEMA_PR = """
+'use strict';
+
+var pr = require('app/util/pr');
+
+pr.sq.sync({ force: true })
+.then(function() {
+  pr.sq.close();
+})
+.done();
 """
 
+# The indexes supporting the entry API's queries (see server/app/api/entry/router_impl.js) that Sequelize does not
+# create. The entry_tag join table's primary key is (tag_id, entry_id), as tag.belongsToMany is declared first (see
+# server/app/util/pr/entry.js), so it only serves lookups by tag_id: joining from entries needs an index on entry_id.
+# Tag lookups by value use the unique index on tag.value. Add an index here with the query that needs it, not before
+CONST_DB_INDEX_PLAN = [
+  {'name': 'entry_tag_entry_ndx', 'table': 'entry_tag', 'columns': ['entry_id']},
+]
+
+# The schema migrations applied by upgrade.py (see lib/migrations.py for the format), oldest first. Add a migration for
+# every model change so that upgraded databases end up with the schema that a new install creates from the models
+CONST_DB_MIGRATIONS = [
+]
+
 
 
 def prompt_for_install_directories():
@@ -104,7 +152,24 @@ def prompt_for_install_directories():
 
 
 
+def event_log_path(install_dir_path, answers_dict=None):
+  '''
+  Returns the path of the JSON-lines event log (see lib/events.py) for runs in install_dir_path, which can be overridden
+  by event_log_path in the answers file, e.g. to collect the timings of every release in one place
+  '''
+  default_event_log_path = os.path.join(install_dir_path, CONST_EVENT_LOG_REL_PATH)
+  return answers.get_option(answers_dict or {}, 'event_log_path', default_event_log_path)
+
+
+
 def read_db_configuration(install_dir_path):
+  '''
+  Returns (user, password, name, schema) of the install's database, from its configuration state (see
+  lib/configstate.py) or, if it has none, read from server/app/config/database.js
+  '''
+  saved_values = configstate.read_values_with(install_dir_path, ['db_user', 'db_password', 'db_name', 'db_schema'])
+  if saved_values is not None:
+    return tuple(saved_values)
   db_config_path = 'server/app/config/database.js'
   with open(os.path.join(install_dir_path, db_config_path), 'r') as db_config_file:
     curr_file_as_string = db_config_file.read()
@@ -114,16 +179,42 @@ def read_db_configuration(install_dir_path):
   schema = general.value_from_file_string('schema: \'([a-zA-Z_]*)\'', curr_file_as_string, db_config_path, 'Schema')
   return (user, pw, name, schema)
 
+def read_db_server_configuration(install_dir_path):
+  '''
+  Returns (host, port, pool max connections, pool min connections) of the install's database, from its configuration
+  state (see lib/configstate.py) or, if it has none, read from server/app/config/database.js
+  '''
+  saved_values = configstate.read_values_with(install_dir_path, ['db_host', 'db_port', 'db_max_conn', 'db_min_conn'])
+  if saved_values is not None:
+    return tuple(saved_values)
+  db_config_path = 'server/app/config/database.js'
+  with open(os.path.join(install_dir_path, db_config_path), 'r') as db_config_file:
+    curr_file_as_string = db_config_file.read()
+  host = general.value_from_file_string('host: \'([a-zA-Z_.]*)\'', curr_file_as_string, db_config_path, 'Host')
+  port = general.value_from_file_string('port: \'([\d]+)\'', curr_file_as_string, db_config_path, 'Port')
+  max_conn = general.value_from_file_string('maxConnections: (\d+)', curr_file_as_string, db_config_path, 'Max conn')
+  min_conn = general.value_from_file_string('minConnections: (\d+)', curr_file_as_string, db_config_path, 'Min conn')
+  return (host, port, max_conn, min_conn)
+
 
 
-def execute_shell_commands(commands_list):
-  for command in commands_list:
-    print('Executing: ' + command)
-    os.system(command)
+def install_dependencies(install_dir_path, answers_dict=None):
+  print('******************************************************************')
+  print('  INSTALLING DEPENDENCIES')
+  print('******************************************************************')
+  cache_dir_path = depcache.cache_dir_from_answers(answers_dict)
+  concurrency = int(answers.get_option(answers_dict or {}, 'dependency_concurrency', 4))
+  for dependency_set in depcache.CONST_DEPENDENCY_SETS:
+    outcome = depcache.install_dependency_set(install_dir_path, dependency_set, cache_dir_path, concurrency)
+    print(dependency_set['dir_rel_path'] + ': ' + outcome + ' (' + cache_dir_path + ')')
+  print('******************************************************************')
+  print('')
+  print('')
+  print('')
 
 
 
-def setup_database(install_dir_path):
+def setup_database(install_dir_path, answers_dict=None):
   print('******************************************************************')
   print('  SETTING UP DATABASE')
   print('******************************************************************')
@@ -132,17 +223,22 @@ def setup_database(install_dir_path):
   # Read DB configuration from server/app/config/database.js
   (user, pw, name, schema) = read_db_configuration(install_dir_path)
 
-  if general.prompt_for_confirm('Drop existing DB schema and user?', None):
-    db_clear_commands = CONST_DB_CLEAR_COMMANDS \
+  if answers_dict is not None:
+    drop_existing_db = answers.get_option(answers_dict, 'drop_existing_db', False)
+  else:
+    drop_existing_db = general.prompt_for_confirm('Drop existing DB schema and user?', None)
+  if drop_existing_db:
+    db_clear_statements = CONST_DB_CLEAR_STATEMENTS \
       .replace('{db.user}', user) \
       .replace('{db.name}', name) \
       .strip() \
       .split('\n')
 
-    execute_shell_commands(db_clear_commands)
+    with events.step('clear_database'):
+      db.execute_statements(db_clear_statements, psql_command=db.psql_command_from_answers(answers_dict))
 
-  # Generate and write DB creation shell script
-  db_setup_commands = CONST_DB_SETUP_COMMANDS_TEMPLATE \
+  # Generate the DB creation statements, CREATE DATABASE cannot run in a transaction so they are not transactional
+  db_setup_statements = CONST_DB_SETUP_STATEMENTS_TEMPLATE \
     .replace('{db.user}', user) \
     .replace('{db.pw}', pw) \
     .replace('{db.name}', name) \
@@ -150,8 +246,9 @@ def setup_database(install_dir_path):
     .strip() \
     .split('\n')
 
-  # Execute the DB setup commands
-  execute_shell_commands(db_setup_commands)
+  # Execute the DB setup statements in one psql session
+  with events.step('create_database'):
+    db.execute_statements(db_setup_statements, psql_command=db.psql_command_from_answers(answers_dict))
 
   print('******************************************************************')
   print('')
@@ -160,10 +257,15 @@ def setup_database(install_dir_path):
 
 
 
-def initialise_schema(install_dir_path):
+def initialise_schema(install_dir_path, answers_dict=None):
+  '''
+  Creates the schema's tables and loads the sample data. If the answers file has a "seed" dict (of entries, tags and
+  optionally fanout, distribution and random_seed, see lib/seed.py), synthetic data is bulk loaded instead
+  '''
   print('******************************************************************')
   print('  INITIALISING DB SCHEMA')
   print('******************************************************************')
+  seed_options = answers.get_option(answers_dict or {}, 'seed', {})
 
   # Write initialise PR script to a temp file in server application directory
   temp_nodefile_file_path = 'TEMP-' + str(uuid.uuid4()) + '-initialise-pr.js'
@@ -175,22 +277,48 @@ def initialise_schema(install_dir_path):
     temp_nodefile_file_path
   )
   with open(temp_nodefile_full_path, 'w') as temp_nodefile_file:
-    temp_nodefile_file.write(CONST_INITIALISE_PR)
-
-  # Run the file as a node server script from a directory with a logs directory
-  #
-  cwd = os.getcwd()
-  print('Changing working directory to ' + install_dir_path)
-  os.chdir(install_dir_path)
-  initialise_pr_command = 'node ' + os.path.join('server', 'app', temp_nodefile_file_path)
-  print('Executing : ' + initialise_pr_command)
-  os.system(initialise_pr_command)
-  print('Restoring working directory to ' + cwd)
-  os.chdir(cwd)
+    temp_nodefile_file.write(CONST_SYNC_SCHEMA_PR if seed_options else CONST_INITIALISE_PR)
+
+  # Run the file as a node server script from a directory with a logs directory, without changing this process's working
+  # directory as other phases may be running at the same time
+  initialise_pr_command = ['node', os.path.join('server', 'app', temp_nodefile_file_path)]
+  print('Executing in ' + install_dir_path + ': ' + ' '.join(initialise_pr_command))
+  with events.step('sync_schema'):
+    start_time = time.time()
+    exit_status = subprocess.call(initialise_pr_command, cwd=install_dir_path)
+    events.record_subprocess(initialise_pr_command, exit_status, time.time() - start_time)
 
   # Delete the temporarily generated file
   print('Deleting ' + temp_nodefile_full_path)
   os.unlink(temp_nodefile_full_path)
+  if exit_status != 0:
+    raise Exception(
+      'Error:\n' +
+      'Initialising the DB schema failed, node exited with status ' + str(exit_status)
+    )
+
+  (user, pw, name, schema) = read_db_configuration(install_dir_path)
+  with events.step('stamp_migrations'):
+    migrations.stamp(
+      migrations=CONST_DB_MIGRATIONS,
+      user=user,
+      schema=schema,
+      database=name,
+      psql_command=db.psql_command_from_answers(answers_dict)
+    )
+
+  if seed_options:
+    with events.step('seed'):
+      seed.seed_database(
+        schema=schema,
+        database=name,
+        entry_count=int(answers.get_option(seed_options, 'entries')),
+        tag_count=int(answers.get_option(seed_options, 'tags')),
+        fanout_mean=float(answers.get_option(seed_options, 'fanout', 2.0)),
+        tag_distribution=answers.get_option(seed_options, 'distribution', 'zipf'),
+        random_seed=int(answers.get_option(seed_options, 'random_seed', 0)),
+        psql_command=db.psql_command_from_answers(answers_dict)
+      )
 
   print('******************************************************************')
   print('')
@@ -199,22 +327,37 @@ def initialise_schema(install_dir_path):
 
 
 
-def execute_additional_db_tasks(install_dir_path):
+def execute_additional_db_tasks(install_dir_path, answers_dict=None):
   print('******************************************************************')
   print('  EXECUTING ADDITIONAL DB TASKS')
   print('******************************************************************')
   (user, pw, name, schema) = read_db_configuration(install_dir_path)
 
-  db_additional_commands = CONST_DB_ADDITIONAL_COMMANDS \
-    .replace('{db.user}', user) \
-    .replace('{db.pw}', pw) \
-    .replace('{db.name}', name) \
-    .replace('{db.schema}', schema) \
-    .strip() \
-    .split('\n')
+  db.build_indexes(
+    index_plan=CONST_DB_INDEX_PLAN,
+    schema=schema,
+    database=name,
+    psql_command=db.psql_command_from_answers(answers_dict),
+    concurrency=int(answers.get_option(answers_dict or {}, 'index_build_concurrency', 2))
+  )
+
+  print('******************************************************************')
+  print('')
+  print('')
+  print('')
 
-  execute_shell_commands(db_additional_commands)
 
+
+def precompress_assets(install_dir_path, answers_dict=None):
+  print('******************************************************************')
+  print('  PRECOMPRESSING STATIC ASSETS')
+  print('******************************************************************')
+  concurrency = (answers_dict or {}).get('asset_compression_concurrency')
+  manifest = assets.precompress_assets(
+    install_dir_path=install_dir_path,
+    concurrency=int(concurrency) if concurrency is not None else None
+  )
+  assets.print_manifest_summary(manifest)
   print('******************************************************************')
   print('')
   print('')
@@ -222,14 +365,172 @@ def execute_additional_db_tasks(install_dir_path):
 
 
 
+def migrate_database(install_dir_path, answers_dict=None, dry_run=False):
+  '''
+  Applies the schema migrations (see CONST_DB_MIGRATIONS) that the install's database has not had yet, after showing
+  them and, if prompting, asking to confirm. If dry_run, only shows them
+  '''
+  print('******************************************************************')
+  print('  MIGRATING DB SCHEMA' + (' (DRY RUN)' if dry_run else ''))
+  print('******************************************************************')
+  (user, pw, name, schema) = read_db_configuration(install_dir_path)
+  psql_command = db.psql_command_from_answers(answers_dict)
+  pending = migrations.plan(CONST_DB_MIGRATIONS, schema, name, psql_command)
+  if pending and not dry_run:
+    if answers_dict is None and not general.prompt_for_confirm('Apply these migrations?', None):
+      raise Exception(
+        'Error:\n' +
+        'Migrations not applied'
+      )
+    migrations.apply(
+      pending=pending,
+      user=user,
+      schema=schema,
+      database=name,
+      psql_command=psql_command,
+      lock_timeout_ms=int(answers.get_option(answers_dict or {}, 'migration_lock_timeout_ms',
+        migrations.CONST_LOCK_TIMEOUT_MS))
+    )
+  print('******************************************************************')
+  print('')
+  print('')
+  print('')
+
+
+
+def check_db_pool_fits_workers(install_dir_path, workers, answers_dict=None):
+  '''
+  Raises an error if workers pm2 workers, each with the install's DB pool, would exhaust the DB server's connections.
+  Only warns if the server's limits could not be read
+  '''
+  (host, port, max_conn, min_conn) = read_db_server_configuration(install_dir_path)
+  (max_connections, reserved_connections, limits_source) = dbpool.server_connection_limits(
+    host,
+    port,
+    db.psql_command_from_answers(answers_dict)
+  )
+  errors = dbpool.enforced_errors(
+    dbpool.pool_errors(workers, int(max_conn), int(min_conn), max_connections, reserved_connections),
+    limits_source
+  )
+  if errors:
+    raise Exception(
+      'Error:\n' +
+      'The pm2 instances would exhaust the DB server\'s connections, reduce them or the DB pool:\n' +
+      '\n'.join(errors)
+    )
+
+
+
+def prompt_for_pm2_settings(settings):
+  print('- instances:          ' + str(settings['instances']))
+  print('- max_memory_restart: ' + str(settings['max_memory_restart']))
+  print('- watch:              ' + str(settings['watch']))
+  print('- kill_timeout:       ' + str(settings['kill_timeout']) + 'ms')
+  print('- listen_timeout:     ' + str(settings['listen_timeout']) + 'ms')
+  if general.prompt_for_confirm('Use these pm2 settings?', True):
+    return settings
+  return pm2.settings_with_overrides(settings, {
+    'instances': int(general.prompt_for_text('Number of instances: ', str(settings['instances']), '^[1-9]\d*$')),
+    'max_memory_restart': general.prompt_for_text('Restart an instance above memory: ', settings['max_memory_restart'],
+      '^\d+[KMG]$'),
+    'watch': general.prompt_for_confirm('Watch server/app for changes (not recommended in production)?', False)
+  })
+
+def configure_pm2(install_dir_path, app_symlink_path, answers_dict=None):
+  '''
+  Generates the install's pm2 configuration from this host's CPUs and memory, overridden by the pm2 dict in the answers
+  file (see lib/pm2.py for the settings) or confirmed by the user. Returns the path of the configuration file
+  '''
+  print('******************************************************************')
+  print('  GENERATING PM2 CONFIGURATION')
+  print('******************************************************************')
+  (cpu_count, memory_bytes) = pm2.host_resources()
+  settings = pm2.recommended_settings(cpu_count, memory_bytes)
+  print('Host has ' + str(cpu_count) + ' CPU(s) and ' + str(memory_bytes / (1024 * 1024)) + 'MB of memory')
+  if answers_dict is not None:
+    settings = pm2.settings_with_overrides(settings, answers.get_option(answers_dict, 'pm2', {}))
+  else:
+    print('Recommended pm2 settings:')
+    settings = prompt_for_pm2_settings(settings)
+  check_db_pool_fits_workers(install_dir_path, int(settings['instances']), answers_dict)
+  pm2_config = pm2.build_config(pm2.read_config(install_dir_path), settings, app_symlink_path.rstrip(os.sep))
+  (pm2_config_path, written) = pm2.write_config(install_dir_path, pm2_config)
+  print(('Wrote: ' if written else 'Unchanged: ') + pm2_config_path)
+  print('******************************************************************')
+  print('')
+  print('')
+  print('')
+  return pm2_config_path
+
+def register_pm2(pm2_config_path, answers_dict=None):
+  '''
+  Starts or gracefully reloads the application with pm2 if pm2_register is set in the answers file or the user confirms
+  '''
+  if answers_dict is not None:
+    register = answers.get_option(answers_dict, 'pm2_register', False)
+  else:
+    register = general.prompt_for_confirm('Start or reload the application with pm2 now?', False)
+  if register:
+    pm2.register_config(pm2_config_path, pm2.pm2_command_from_answers(answers_dict))
+
+
+
+def tune_database(install_dir_path, answers_dict=None):
+  '''
+  Shows the Postgres settings recommended for this host, its pm2 instances and their DB pools (see lib/pgtune.py) and
+  applies them if tune_database is set in the answers file or the user confirms. Does nothing if the DB server is on
+  another host, as this host's resources say nothing about it
+  '''
+  print('******************************************************************')
+  print('  TUNING DB SERVER')
+  print('******************************************************************')
+  (host, port, max_conn, min_conn) = read_db_server_configuration(install_dir_path)
+  if host not in ['localhost', '127.0.0.1']:
+    print('The DB server is on ' + host + ', not tuning it from this host')
+  else:
+    (cpu_count, memory_bytes) = pm2.host_resources()
+    workers = int(pm2.read_config(install_dir_path)['instances'])
+    connections = workers * int(max_conn) + dbpool.CONST_HEADROOM_CONNECTIONS
+    print('Host has ' + str(cpu_count) + ' CPU(s) and ' + str(memory_bytes / (1024 * 1024)) + 'MB of memory, ' +
+      str(workers) + ' pm2 instance(s) with up to ' + max_conn + ' DB connection(s) each')
+    psql_command = db.psql_command_from_answers(answers_dict)
+    changes = pgtune.settings_diff(
+      pgtune.current_settings(psql_command),
+      pgtune.recommend_settings(cpu_count, memory_bytes, connections)
+    )
+    pgtune.print_diff(changes)
+    if answers_dict is not None:
+      apply_changes = answers.get_option(answers_dict, 'tune_database', False)
+    else:
+      apply_changes = bool(changes) and general.prompt_for_confirm('Apply these settings to the DB server?', False)
+    if changes and apply_changes:
+      pgtune.apply_changes(changes, psql_command)
+    elif changes:
+      print('Not applying the settings' + (', set tune_database: true to' if answers_dict is not None else ''))
+  print('******************************************************************')
+  print('')
+  print('')
+  print('')
+
+
+
+def symlink_points_to(symlink_path, target_path):
+  return os.path.islink(symlink_path.rstrip(os.sep)) and \
+    os.path.realpath(symlink_path) == os.path.realpath(target_path)
+
 def create_app_symlink(install_dir_path, app_symlink_path):
   print('******************************************************************')
   print('  CREATING APP SYMLINK')
   print('******************************************************************')
 
-  if not os.path.exists(os.path.dirname(app_symlink_path)):
-    os.makedirs(os.path.dirname(app_symlink_path))
-  os.symlink(install_dir_path, app_symlink_path)
+  if symlink_points_to(app_symlink_path, install_dir_path):
+    print('App symlink already points to ' + install_dir_path + ' (resumed install)')
+  else:
+    if not os.path.exists(os.path.dirname(app_symlink_path)):
+      os.makedirs(os.path.dirname(app_symlink_path))
+    os.symlink(install_dir_path, app_symlink_path)
+    releases.record_release(app_symlink_path, install_dir_path)
 
   print('******************************************************************')
   print('')
@@ -238,15 +539,134 @@ def create_app_symlink(install_dir_path, app_symlink_path):
 
 
 
-def install_app(install_dir_path, app_symlink_path):
+def read_file_if_exists(file_path):
+  if not os.path.isfile(file_path):
+    return None
+  with open(file_path, 'r') as existing_file:
+    return existing_file.read()
+
+def install_phases(install_dir_path, app_symlink_path, answers_dict=None):
+  '''
+  Returns the install phases (see lib/checkpoints.py), in order. The inputs of each phase are what, if changed, mean it
+  has to be run again: the answers it uses and the configuration files it reads. A phase runs after the phases whose
+  files or database objects it uses; interactive installs prompt in several phases, so every phase then needs the
+  console and they run one at a time
+  '''
+  def answer(key):
+    return (answers_dict or {}).get(key)
+
+  def db_configuration_inputs():
+    return list(read_db_configuration(install_dir_path))
+
+  resources = ['console'] if answers_dict is None else []
+  pm2_config_path = os.path.join(install_dir_path, pm2.CONST_PM2_CONFIG_REL_PATH)
+  database_config_path = os.path.join(install_dir_path, 'server', 'app', 'config', 'database.js')
+  return [
+    {
+      'id': 'install_dependencies',
+      'after': [],
+      'resources': resources,
+      'inputs': lambda: [depcache.dependency_key(install_dir_path, dependency_set)
+        for dependency_set in depcache.CONST_DEPENDENCY_SETS] + [depcache.cache_dir_from_answers(answers_dict)],
+      'run': lambda: install_dependencies(install_dir_path=install_dir_path, answers_dict=answers_dict)
+    },
+    {
+      'id': 'configure',
+      'after': [],
+      'resources': resources,
+      'inputs': lambda: answer('values'),
+      'run': lambda: configure.configure_app(
+        current_value_install_dir=install_dir_path,
+        output_value_install_dir=install_dir_path,
+        answers_dict=answers_dict
+      )
+    },
+    {
+      'id': 'setup_database',
+      'after': ['configure'],
+      'resources': resources,
+      'inputs': lambda: [db_configuration_inputs(), answer('drop_existing_db')],
+      'run': lambda: setup_database(install_dir_path=install_dir_path, answers_dict=answers_dict)
+    },
+    {
+      'id': 'initialise_schema',
+      'after': ['install_dependencies', 'setup_database'],
+      'resources': resources,
+      'inputs': lambda: [db_configuration_inputs(), answer('seed')],
+      'run': lambda: initialise_schema(install_dir_path=install_dir_path, answers_dict=answers_dict)
+    },
+    {
+      'id': 'build_indexes',
+      'after': ['initialise_schema'],
+      'resources': resources,
+      'inputs': lambda: [db_configuration_inputs(), CONST_DB_INDEX_PLAN],
+      'run': lambda: execute_additional_db_tasks(install_dir_path=install_dir_path, answers_dict=answers_dict)
+    },
+    {
+      'id': 'precompress_assets',
+      'after': ['install_dependencies', 'configure'],
+      'resources': resources,
+      'inputs': lambda: [assets.CONST_STATIC_ROOTS, assets.CONST_COMPRESS_LEVEL],
+      'run': lambda: precompress_assets(install_dir_path=install_dir_path, answers_dict=answers_dict)
+    },
+    {
+      'id': 'configure_pm2',
+      'after': ['configure'],
+      'resources': resources,
+      'inputs': lambda: [read_file_if_exists(database_config_path), answer('pm2'), list(pm2.host_resources())],
+      'run': lambda: configure_pm2(
+        install_dir_path=install_dir_path,
+        app_symlink_path=app_symlink_path,
+        answers_dict=answers_dict
+      )
+    },
+    {
+      'id': 'tune_database',
+      'after': ['setup_database', 'configure_pm2'],
+      'resources': resources,
+      'inputs': lambda: [read_file_if_exists(database_config_path), read_file_if_exists(pm2_config_path),
+        answer('tune_database'), list(pm2.host_resources())],
+      'run': lambda: tune_database(install_dir_path=install_dir_path, answers_dict=answers_dict)
+    },
+    {
+      'id': 'create_app_symlink',
+      'after': ['build_indexes', 'precompress_assets', 'configure_pm2', 'tune_database'],
+      'resources': resources,
+      'inputs': lambda: app_symlink_path,
+      'run': lambda: create_app_symlink(install_dir_path=install_dir_path, app_symlink_path=app_symlink_path)
+    },
+    {
+      'id': 'register_pm2',
+      'after': ['create_app_symlink'],
+      'resources': resources,
+      'inputs': lambda: [read_file_if_exists(pm2_config_path), answer('pm2_register')],
+      'run': lambda: register_pm2(pm2_config_path=pm2_config_path, answers_dict=answers_dict)
+    }
+  ]
+
+def install_app(install_dir_path, app_symlink_path, answers_dict=None, from_phase=None):
   '''
   Installs the application by executing the following process:
-  - (0) Check install_dir_path exists and app_symlink_path doesn't
-  - (1) Guide user through configuration file changes
-  - (2) Initialise the DB, creating users and schema
-  - (3) Set up the database schema
-  - (4) Executes additional database level tasks (like index creation for improved performance)
-  - (5) Symlinks the install directory to the target application directory
+  - (0) Check install_dir_path exists and app_symlink_path doesn't (or already points to install_dir_path)
+  - (1) install_dependencies: Restores missing dependencies from the dependency cache, or installs and caches them
+  - (2) configure: Guide user through configuration file changes
+  - (3) setup_database: Initialise the DB, creating users and schema
+  - (4) initialise_schema: Set up the database schema and record the schema migrations as applied
+  - (5) build_indexes: Executes additional database level tasks (like index creation for improved performance)
+  - (6) precompress_assets: Writes the static assets' .gz siblings and content-hash manifest
+  - (7) configure_pm2: Generates the pm2 configuration for this host
+  - (8) tune_database: Shows and optionally applies the Postgres settings recommended for this host
+  - (9) create_app_symlink: Symlinks the install directory to the target application directory
+  - (10) register_pm2: Optionally starts the application with pm2
+
+  Phases run as soon as the phases they depend on have finished (see install_phases), so (1) and (2) run at the same
+  time, as do (6) and (7) alongside the database phases (3) - (5) and (8) alongside (4) and (5), up to
+  phase_concurrency phases at a time. Each phase is checkpointed (see lib/checkpoints.py): if the install fails,
+  running it again skips the phases that succeeded with the same inputs and resumes at the one that failed. from_phase
+  forces the install to run from that phase onwards instead.
+
+  If answers_dict (see lib/answers.py) is given, nothing is prompted for and all configuration values are validated
+  before any changes are made
   '''
   # (0)
   if not os.path.exists(install_dir_path):
@@ -254,56 +674,51 @@ def install_app(install_dir_path, app_symlink_path):
       'Error:\n' +
       'Install directory path does not exist: "' + install_dir_path + '"'
     )
-  if os.path.lexists(app_symlink_path):
+  if os.path.lexists(app_symlink_path) and not symlink_points_to(app_symlink_path, install_dir_path):
     raise Exception(
       'Error:\n' +
       'App symlink already exists: "' + app_symlink_path + '"'
     )
 
-  # (1)
-  configure.configure_app(
-    current_value_install_dir=install_dir_path,
-    output_value_install_dir=install_dir_path
-  )
-
-  # (2)
-  setup_database(
-    install_dir_path=install_dir_path
-  )
-
-  # (3)
-  initialise_schema(
-    install_dir_path=install_dir_path
-  )
-
-  # (4)
-  execute_additional_db_tasks(
-    install_dir_path=install_dir_path
-  )
-
-  # (5)
-  create_app_symlink(
-    install_dir_path=install_dir_path,
-    app_symlink_path=app_symlink_path
-  )
+  # (1) - (10)
+  with events.run(event_log_path(install_dir_path, answers_dict), 'install'):
+    checkpoints.run_phases(
+      install_dir_path=install_dir_path,
+      phases=install_phases(install_dir_path, app_symlink_path, answers_dict),
+      from_phase=from_phase,
+      concurrency=int(answers.get_option(answers_dict or {}, 'phase_concurrency', 4))
+    )
 
 
 
 if __name__ == '__main__':
-  print('NB: Usually the application install directory is the parent of directory of this script')
-
-  (install_dir_path, app_symlink_path) = prompt_for_install_directories()
-  while not general.prompt_for_confirm('Is this correct?', False):
+  parser = argparse.ArgumentParser(description='Installs the application to a server')
+  parser.add_argument('--answers', help='YAML or JSON answers file to install from without prompting')
+  parser.add_argument('--from-phase', choices=CONST_INSTALL_PHASE_IDS,
+    help='Run the install from this phase onwards, even if it and later phases already succeeded')
+  args = parser.parse_args()
+
+  answers_dict = None
+  if args.answers is not None:
+    answers_dict = answers.load_answers(args.answers)
+    install_dir_path = answers.get_option(answers_dict, 'install_dir_path')
+    app_symlink_path = answers.get_option(answers_dict, 'app_symlink_path')
+  else:
+    print('NB: Usually the application install directory is the parent of directory of this script')
     (install_dir_path, app_symlink_path) = prompt_for_install_directories()
+    while not general.prompt_for_confirm('Is this correct?', False):
+      (install_dir_path, app_symlink_path) = prompt_for_install_directories()
 
   print('\nYou have entered:')
   print('- application install directory path: ' + install_dir_path)
   print('- application symlink path:           ' + app_symlink_path)
-  if general.prompt_for_confirm('Is this correct?', None):
+  if answers_dict is not None or general.prompt_for_confirm('Is this correct?', None):
     print('')
     install_app(
       install_dir_path=install_dir_path,
-      app_symlink_path=app_symlink_path
+      app_symlink_path=app_symlink_path,
+      answers_dict=answers_dict,
+      from_phase=args.from_phase
     )
     print('')
     print('')
@@ -0,0 +1,106 @@
+'''
+Answers files let configure.py, install.py and upgrade.py run without prompting
+
+An answers file is a YAML (.yaml, .yml) or JSON (.json) file holding the options a script would otherwise prompt for,
+e.g. install_dir_path, and a "values" dict of {valkey: value} for the configuration inputs in configure.yaml. Inputs
+that are not answered keep their current value. Any value can be overridden with an environment variable named
+LOGIN_FIDDLE_VALUE_<VALKEY>, e.g. LOGIN_FIDDLE_VALUE_DB_PASSWORD
+'''
+
+import json as json
+import os as os
+import os.path as path
+
+CONST_ENV_VALUE_PREFIX = 'LOGIN_FIDDLE_VALUE_'
+
+def load_data_file(filepath):
+  '''
+  Loads a YAML or JSON file, chosen by its extension. yaml is only imported when a YAML file is loaded
+  '''
+  if not path.isfile(filepath):
+    raise Exception(
+      'Error:\n' +
+      '"' + filepath + '" does not exist'
+    )
+  extension = path.splitext(filepath)[1].lower()
+  with open(filepath, 'r') as data_file:
+    if extension == '.json':
+      return json.load(data_file)
+    elif extension in ['.yaml', '.yml']:
+      import yaml as yaml
+      return yaml.safe_load(data_file)
+    else:
+      raise Exception(
+        'Error:\n' +
+        '"' + filepath + '" is not a .json, .yaml or .yml file'
+      )
+
+
+
+def value_to_string(value):
+  '''
+  Converts a value loaded from YAML or JSON to the string written to the configuration files, so that e.g. YAML true is
+  written as the JavaScript literal true rather than Python's True
+  '''
+  if isinstance(value, bool):
+    return 'true' if value else 'false'
+  elif isinstance(value, basestring):
+    return value
+  else:
+    return str(value)
+
+
+
+def load_answers(answers_filepath, environ=None):
+  '''
+  Loads an answers file and applies environment variable overrides, returning a dict of {option: value} with the
+  configuration input values as a {valkey: value string} dict under "values"
+  '''
+  answers_dict = load_data_file(answers_filepath)
+  if answers_dict is None:
+    answers_dict = {}
+  if not isinstance(answers_dict, dict):
+    raise Exception(
+      'Error:\n' +
+      '"' + answers_filepath + '" does not contain a dict of answers'
+    )
+  return answers_from_dict(answers_dict, environ)
+
+
+
+def answers_from_dict(answers_dict, environ=None):
+  '''
+  Returns a copy of answers_dict with its "values" converted to strings and environment variable overrides applied
+  '''
+  if environ is None:
+    environ = os.environ
+  answer_values = {}
+  for (valkey, value) in (answers_dict.get('values') or {}).items():
+    answer_values[valkey] = value_to_string(value)
+  for (env_key, value) in environ.items():
+    if env_key.startswith(CONST_ENV_VALUE_PREFIX):
+      answer_values[env_key[len(CONST_ENV_VALUE_PREFIX):].lower()] = value
+  answers_dict = dict(answers_dict)
+  answers_dict['values'] = answer_values
+  return answers_dict
+
+
+
+def get_option(answers_dict, key, default=None):
+  '''
+  Returns the answer for option key, or default if it is not answered. Options without a default must be answered
+  '''
+  if key in answers_dict:
+    return answers_dict[key]
+  elif default is not None:
+    return default
+  else:
+    raise Exception(
+      'Error:\n' +
+      'The answers file does not answer "' + key + '"'
+    )
+
+
+
+if __name__ == '__main__':
+  print('This file is not configured to be run separately; tests will come at a later date')
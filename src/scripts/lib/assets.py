@@ -0,0 +1,176 @@
+'''
+Precompresses the client's static assets and writes their content-hash manifest
+
+The server gzips every static response on the fly. Instead, each compressible file under the static roots gets a .gz
+sibling compressed once at the maximum level, and client/asset-manifest.json records every static file's content hash
+and whether it has a .gz sibling. The server (see server/app/util/static_assets.js) serves the .gz bytes to clients that
+accept gzip, and adds the content hash to the asset URLs in index.html so that they can be cached for a year: a changed
+file gets a new URL.
+
+The .gz files are written with a zero timestamp so that they only change when their source does, and files whose hash
+is unchanged since the last manifest are not compressed again. A static file rewritten after the manifest was written
+(e.g. client/js/main.js by configure.py) must be refreshed with refresh_assets, or its stale .gz and hash are served
+'''
+
+import gzip as gzip
+import hashlib as hashlib
+import json as json
+import multiprocessing as multiprocessing
+import os as os
+import StringIO as StringIO
+
+import events as events
+import fleet as fleet
+import general as general
+
+CONST_CLIENT_REL_PATH = 'client'
+CONST_STATIC_ROOTS = ['assets', 'js', 'bower_components'] # relative to the client, served at /<root>
+CONST_MANIFEST_REL_PATH = 'client/asset-manifest.json'
+CONST_MANIFEST_VERSION = 1
+CONST_HASH_LENGTH = 16
+
+CONST_COMPRESS_LEVEL = 9
+CONST_MIN_COMPRESS_BYTES = 1024 # smaller responses fit in a packet anyway
+CONST_MAX_COMPRESSED_RATIO = 0.9 # keep a .gz only if it saves at least 10%
+CONST_COMPRESSIBLE_EXTENSIONS = ['.css', '.eot', '.html', '.ico', '.js', '.json', '.map', '.md', '.otf', '.svg',
+  '.ttf', '.txt', '.xml']
+
+def static_files(client_dir_path):
+  '''
+  Returns the paths of every static file under the static roots of client_dir_path, relative to it and sorted, except
+  .gz files
+  '''
+  rel_paths = []
+  for root in CONST_STATIC_ROOTS:
+    for (dir_path, dir_names, file_names) in os.walk(os.path.join(client_dir_path, root)):
+      dir_names.sort()
+      for file_name in file_names:
+        if not file_name.endswith('.gz'):
+          rel_paths.append(os.path.relpath(os.path.join(dir_path, file_name), client_dir_path))
+  return sorted(rel_paths)
+
+def is_compressible(rel_path, byte_count):
+  return os.path.splitext(rel_path)[1].lower() in CONST_COMPRESSIBLE_EXTENSIONS and \
+    byte_count >= CONST_MIN_COMPRESS_BYTES
+
+def gzip_string(file_as_string):
+  '''
+  Returns file_as_string gzipped at the maximum level, with a zero timestamp so that the result only depends on it
+  '''
+  gzip_buffer = StringIO.StringIO()
+  gzip_file = gzip.GzipFile(filename='', mode='wb', compresslevel=CONST_COMPRESS_LEVEL, fileobj=gzip_buffer, mtime=0)
+  try:
+    gzip_file.write(file_as_string)
+  finally:
+    gzip_file.close()
+  return gzip_buffer.getvalue()
+
+
+
+def read_manifest(install_dir_path):
+  '''
+  Returns the asset manifest of install_dir_path, or an empty one if there isn't one
+  '''
+  manifest_path = os.path.join(install_dir_path, CONST_MANIFEST_REL_PATH)
+  if not os.path.isfile(manifest_path):
+    return {'version': CONST_MANIFEST_VERSION, 'assets': {}}
+  with open(manifest_path, 'r') as manifest_file:
+    manifest = json.load(manifest_file)
+  if manifest.get('version') != CONST_MANIFEST_VERSION:
+    return {'version': CONST_MANIFEST_VERSION, 'assets': {}}
+  return manifest
+
+def process_asset(client_dir_path, rel_path, previous_entry):
+  '''
+  Hashes the static file at rel_path and, if it is compressible, writes its .gz sibling unless it is unchanged since
+  previous_entry (its entry in the last manifest, or None). Returns its manifest entry
+  '''
+  file_path = os.path.join(client_dir_path, rel_path)
+  gzip_path = file_path + '.gz'
+  with open(file_path, 'rb') as asset_file:
+    file_as_string = asset_file.read()
+  entry = {
+    'hash': hashlib.sha256(file_as_string).hexdigest()[:CONST_HASH_LENGTH],
+    'bytes': len(file_as_string),
+    'gzip_bytes': None
+  }
+  if previous_entry is not None and previous_entry['hash'] == entry['hash'] and \
+    (previous_entry['gzip_bytes'] is None or os.path.isfile(gzip_path)):
+    entry['gzip_bytes'] = previous_entry['gzip_bytes']
+    return entry
+  if is_compressible(rel_path, len(file_as_string)):
+    gzip_as_string = gzip_string(file_as_string)
+    if len(gzip_as_string) <= len(file_as_string) * CONST_MAX_COMPRESSED_RATIO:
+      general.write_file_if_changed(gzip_path, gzip_as_string)
+      entry['gzip_bytes'] = len(gzip_as_string)
+  if entry['gzip_bytes'] is None and previous_entry is not None and previous_entry['gzip_bytes'] is not None and \
+    os.path.isfile(gzip_path):
+    os.remove(gzip_path) # written by an earlier run, and no longer worth serving
+  return entry
+
+def precompress_assets(install_dir_path, concurrency=None):
+  '''
+  Writes the .gz siblings of the static assets of install_dir_path, up to concurrency (default: the CPU count) at a
+  time, and then its asset manifest. Returns the manifest
+  '''
+  if concurrency is None:
+    concurrency = multiprocessing.cpu_count()
+  client_dir_path = os.path.join(install_dir_path, CONST_CLIENT_REL_PATH)
+  previous_assets = read_manifest(install_dir_path)['assets']
+  rel_paths = static_files(client_dir_path)
+  assets = {}
+
+  events_context = events.current_context()
+  def process(rel_path):
+    with events.attach(events_context):
+      assets['/' + rel_path.replace(os.sep, '/')] = process_asset(client_dir_path, rel_path,
+        previous_assets.get('/' + rel_path.replace(os.sep, '/')))
+
+  results = fleet.run_waves(process, rel_paths, concurrency, canary_count=0)
+  failures = [result for result in results if result['status'] != fleet.CONST_SUCCEEDED]
+  if failures:
+    raise Exception(
+      'Error:\n' +
+      'Could not precompress asset(s):\n' +
+      '\n'.join([failure['target'] + ': ' + failure['error'] for failure in failures])
+    )
+
+  manifest = {'version': CONST_MANIFEST_VERSION, 'assets': assets}
+  general.write_file_if_changed(os.path.join(install_dir_path, CONST_MANIFEST_REL_PATH),
+    json.dumps(manifest, indent=2, separators=(',', ': '), sort_keys=True) + '\n')
+  return manifest
+
+def refresh_assets(install_dir_path, file_paths):
+  '''
+  Rehashes and recompresses (see process_asset) those of file_paths that are static files of install_dir_path and
+  updates their entries in its asset manifest. Returns the URL paths refreshed. Does nothing if there is no manifest,
+  as the static roots are then served as they are
+  '''
+  manifest_path = os.path.join(install_dir_path, CONST_MANIFEST_REL_PATH)
+  if not os.path.isfile(manifest_path):
+    return []
+  client_dir_path = os.path.realpath(os.path.join(install_dir_path, CONST_CLIENT_REL_PATH))
+  manifest = read_manifest(install_dir_path)
+  refreshed_url_paths = []
+  for file_path in file_paths:
+    rel_path = os.path.relpath(os.path.realpath(file_path), client_dir_path)
+    if rel_path.split(os.sep)[0] not in CONST_STATIC_ROOTS or rel_path.endswith('.gz'):
+      continue
+    url_path = '/' + rel_path.replace(os.sep, '/')
+    manifest['assets'][url_path] = process_asset(client_dir_path, rel_path, manifest['assets'].get(url_path))
+    refreshed_url_paths.append(url_path)
+  if refreshed_url_paths:
+    general.write_file_if_changed(manifest_path,
+      json.dumps(manifest, indent=2, separators=(',', ': '), sort_keys=True) + '\n')
+  return refreshed_url_paths
+
+def print_manifest_summary(manifest):
+  gzipped_entries = [entry for entry in manifest['assets'].values() if entry['gzip_bytes'] is not None]
+  print('Static assets: ' + str(len(manifest['assets'])) + ' file(s), ' + str(len(gzipped_entries)) +
+    ' precompressed from ' + str(sum([entry['bytes'] for entry in gzipped_entries])) + ' to ' +
+    str(sum([entry['gzip_bytes'] for entry in gzipped_entries])) + ' bytes')
+
+
+
+if __name__ == '__main__':
+  print('This file is not configured to be run separately; tests will come at a later date')
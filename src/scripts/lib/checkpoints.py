@@ -0,0 +1,127 @@
+'''
+Checkpointed phases, so that a failed install can be resumed at the phase that failed
+
+After each phase its id, the hash of its inputs and its outcome are written to a state file in the install directory.
+When the phases are run again, a phase is skipped if it succeeded with the same inputs hash - unless a phase it runs
+after has been run again, as it may depend on what that phase did. Phases run as a graph (see lib/scheduler.py), so
+independent phases can run at the same time. A phase's inputs are computed just before it is checked, so that they can
+include files written by the phases it runs after
+'''
+
+import hashlib as hashlib
+import json as json
+import os as os
+import threading as threading
+import time as time
+
+import events as events
+import fleet as fleet
+import general as general
+import scheduler as scheduler
+
+CONST_STATE_REL_PATH = 'install-state.json'
+CONST_STATE_VERSION = 1
+CONST_OUTCOME_SUCCEEDED = 'succeeded'
+CONST_OUTCOME_FAILED = 'failed'
+
+def state_path(install_dir_path):
+  return os.path.join(install_dir_path, CONST_STATE_REL_PATH)
+
+def read_state(install_dir_path):
+  '''
+  Returns the checkpoint state of install_dir_path as {'version': ..., 'phases': {phase id: checkpoint dict}}
+  '''
+  path = state_path(install_dir_path)
+  if not os.path.isfile(path):
+    return {'version': CONST_STATE_VERSION, 'phases': {}}
+  with open(path, 'r') as state_file:
+    state = json.load(state_file)
+  if state.get('version') != CONST_STATE_VERSION:
+    raise Exception(
+      'Error:\n' +
+      'Checkpoint state "' + path + '" has unsupported version ' + repr(state.get('version'))
+    )
+  return state
+
+def record_checkpoint(install_dir_path, state, phase_id, phase_inputs_hash, outcome, error=None):
+  state['phases'][phase_id] = {
+    'inputs_hash': phase_inputs_hash,
+    'outcome': outcome,
+    'error': error,
+    'finished_at': time.strftime('%Y-%m-%dT%H:%M:%S%z')
+  }
+  state_string = json.dumps(state, indent=2, separators=(',', ': '), sort_keys=True) + '\n'
+  general.write_file_atomically(state_path(install_dir_path), state_string)
+
+def inputs_hash(phase_inputs):
+  '''
+  Returns the hash of phase_inputs, any JSON serialisable value
+  '''
+  return hashlib.sha1(json.dumps(phase_inputs, sort_keys=True)).hexdigest()
+
+
+
+def run_phases(install_dir_path, phases, from_phase=None, concurrency=1):
+  '''
+  Runs phases, a list of {'id', 'inputs', 'run', 'after', 'resources'} dicts where inputs returns the phase's inputs
+  (see inputs_hash), run runs it and after and resources are as for lib/scheduler.py (by default a phase runs after the
+  one before it), as event steps, up to concurrency at a time. Phases that already succeeded with the same inputs are
+  skipped unless a phase they run after was run. If from_phase is given the phases before it are skipped and it and
+  every phase after it are run regardless of their checkpoints
+  '''
+  phase_ids = [phase['id'] for phase in phases]
+  if from_phase is not None and from_phase not in phase_ids:
+    raise Exception(
+      'Error:\n' +
+      'Unknown phase "' + from_phase + '", expected one of: ' + ', '.join(phase_ids)
+    )
+  state = read_state(install_dir_path)
+  state_lock = threading.Lock()
+  phases_run = {}
+  def run_phase(phase, after_ids):
+    phases_run[phase['id']] = False
+    if from_phase is not None and phase_ids.index(phase['id']) < phase_ids.index(from_phase):
+      print('Skipping phase ' + phase['id'] + ', it is before phase ' + from_phase)
+      return
+    phase_inputs_hash = inputs_hash(phase['inputs']())
+    checkpoint = state['phases'].get(phase['id'])
+    if from_phase is None and not any([phases_run[after_id] for after_id in after_ids]) and checkpoint is not None \
+      and checkpoint['outcome'] == CONST_OUTCOME_SUCCEEDED and checkpoint['inputs_hash'] == phase_inputs_hash:
+      print('Skipping phase ' + phase['id'] + ', it already succeeded at ' + checkpoint['finished_at'] +
+        ' with the same inputs')
+      return
+    phases_run[phase['id']] = True
+    try:
+      with events.step(phase['id']):
+        phase['run']()
+    except Exception as e:
+      with state_lock:
+        record_checkpoint(install_dir_path, state, phase['id'], phase_inputs_hash, CONST_OUTCOME_FAILED, str(e))
+      raise
+    with state_lock:
+      record_checkpoint(install_dir_path, state, phase['id'], phase_inputs_hash, CONST_OUTCOME_SUCCEEDED)
+
+  tasks = []
+  for (phase_index, phase) in enumerate(phases):
+    after_ids = phase.get('after', phase_ids[phase_index - 1:phase_index])
+    tasks.append({
+      'id': phase['id'],
+      'after': after_ids,
+      'resources': phase.get('resources', []),
+      'run': (lambda phase, after_ids: lambda: run_phase(phase, after_ids))(phase, after_ids)
+    })
+  results = scheduler.run_graph(tasks, concurrency)
+  scheduler.print_critical_path(tasks, results)
+  failures = [result for result in results if result['status'] == fleet.CONST_FAILED]
+  if failures:
+    skipped_ids = [result['target'] for result in results if result['status'] == fleet.CONST_SKIPPED]
+    raise Exception(
+      'Error:\n' +
+      '\n'.join(['Phase ' + failure['target'] + ' failed:\n' + failure['error'] for failure in failures]) + '\n' +
+      ('Not run: ' + ', '.join(skipped_ids) + '\n' if skipped_ids else '') +
+      'Re-run to resume from the failed phase(s) (checkpoints: ' + state_path(install_dir_path) + ')'
+    )
+
+
+if __name__ == '__main__':
+  print('This file is not configured to be run separately; tests will come at a later date')
@@ -0,0 +1,221 @@
+'''
+Synthetic configure.yaml manifests and the measurements used to benchmark the configuration tooling
+
+A fixture is an install directory of generated configuration files and a manifest of inputs and outputs written in the
+same form as configure.yaml. Each input reads a value from a line of one of the files and each output writes the value
+of an input to a line of its own, with filler lines between them so that the files have the given size and every
+pattern is matched against the whole file. Fixtures are generated from their sizes alone, so the same case always
+configures the same files.
+
+A run is measured from inside the process that configures the fixture: wall and CPU time, the peak resident memory of
+the process, the file system calls it made and the calls and cumulative time of the tooling's main functions
+'''
+
+import __builtin__ as __builtin__
+import contextlib as contextlib
+import os as os
+import resource as resource
+import time as time
+
+import events as events
+import general as general
+import loadgen as loadgen
+
+CONST_MANIFEST_NAME = 'configure.yaml'
+CONST_CONFIG_REL_DIR_PATH = 'config'
+CONST_ENTRY_TEMPLATE = "  %s: '%s', // configure.py: bench\n"
+CONST_ENTRY_REGEX_TEMPLATE = "%s: '([^']*)', // configure.py: bench"
+CONST_FILLER_LINE = '  // ' + 'filler to pad the file to its benchmark size, it is scanned by every pattern' + '\n'
+
+# The file system calls counted by count_fs_ops, as (module, function name)
+CONST_FS_FUNCTIONS = [
+  (__builtin__, 'open'), (os, 'open'), (os, 'stat'), (os, 'lstat'), (os, 'rename'), (os, 'fsync'), (os, 'unlink'),
+  (os, 'chmod'), (os, 'listdir')
+]
+
+def input_valkey(input_number):
+  return 'value_%05d' % input_number
+
+def output_key(output_number):
+  return 'output_%05d' % output_number
+
+def config_rel_path(file_number):
+  return os.path.join(CONST_CONFIG_REL_DIR_PATH, 'file_%03d.js' % file_number)
+
+def yaml_quote(string):
+  return "'" + string.replace("'", "''") + "'"
+
+def answer_values(input_count):
+  '''
+  Returns answer values {valkey: value} that change the first half of the inputs of a fixture with input_count inputs,
+  so that the rest keep the value read from their files. Output n is written to file n % file count and uses input
+  n % input_count, so the changed inputs reach every file if there are at least twice as many inputs as files (changing
+  every other input would only reach every other file when both counts are even)
+  '''
+  return dict([(input_valkey(input_number), 'b%05d' % input_number) for input_number in range((input_count + 1) / 2)])
+
+
+
+def config_file_string(entry_lines, file_kb):
+  '''
+  Returns the contents of a configuration file of entry_lines spread evenly between filler lines, padded to file_kb kB
+  '''
+  filler_count = max(0, (file_kb * 1024 - sum([len(line) for line in entry_lines])) / len(CONST_FILLER_LINE))
+  entry_filler_count = filler_count / max(len(entry_lines), 1)
+  lines = []
+  for entry_line in entry_lines:
+    lines.extend([CONST_FILLER_LINE] * entry_filler_count)
+    lines.append(entry_line)
+  lines.extend([CONST_FILLER_LINE] * (filler_count - entry_filler_count * len(entry_lines)))
+  return "'use strict';\n\nmodule.exports = {\n" + ''.join(lines) + '};\n'
+
+def manifest_string(input_count, output_count, file_count):
+  '''
+  Returns the YAML manifest of a fixture, in the same form as configure.yaml
+  '''
+  manifest_lines = ['---', 'inputs:']
+  for input_number in range(input_count):
+    valkey = input_valkey(input_number)
+    manifest_lines.extend([
+      '  - valkey                   : ' + yaml_quote(valkey),
+      '    name                     : ' + yaml_quote('Benchmark value ' + str(input_number)),
+      '    desc                     : ' + yaml_quote('A synthetic input [string]'),
+      '    current_val_rel_filepath : ' + yaml_quote('./' + config_rel_path(input_number % file_count)),
+      '    current_val_regex        : ' + yaml_quote(CONST_ENTRY_REGEX_TEMPLATE % valkey),
+      '    validation_regex         : ' + yaml_quote("^[^']*$")
+    ])
+  manifest_lines.extend(['', 'outputs:'])
+  for output_number in range(output_count):
+    manifest_lines.extend([
+      '  - output_rel_filepath      : ' + yaml_quote('./' + config_rel_path(output_number % file_count)),
+      '    output_regex_string      : ' + yaml_quote(CONST_ENTRY_REGEX_TEMPLATE % output_key(output_number)),
+      '    value_template           : ' + yaml_quote('%(' + input_valkey(output_number % input_count) + ')s')
+    ])
+  return '\n'.join(manifest_lines) + '\n'
+
+def generate_fixture(fixture_dir_path, input_count, output_count, file_count, file_kb):
+  '''
+  Writes a fixture of input_count inputs and output_count outputs across file_count files of file_kb kB each to
+  fixture_dir_path, replacing any files already there. Returns the path of its manifest
+  '''
+  config_dir_path = os.path.join(fixture_dir_path, CONST_CONFIG_REL_DIR_PATH)
+  if not os.path.isdir(config_dir_path):
+    os.makedirs(config_dir_path)
+  entry_lines_by_file = [[] for file_number in range(file_count)]
+  for input_number in range(input_count):
+    entry_lines_by_file[input_number % file_count].append(
+      CONST_ENTRY_TEMPLATE % (input_valkey(input_number), 'a%05d' % input_number))
+  for output_number in range(output_count):
+    entry_lines_by_file[output_number % file_count].append(
+      CONST_ENTRY_TEMPLATE % (output_key(output_number), 'a%05d' % (output_number % input_count)))
+  for file_number in range(file_count):
+    general.write_file_atomically(os.path.join(fixture_dir_path, config_rel_path(file_number)),
+      config_file_string(entry_lines_by_file[file_number], file_kb))
+  manifest_path = os.path.join(fixture_dir_path, CONST_MANIFEST_NAME)
+  general.write_file_atomically(manifest_path, manifest_string(input_count, output_count, file_count))
+  return manifest_path
+
+
+
+@contextlib.contextmanager
+def count_fs_ops(counts):
+  '''
+  Counts the file system calls (see CONST_FS_FUNCTIONS) made in the body into counts {function name: calls}
+  '''
+  originals = [(module, name, getattr(module, name)) for (module, name) in CONST_FS_FUNCTIONS]
+  def counted(name, function):
+    def counted_function(*args, **kwargs):
+      counts[name] = counts.get(name, 0) + 1
+      return function(*args, **kwargs)
+    return counted_function
+
+  for (module, name, function) in originals:
+    setattr(module, name, counted(name, function))
+  try:
+    yield
+  finally:
+    for (module, name, function) in originals:
+      setattr(module, name, function)
+
+@contextlib.contextmanager
+def time_functions(functions, timings):
+  '''
+  Records the calls and cumulative wall time of each of functions, a list of (label, module, function name), made in
+  the body into timings {label: {'calls', 'seconds'}}. Time spent in a timed function called by another one counts
+  towards both
+  '''
+  originals = [(label, module, name, getattr(module, name)) for (label, module, name) in functions]
+  def timed(label, function):
+    def timed_function(*args, **kwargs):
+      start_time = time.time()
+      try:
+        return function(*args, **kwargs)
+      finally:
+        timing = timings.setdefault(label, {'calls': 0, 'seconds': 0.0})
+        timing['calls'] += 1
+        timing['seconds'] += time.time() - start_time
+    return timed_function
+
+  for (label, module, name, function) in originals:
+    setattr(module, name, timed(label, function))
+  try:
+    yield
+  finally:
+    for (label, module, name, function) in originals:
+      setattr(module, name, function)
+
+def peak_rss_kb():
+  '''
+  Returns the peak resident memory of this process so far in kB. Linux keeps ru_maxrss across exec, so that a new
+  process starts with its parent's peak, so the high water mark of /proc/self/status is used where there is one
+  '''
+  if os.path.isfile('/proc/self/status'):
+    with open('/proc/self/status', 'r') as status_file:
+      for line in status_file:
+        if line.startswith('VmHWM:'):
+          return int(line.split()[1])
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+@contextlib.contextmanager
+def measure(run_record):
+  '''
+  Measures the body into run_record: wall_seconds, cpu_seconds, peak_rss_kb, rss_growth_kb (how far the peak rose while
+  the body ran) and fs_ops (see count_fs_ops)
+  '''
+  fs_ops = {}
+  start_rss_kb = peak_rss_kb()
+  start_cpu_seconds = events.cpu_seconds()[0]
+  start_time = time.time()
+  with count_fs_ops(fs_ops):
+    yield
+  run_record['wall_seconds'] = time.time() - start_time
+  run_record['cpu_seconds'] = events.cpu_seconds()[0] - start_cpu_seconds
+  run_record['peak_rss_kb'] = peak_rss_kb()
+  run_record['rss_growth_kb'] = run_record['peak_rss_kb'] - start_rss_kb
+  run_record['fs_ops'] = fs_ops
+
+
+
+def median(values):
+  return loadgen.percentile(sorted(values), 50)
+
+def summarise_runs(runs):
+  '''
+  Returns the median of each measurement of runs (see measure, with the number of files written under 'files_written'
+  and the function timings under 'functions')
+  '''
+  summary = {}
+  for key in ['wall_seconds', 'cpu_seconds', 'peak_rss_kb', 'rss_growth_kb', 'files_written']:
+    summary[key] = median([run[key] for run in runs])
+  summary['fs_ops'] = dict([(name, median([run['fs_ops'].get(name, 0) for run in runs]))
+    for name in sorted(set([name for run in runs for name in run['fs_ops']]))])
+  summary['functions'] = dict([(label, {
+    'calls': median([run['functions'].get(label, {}).get('calls', 0) for run in runs]),
+    'seconds': median([run['functions'].get(label, {}).get('seconds', 0.0) for run in runs])
+  }) for label in sorted(set([label for run in runs for label in run['functions']]))])
+  return summary
+
+
+
+if __name__ == '__main__':
+  print('This file is not configured to be run separately; tests will come at a later date')
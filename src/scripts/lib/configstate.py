@@ -0,0 +1,98 @@
+'''
+The resolved configuration values of an install, saved next to it so that they can be read without scraping its files
+
+configure.py writes every {valkey: value} it configured to config-state.json in the install directory, with the
+sha256 of each configuration file it wrote them to. Readers (configure.py reading the current release's values on
+upgrade, install.read_db_configuration, benchmark_api.py) use the saved values while every one of those files is
+unchanged, and fall back to reading the values from the files themselves if there is no state file, it has another
+version or a file has changed since, e.g. after a manual configuration change (see README.md). The state file holds the
+configuration's secrets, so it is only readable by its owner, ignored by git and not copied into builds (see
+Gruntfile.js).
+
+The values read are kept for each install directory until its state is written again, as they are read several times
+per install (from many threads), so the configuration files are only hashed once
+'''
+
+import json as json
+import os as os
+import threading as threading
+
+import dedup as dedup
+import general as general
+
+CONST_STATE_REL_PATH = 'config-state.json'
+CONST_STATE_VERSION = 1
+CONST_STATE_FILE_MODE = 0600
+
+read_values_cache = {}
+read_values_lock = threading.Lock()
+
+def state_path(install_dir_path):
+  return os.path.join(install_dir_path, CONST_STATE_REL_PATH)
+
+def file_hashes(install_dir_path, rel_paths):
+  return dict([(rel_path, dedup.file_sha256(os.path.join(install_dir_path, rel_path))) for rel_path in rel_paths])
+
+def write_state(install_dir_path, values, rel_paths):
+  '''
+  Saves values {valkey: value} as the configuration of install_dir_path, held in the files at rel_paths (relative to
+  install_dir_path). Returns True if the state file changed
+  '''
+  with read_values_lock:
+    read_values_cache.pop(os.path.realpath(install_dir_path), None)
+  state = {
+    'version': CONST_STATE_VERSION,
+    'values': values,
+    'files': file_hashes(install_dir_path, sorted(set([os.path.normpath(rel_path) for rel_path in rel_paths])))
+  }
+  return general.write_file_if_changed(
+    state_path(install_dir_path),
+    json.dumps(state, indent=2, separators=(',', ': '), sort_keys=True) + '\n',
+    new_file_mode=CONST_STATE_FILE_MODE
+  )
+
+def read_values(install_dir_path):
+  '''
+  Returns the saved {valkey: value} configuration of install_dir_path, or None if it has no state file, the state file
+  has another version or any of the configuration files has changed since it was written. Only the first read of an
+  install directory (until its state is written again) checks the files
+  '''
+  cache_key = os.path.realpath(install_dir_path)
+  with read_values_lock:
+    if cache_key not in read_values_cache:
+      read_values_cache[cache_key] = read_values_uncached(install_dir_path)
+    values = read_values_cache[cache_key]
+  return None if values is None else dict(values)
+
+def read_values_uncached(install_dir_path):
+  path = state_path(install_dir_path)
+  if not os.path.isfile(path):
+    return None
+  with open(path, 'r') as state_file:
+    state = json.load(state_file)
+  if state.get('version') != CONST_STATE_VERSION:
+    print('Configuration state "' + path + '" has unsupported version ' + repr(state.get('version')) +
+      ', reading the configuration files instead')
+    return None
+  for (rel_path, file_hash) in sorted(state['files'].items()):
+    file_path = os.path.join(install_dir_path, rel_path)
+    if not os.path.isfile(file_path) or dedup.file_sha256(file_path) != file_hash:
+      print('Configuration file "' + file_path + '" has changed since "' + path + '" was written, reading the ' +
+        'configuration files instead')
+      return None
+  return dict([(str(valkey), str(value)) for (valkey, value) in state['values'].items()])
+
+def read_values_with(install_dir_path, valkeys):
+  '''
+  Returns the saved values of valkeys as a list in the same order, or None if there are no saved values (see
+  read_values) or they do not include every one of valkeys
+  '''
+  values = read_values(install_dir_path)
+  if values is None or not all([valkey in values for valkey in valkeys]):
+    return None
+  return [values[valkey] for valkey in valkeys]
+
+
+
+if __name__ == '__main__':
+  print('This file is not configured to be run separately; tests will come at a later date')
@@ -1,13 +1,75 @@
 import os.path as path
-import re as re
 
 import general as general
 
+CONST_SECRET_VALKEY_REGEX = 'password|secret'
+
+class ConfigFileSet:
+  '''
+  The set of configuration files read from and written to by Inputs and Outputs. Each file is read from disk at most
+  once and all changes are made to the in-memory copy, then flush() writes each changed file back to disk once,
+  atomically
+  '''
+  def __init__(self):
+    self.file_strings = {}
+    self.original_file_strings = {}
+    self.changed_filepaths = set()
+
+  def __repr__(self):
+    return 'file_strings=' + repr(sorted(self.file_strings.keys())) + ',changed_filepaths=' \
+      + repr(sorted(self.changed_filepaths))
+
+  def read(self, filepath):
+    '''
+    Returns the contents of filepath, reading it from disk only on the first call for that file
+    '''
+    real_filepath = path.realpath(filepath)
+    if real_filepath not in self.file_strings:
+      with open(real_filepath, 'r') as config_file:
+        self.file_strings[real_filepath] = config_file.read()
+      self.original_file_strings[real_filepath] = self.file_strings[real_filepath]
+    return self.file_strings[real_filepath]
+
+  def write(self, filepath, file_as_string):
+    '''
+    Replaces the in-memory contents of filepath, which is written to disk on the next flush()
+    '''
+    real_filepath = path.realpath(filepath)
+    self.file_strings[real_filepath] = file_as_string
+    self.changed_filepaths.add(real_filepath)
+
+  def modified_filepaths(self):
+    '''
+    Returns the sorted list of file paths whose in-memory contents differ from the contents read from disk
+    '''
+    return sorted([
+      filepath for filepath in self.changed_filepaths
+      if self.file_strings[filepath] != self.original_file_strings.get(filepath)
+    ])
+
+  def flush(self):
+    '''
+    Writes every file whose contents have changed to disk, returning the list of file paths written. Files written to
+    with their original contents are left untouched, so that their mtime (which file watchers act on) and inode do not
+    change
+    '''
+    written_filepaths = [
+      filepath for filepath in self.modified_filepaths()
+      if general.write_file_if_changed(filepath, self.file_strings[filepath])
+    ]
+    for filepath in written_filepaths:
+      self.original_file_strings[filepath] = self.file_strings[filepath]
+    self.changed_filepaths.clear()
+    return written_filepaths
+
+
+
 class Input:
   '''
   Represents a single configuration value, that may be written to many places in the configuration
   '''
-  def __init__(self, valkey, name, desc, current_val_filepath, current_val_regex, validation_regex):
+  def __init__(self, valkey, name, desc, current_val_filepath, current_val_regex, validation_regex, file_set,
+    saved_values=None):
     if path.isfile(current_val_filepath) is not True:
       raise Exception(
         'Error:\n' +
@@ -19,6 +81,8 @@ class Input:
     self.current_val_filepath = current_val_filepath
     self.current_val_regex = current_val_regex
     self.validation_regex = validation_regex
+    self.file_set = file_set
+    self.saved_values = saved_values or {}
 
   def __repr__(self):
     return repr(self.valkey) + ': name=' + repr(self.name) + ',desc=' + repr(self.desc) + ',current_val_filepath=' \
@@ -28,24 +92,43 @@ class Input:
   def get_valkey(self):
     return self.valkey
 
-  def read_and_return_value(self):
+  def read_current_value(self):
     '''
-    Loads current value as default and reads value from user, returning it to the caller - the object does not cache it
+    Returns the current value of this input, from the saved values (see lib/configstate.py) if they have it, otherwise
+    read from current_val_filepath
     '''
-    with open(self.current_val_filepath, 'r') as current_value_file:
-      current_file_as_string = current_value_file.read()
-    current_value = general.value_from_file_string(
+    if self.valkey in self.saved_values:
+      return self.saved_values[self.valkey]
+    return general.value_from_file_string(
       regex_match_string=self.current_val_regex,
-      file_as_string=current_file_as_string,
+      file_as_string=self.file_set.read(self.current_val_filepath),
       file_path=self.current_val_filepath,
       name=self.name
     )
+
+  def validation_error(self, value):
+    '''
+    Returns a description of why value is not valid for this input, or None if it matches validation_regex
+    '''
+    if general.compiled_pattern(self.validation_regex).match(value):
+      return None
+    return 'Error: ' + value + ' does not match validation regex: ' + self.validation_regex
+
+  def read_and_return_value(self, recommended_value=None):
+    '''
+    Loads current value (or recommended_value, if given) as default and reads value from user, returning it to the
+    caller - the object does not cache it
+    '''
+    current_value = self.read_current_value()
     print(self.name + ': ')
     print(self.desc)
+    if recommended_value is not None:
+      print('Recommended: ' + recommended_value + ' (current: ' + current_value + ')')
+      current_value = recommended_value
     new_value = self.__get_value_input(current_value)
-    while not re.match(self.validation_regex, new_value) or not general.prompt_for_confirm('Is this correct?', True):
-      if not re.match(self.validation_regex, new_value):
-        print('Error: ' + new_value + ' does not match validation regex: ' + self.validation_regex)
+    while self.validation_error(new_value) or not general.prompt_for_confirm('Is this correct?', True):
+      if self.validation_error(new_value):
+        print(self.validation_error(new_value))
       new_value = self.__get_value_input(current_value)
     return new_value
 
@@ -64,9 +147,10 @@ class Input:
 class Output:
   '''
   Represents a single place a configuration value is written to, the Input valkeys used by an Output to assemble its
-  value may be used by more than one Output object
+  value may be used by more than one Output object. If state_valkey is given the value it writes is also saved under
+  that valkey in the configuration state (see lib/configstate.py)
   '''
-  def __init__(self, output_filepath, output_regex_string, value_template):
+  def __init__(self, output_filepath, output_regex_string, value_template, file_set, state_valkey=None):
     if path.isfile(output_filepath) is not True:
       raise Exception(
         'Error:\n' +
@@ -75,30 +159,50 @@ class Output:
     self.output_filepath = output_filepath
     self.output_regex_string = output_regex_string
     self.value_template = value_template
+    self.file_set = file_set
+    self.state_valkey = state_valkey
 
   def __repr__(self):
     return 'output_filepath=' + repr(self.output_filepath) + ',output_regex_string=' + repr(self.output_regex_string) \
       + ',value_template=' + repr(self.value_template)
 
+  def get_output_filepath(self):
+    return self.output_filepath
+
   def get_value_template(self):
     return self.value_template
 
+  def get_state_valkey(self):
+    return self.state_valkey
+
+  def is_secret(self):
+    return general.compiled_pattern(CONST_SECRET_VALKEY_REGEX).search(self.value_template) is not None
+
   def write_output(self, inputs_dict):
     '''
-    Writes this output to file, assembling its value using the attached dict of {valkey: input-string}
+    Writes this output to its file in the file set, assembling its value using the attached dict of
+    {valkey: input-string}. The file itself is only written to disk when the file set is flushed. Returns a change dict
+    of the output's filepath, regex, old_value and new_value
     '''
-    with open(self.output_filepath, 'r') as output_value_file:
-      output_file_as_string = output_value_file.read()
-    replacement_string = re.sub(r'\([^\)]*\)', self.value_template % inputs_dict, self.output_regex_string)
-    updated_file_as_str_count_tuple = re.subn(self.output_regex_string, replacement_string, output_file_as_string)
-    if updated_file_as_str_count_tuple[1] == 1:
-      with open(self.output_filepath, 'w') as destination_value_file:
-        destination_value_file.write(updated_file_as_str_count_tuple[0])
+    output_file_as_string = self.file_set.read(self.output_filepath)
+    matches = general.first_two_matches(self.output_regex_string, output_file_as_string)
+    if len(matches) == 1:
+      new_value = self.value_template % inputs_dict
+      self.file_set.write(
+        self.output_filepath,
+        general.splice_match_group(output_file_as_string, matches[0], new_value)
+      )
+      return {
+        'filepath': self.output_filepath,
+        'output_regex_string': self.output_regex_string,
+        'old_value': matches[0].group(1),
+        'new_value': new_value
+      }
     else:
       raise Exception(
         'Error:\n' +
-        'Was expecting 1 substitution from /' + self.output_regex_string + '/ in ' + self.output_filepath +
-        ', but ' + str(updated_file_as_str_count_tuple[1]) + ' were made'
+        'Was expecting 1 match for /' + self.output_regex_string + '/ in ' + self.output_filepath +
+        ', but ' + ('none were' if len(matches) == 0 else 'more than one was') + ' found'
       )
 
 
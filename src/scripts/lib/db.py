@@ -0,0 +1,201 @@
+'''
+Runs database statements through a single psql session
+
+All of the statements for a phase are streamed to one psql process over stdin instead of starting a sudo + psql process
+(and a new database connection) per statement. psql stops at the first failing statement and the per-statement status,
+timing and output are returned to the caller
+'''
+
+import subprocess as subprocess
+import time as time
+
+import events as events
+import fleet as fleet
+
+CONST_PSQL_COMMAND = ['sudo', '-u', 'postgres', 'psql']
+CONST_STATEMENT_MARKER = '__login_fiddle_statement__'
+
+CONST_STATUS_SUCCEEDED = 'succeeded'
+CONST_STATUS_FAILED = 'failed'
+CONST_STATUS_NOT_RUN = 'not run'
+
+CONST_INDEX_VALIDITY_QUERY = """
+SELECT c.relname, i.indisvalid FROM pg_index i
+JOIN pg_class c ON c.oid = i.indexrelid JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE n.nspname = '{schema}';
+"""
+
+def psql_command_from_answers(answers_dict):
+  '''
+  Returns the psql command to run as a list, which can be overridden by psql_command in an answers file, e.g. to point
+  the install at a throwaway local cluster: ['psql', '-h', '/tmp/pg-test', '-p', '5499', '-U', 'postgres']
+  '''
+  if answers_dict is not None and answers_dict.get('psql_command'):
+    return list(answers_dict['psql_command'])
+  return list(CONST_PSQL_COMMAND)
+
+
+
+def build_psql_script(statements):
+  '''
+  Builds the psql script for statements, each preceded by an \\echo of a marker so that psql's output can be attributed
+  to the statement that produced it. Statements can be SQL (terminated with ;) or psql meta-commands like \\connect
+  '''
+  script_lines = ['\\set ON_ERROR_STOP on', '\\timing on']
+  for (statement_index, statement) in enumerate(statements):
+    script_lines.append('\\echo ' + CONST_STATEMENT_MARKER + ' ' + str(statement_index))
+    script_lines.append(statement)
+  return '\n'.join(script_lines) + '\n'
+
+
+
+def parse_psql_output(statements, psql_output, failed):
+  '''
+  Returns a list of statement result dicts of {'statement', 'status', 'milliseconds', 'output'}, one per statement,
+  from the stdout of a psql session run with build_psql_script. If failed, the last statement psql reached failed and
+  any statements after it were not run
+  '''
+  results = [
+    {'statement': statement, 'status': CONST_STATUS_NOT_RUN, 'milliseconds': None, 'output': []}
+    for statement in statements
+  ]
+  current_result = None
+  for line in psql_output.splitlines():
+    if line.startswith(CONST_STATEMENT_MARKER + ' '):
+      current_result = results[int(line.split()[1])]
+      current_result['status'] = CONST_STATUS_SUCCEEDED
+    elif current_result is None:
+      continue
+    elif line.startswith('Time: '):
+      current_result['milliseconds'] = (current_result['milliseconds'] or 0) + float(line.split()[1])
+    elif line.strip():
+      current_result['output'].append(line)
+  if failed and current_result is not None:
+    current_result['status'] = CONST_STATUS_FAILED
+  return results
+
+
+
+def execute_statements(statements, database=None, transactional=False, psql_command=None):
+  '''
+  Executes statements in order in one psql session, connected to database (psql's default database if None). If
+  transactional, the statements are run in a single transaction - only use this if all of them can be run in a
+  transaction block (e.g. not CREATE DATABASE). Prints each statement's status and timing and returns the list of
+  statement results (see parse_psql_output). Raises an error at the first statement that fails
+  '''
+  if psql_command is None:
+    psql_command = CONST_PSQL_COMMAND
+  command = list(psql_command) + ['--no-psqlrc']
+  if transactional:
+    command.append('--single-transaction')
+  if database is not None:
+    command.extend(['--dbname', database])
+
+  print('Executing ' + str(len(statements)) + ' statement(s) in one session: ' + ' '.join(command))
+  start_time = time.time()
+  psql_process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+  (psql_stdout, psql_stderr) = psql_process.communicate(build_psql_script(statements))
+  elapsed_seconds = time.time() - start_time
+  events.record_subprocess(command, psql_process.returncode, elapsed_seconds)
+  results = parse_psql_output(statements, psql_stdout, psql_process.returncode != 0)
+
+  for result in results:
+    if result['milliseconds'] is None:
+      timing = '         -'
+    else:
+      timing = '%8.1fms' % result['milliseconds']
+    print('  ' + result['status'].ljust(10) + timing + '  ' + result['statement'])
+  print('Session finished in %.2fs with exit status %d' % (elapsed_seconds, psql_process.returncode))
+
+  if psql_process.returncode != 0:
+    failed_statements = [result['statement'] for result in results if result['status'] == CONST_STATUS_FAILED]
+    raise Exception(
+      'Error:\n' +
+      'psql exited with status ' + str(psql_process.returncode) +
+      (' at statement: ' + failed_statements[0] if failed_statements else ' before running any statement') + '\n' +
+      psql_stderr.strip()
+    )
+  return results
+
+
+
+def query(sql, database=None, psql_command=None):
+  '''
+  Runs a single query in its own psql session and returns its rows as lists of strings. Raises an error if it fails
+  '''
+  if psql_command is None:
+    psql_command = CONST_PSQL_COMMAND
+  command = list(psql_command) + ['--no-psqlrc', '--no-align', '--tuples-only', '--field-separator', '\t']
+  if database is not None:
+    command.extend(['--dbname', database])
+  command.extend(['--command', sql])
+  start_time = time.time()
+  psql_process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+  (psql_stdout, psql_stderr) = psql_process.communicate()
+  events.record_subprocess(command, psql_process.returncode, time.time() - start_time)
+  if psql_process.returncode != 0:
+    raise Exception(
+      'Error:\n' +
+      'psql exited with status ' + str(psql_process.returncode) + ' running: ' + sql + '\n' +
+      psql_stderr.strip()
+    )
+  return [line.split('\t') for line in psql_stdout.splitlines() if line]
+
+
+
+def index_statements(index, schema, index_validity):
+  '''
+  Returns the statements needed to build index (an index plan dict of name, table, columns and an optional partial
+  index where clause) given the {index name: is valid} dict of existing indexes. An index left invalid by a failed
+  concurrent build is dropped and rebuilt, a valid index needs no statements
+  '''
+  qualified_name = schema + '.' + index['name']
+  create_statement = 'CREATE INDEX CONCURRENTLY ' + index['name'] + ' ON ' + schema + '.' + index['table'] + \
+    ' (' + ', '.join(index['columns']) + ')' + (' WHERE ' + index['where'] if index.get('where') else '') + ';'
+  if index['name'] not in index_validity:
+    return [create_statement]
+  elif not index_validity[index['name']]:
+    return ['DROP INDEX CONCURRENTLY IF EXISTS ' + qualified_name + ';', create_statement]
+  else:
+    return []
+
+
+
+def build_indexes(index_plan, schema, database, psql_command=None, concurrency=2):
+  '''
+  Builds every index in index_plan (see index_statements) that does not exist or is invalid, with CREATE INDEX
+  CONCURRENTLY so writes to the tables are not blocked. Up to concurrency indexes are built at once, each in its own
+  session, as concurrent builds cannot run in a transaction. Safe to re-run. Raises an error listing every index that
+  could not be built
+  '''
+  index_validity = {}
+  for (index_name, is_valid) in query(CONST_INDEX_VALIDITY_QUERY.replace('{schema}', schema), database, psql_command):
+    index_validity[index_name] = (is_valid == 't')
+
+  planned_indexes = []
+  for index in index_plan:
+    statements = index_statements(index, schema, index_validity)
+    if statements:
+      planned_indexes.append((index, statements))
+    else:
+      print('Index ' + schema + '.' + index['name'] + ' already exists and is valid, skipping')
+
+  events_context = events.current_context()
+  def build_index(planned_index):
+    with events.attach(events_context):
+      with events.step('index ' + planned_index[0]['name']):
+        execute_statements(planned_index[1], database=database, psql_command=psql_command)
+
+  results = fleet.run_waves(build_index, planned_indexes, concurrency, canary_count=0)
+  failures = [result for result in results if result['status'] != fleet.CONST_SUCCEEDED]
+  if failures:
+    raise Exception(
+      'Error:\n' +
+      'Could not build index(es):\n' +
+      '\n'.join([failure['target'][0]['name'] + ': ' + failure['error'] for failure in failures])
+    )
+
+
+
+if __name__ == '__main__':
+  print('This file is not configured to be run separately; tests will come at a later date')
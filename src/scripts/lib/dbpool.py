@@ -0,0 +1,128 @@
+'''
+Recommends and checks the database connection pool bounds written to server/app/config/database.js
+
+Every pm2 worker has its own pool, so the server sees up to workers x maxConnections connections from the application.
+That has to fit in Postgres' max_connections less the slots reserved for superusers and some headroom for psql,
+install/upgrade scripts and migrations. The minimum pool size and idle time grow with the connection round trip to the
+server, as the further away it is the more a new connection costs
+'''
+
+import socket as socket
+import time as time
+
+import db as db
+
+CONST_LIMITS_SOURCE_SERVER = 'server'
+CONST_DEFAULT_MAX_CONNECTIONS = 100 # the Postgres defaults, used if the server cannot be queried
+CONST_DEFAULT_RESERVED_CONNECTIONS = 3
+CONST_HEADROOM_CONNECTIONS = 5
+CONST_MAX_POOL_PER_WORKER = 10 # a node worker is single threaded, more connections than this just queue in Postgres
+
+CONST_RTT_SAMPLES = 5
+CONST_LOCAL_RTT_MS = 1.0
+CONST_REMOTE_RTT_MS = 10.0
+
+CONST_LIMITS_QUERY = """
+SELECT current_setting('max_connections'), current_setting('superuser_reserved_connections');
+"""
+
+def non_interactive_command(psql_command):
+  '''
+  Returns psql_command changed so that neither sudo nor psql prompt for a password, they fail instead. configure and
+  install check the pool on every run, including unattended ones
+  '''
+  psql_command = list(psql_command)
+  if psql_command and psql_command[0] == 'sudo' and '-n' not in psql_command:
+    psql_command.insert(1, '-n')
+  return psql_command + ['--no-password']
+
+def server_connection_limits(db_host, db_port, psql_command=None):
+  '''
+  Returns (max_connections, superuser_reserved_connections, description of where they came from) of the server at
+  db_host:db_port, or the Postgres defaults if it cannot be queried without a password. The description is
+  CONST_LIMITS_SOURCE_SERVER if they were read from the server
+  '''
+  if psql_command is None:
+    psql_command = db.CONST_PSQL_COMMAND
+  psql_command = non_interactive_command(psql_command)
+  if db_host and db_host not in ['localhost', '127.0.0.1']:
+    psql_command.extend(['--host', db_host])
+  if db_port:
+    psql_command.extend(['--port', str(db_port)])
+  try:
+    rows = db.query(CONST_LIMITS_QUERY, psql_command=psql_command)
+    return (int(rows[0][0]), int(rows[0][1]), CONST_LIMITS_SOURCE_SERVER)
+  except Exception as e:
+    print('Warning: could not read max_connections from the server, assuming the Postgres defaults (' +
+      str(e).replace('\n', ' ') + ')')
+    return (CONST_DEFAULT_MAX_CONNECTIONS, CONST_DEFAULT_RESERVED_CONNECTIONS, 'Postgres defaults')
+
+def measure_connect_rtt(db_host, db_port, samples=CONST_RTT_SAMPLES):
+  '''
+  Returns the median time in milliseconds to open a TCP connection to db_host:db_port, or None if it cannot be reached
+  '''
+  rtts = []
+  for sample in range(samples):
+    start_time = time.time()
+    try:
+      socket.create_connection((db_host or 'localhost', int(db_port)), timeout=2).close()
+    except (socket.error, ValueError):
+      return None
+    rtts.append((time.time() - start_time) * 1000.0)
+  return sorted(rtts)[len(rtts) / 2]
+
+
+
+def available_connections(max_connections, reserved_connections):
+  return max_connections - reserved_connections - CONST_HEADROOM_CONNECTIONS
+
+def recommend_pool(workers, max_connections, reserved_connections, rtt_ms):
+  '''
+  Returns the recommended {'db_max_conn', 'db_min_conn', 'db_max_idle_time'} values (as strings, like answers values)
+  for workers pm2 workers sharing a server with max_connections and reserved_connections
+  '''
+  max_conn_share = available_connections(max_connections, reserved_connections) / workers
+  max_conn = max(1, min(CONST_MAX_POOL_PER_WORKER, max_conn_share))
+  if rtt_ms is None or rtt_ms < CONST_LOCAL_RTT_MS:
+    (min_conn, max_idle_time) = (1, 10000)
+  elif rtt_ms < CONST_REMOTE_RTT_MS:
+    (min_conn, max_idle_time) = (2, 30000)
+  else:
+    (min_conn, max_idle_time) = (4, 120000)
+  return {
+    'db_max_conn': str(max_conn),
+    'db_min_conn': str(min(min_conn, max_conn)),
+    'db_max_idle_time': str(max_idle_time)
+  }
+
+def pool_errors(workers, max_conn, min_conn, max_connections, reserved_connections):
+  '''
+  Returns a list of the reasons the pool bounds are unsafe for workers workers on the server, empty if they are safe
+  '''
+  errors = []
+  if min_conn > max_conn:
+    errors.append('Error: the minimum DB connections (' + str(min_conn) + ') is more than the maximum (' +
+      str(max_conn) + ')')
+  available = available_connections(max_connections, reserved_connections)
+  if workers * max_conn > available:
+    errors.append('Error: ' + str(workers) + ' worker(s) x ' + str(max_conn) + ' maximum DB connections = ' +
+      str(workers * max_conn) + ' connections, but the server only has ' + str(available) + ' available (' +
+      str(max_connections) + ' max_connections - ' + str(reserved_connections) + ' reserved - ' +
+      str(CONST_HEADROOM_CONNECTIONS) + ' headroom)')
+  return errors
+
+def enforced_errors(errors, limits_source):
+  '''
+  Returns errors (see pool_errors) if the server's limits were read from the server. If they were assumed, the errors
+  are only printed as warnings and an empty list is returned, as a guess should not refuse a configuration
+  '''
+  if not errors or limits_source == CONST_LIMITS_SOURCE_SERVER:
+    return errors
+  print('Warning: the DB pool may be unsafe, but the server\'s limits could not be read to check (assumed ' +
+    limits_source + '):\n' + '\n'.join(errors))
+  return []
+
+
+
+if __name__ == '__main__':
+  print('This file is not configured to be run separately; tests will come at a later date')
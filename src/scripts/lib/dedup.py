@@ -0,0 +1,181 @@
+'''
+Hardlinks the files of a new release to the identical files of the previous one
+
+Every upgrade is a full install directory next to the previous one, and most of it is the dependency trees
+(server/node_modules, client/bower_components), which are the same in both. Each file in the dependency trees of the new
+release whose contents, mode (other than its write bits) and owner match the file at the same path in the previous
+release is replaced with a hardlink to it, so a release only takes up the disk space of what changed. As the previous
+release's files may themselves be links to older releases, unchanged files end up shared by every release, including
+the one rollback.py would return to.
+
+A linked file is one inode, so writing to it in place through any release's path (npm rebuild or node-gyp output, an
+editor that saves in place) would change it in every release. Linked files are therefore made read-only, so that such
+a write fails instead - except for root, which the permissions do not stop. Only the dependency trees are linked, as
+nothing but npm and bower writes to them; the application's own files, its configuration and its logs are never linked.
+Replacing a file by renaming over it (see general.write_file_atomically) or deleting it only affects that release.
+
+The sha256 of every file in the dependency trees is kept in an index in each release, and reused while a file's size
+and mtime are unchanged, so only new and changed files are hashed
+'''
+
+import hashlib as hashlib
+import json as json
+import os as os
+import stat as stat
+import uuid as uuid
+
+import fleet as fleet
+import general as general
+
+CONST_HASH_INDEX_REL_PATH = 'release-hashes.json'
+CONST_HASH_INDEX_VERSION = 1
+CONST_LINKED_REL_PATHS = ['server/node_modules', 'client/bower_components']
+CONST_WRITE_BITS = stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
+CONST_HASH_CHUNK_BYTES = 1024 * 1024
+
+def release_files(release_dir_path):
+  '''
+  Returns {relative path: lstat result} of every regular file under the linked paths (see CONST_LINKED_REL_PATHS) of
+  release_dir_path. Symlinked directories, e.g. server/node_modules/app, are not followed
+  '''
+  files = {}
+  for linked_rel_path in CONST_LINKED_REL_PATHS:
+    for (dir_path, dir_names, file_names) in os.walk(os.path.join(release_dir_path, linked_rel_path)):
+      rel_dir_path = os.path.relpath(dir_path, release_dir_path)
+      for file_name in file_names:
+        file_stat = os.lstat(os.path.join(dir_path, file_name))
+        if stat.S_ISREG(file_stat.st_mode):
+          files[os.path.normpath(os.path.join(rel_dir_path, file_name))] = file_stat
+  return files
+
+def file_sha256(file_path):
+  '''
+  Returns the sha256 of the file at file_path, read in chunks so that large files are not held in memory
+  '''
+  file_hash = hashlib.sha256()
+  with open(file_path, 'rb') as hashed_file:
+    for chunk in iter(lambda: hashed_file.read(CONST_HASH_CHUNK_BYTES), ''):
+      file_hash.update(chunk)
+  return file_hash.hexdigest()
+
+def file_identity(file_stat):
+  '''
+  Returns what a file has to share with another to be linked to it, other than its contents. The write bits are left
+  out, as linked files are made read-only (see link_over)
+  '''
+  return [stat.S_IMODE(file_stat.st_mode) & ~CONST_WRITE_BITS, file_stat.st_uid, file_stat.st_gid]
+
+
+
+def read_hash_index(release_dir_path):
+  index_path = os.path.join(release_dir_path, CONST_HASH_INDEX_REL_PATH)
+  if not os.path.isfile(index_path):
+    return {}
+  with open(index_path, 'r') as index_file:
+    index_data = json.load(index_file)
+  if index_data.get('version') != CONST_HASH_INDEX_VERSION:
+    return {}
+  return index_data['files']
+
+def write_hash_index(release_dir_path, index):
+  general.write_file_if_changed(
+    os.path.join(release_dir_path, CONST_HASH_INDEX_REL_PATH),
+    json.dumps({'version': CONST_HASH_INDEX_VERSION, 'files': index}, sort_keys=True) + '\n'
+  )
+
+def hash_release(release_dir_path, concurrency):
+  '''
+  Returns the hash index of release_dir_path, {relative path: {'bytes', 'mtime', 'sha256'}}, hashing (up to concurrency
+  files at a time) only the files that are not in its stored index with the same size and mtime
+  '''
+  stored_index = read_hash_index(release_dir_path)
+  files = release_files(release_dir_path)
+  index = {}
+  unhashed_rel_paths = []
+  for (rel_path, file_stat) in files.items():
+    entry = {'bytes': file_stat.st_size, 'mtime': file_stat.st_mtime}
+    stored_entry = stored_index.get(rel_path)
+    if stored_entry is not None and stored_entry['bytes'] == entry['bytes'] and stored_entry['mtime'] == entry['mtime']:
+      entry['sha256'] = stored_entry['sha256']
+    else:
+      unhashed_rel_paths.append(rel_path)
+    index[rel_path] = entry
+
+  def hash_file(rel_path):
+    index[rel_path]['sha256'] = file_sha256(os.path.join(release_dir_path, rel_path))
+
+  results = fleet.run_waves(hash_file, sorted(unhashed_rel_paths), concurrency, canary_count=0)
+  failures = [result for result in results if result['status'] != fleet.CONST_SUCCEEDED]
+  if failures:
+    raise Exception(
+      'Error:\n' +
+      'Could not hash file(s) of release "' + release_dir_path + '":\n' +
+      '\n'.join([failure['target'] + ': ' + failure['error'] for failure in failures])
+    )
+  return index
+
+
+
+def link_over(source_path, target_path):
+  '''
+  Atomically replaces the file at target_path with a hardlink to source_path, making the shared file read-only first
+  so that it cannot be written to in place through either path
+  '''
+  make_read_only(source_path)
+  temp_path = target_path + '.link-' + str(uuid.uuid4())
+  os.link(source_path, temp_path)
+  try:
+    os.rename(temp_path, target_path)
+  except:
+    os.unlink(temp_path)
+    raise
+
+def make_read_only(file_path):
+  file_mode = stat.S_IMODE(os.lstat(file_path).st_mode)
+  if file_mode & CONST_WRITE_BITS:
+    os.chmod(file_path, file_mode & ~CONST_WRITE_BITS)
+
+def deduplicate_release(release_dir_path, previous_release_dir_path, concurrency=4):
+  '''
+  Hardlinks every file in the dependency trees of release_dir_path that is identical to the file at the same path in
+  previous_release_dir_path (which may be None), making it read-only, and stores both releases' hash indexes. Returns
+  {'files', 'linked_files', 'linked_bytes'}, where the files are those of the dependency trees and the linked files
+  include those that were already linked
+  '''
+  index = hash_release(release_dir_path, concurrency)
+  result = {'files': len(index), 'linked_files': 0, 'linked_bytes': 0}
+  if previous_release_dir_path is None or not os.path.isdir(previous_release_dir_path):
+    write_hash_index(release_dir_path, index)
+    return result
+  if os.stat(release_dir_path).st_dev != os.stat(previous_release_dir_path).st_dev:
+    print('Warning: "' + release_dir_path + '" and "' + previous_release_dir_path + '" are on different filesystems, ' +
+      'not linking their files')
+    write_hash_index(release_dir_path, index)
+    return result
+
+  previous_index = hash_release(previous_release_dir_path, concurrency)
+  write_hash_index(previous_release_dir_path, previous_index)
+  for (rel_path, entry) in sorted(index.items()):
+    previous_entry = previous_index.get(rel_path)
+    if previous_entry is None or previous_entry['sha256'] != entry['sha256']:
+      continue
+    file_path = os.path.join(release_dir_path, rel_path)
+    previous_file_path = os.path.join(previous_release_dir_path, rel_path)
+    file_stat = os.lstat(file_path)
+    previous_file_stat = os.lstat(previous_file_path)
+    if file_identity(file_stat) != file_identity(previous_file_stat):
+      continue
+    if (file_stat.st_dev, file_stat.st_ino) != (previous_file_stat.st_dev, previous_file_stat.st_ino):
+      link_over(previous_file_path, file_path)
+      entry['mtime'] = previous_file_stat.st_mtime
+    else:
+      make_read_only(file_path)
+    result['linked_files'] += 1
+    result['linked_bytes'] += entry['bytes']
+  write_hash_index(release_dir_path, index)
+  return result
+
+
+
+if __name__ == '__main__':
+  print('This file is not configured to be run separately; tests will come at a later date')
@@ -0,0 +1,227 @@
+'''
+A local content-addressed cache of the server's node_modules and the client's bower_components
+
+A dependency set is cached under the sha256 of its manifest (package.json or bower.json) - and, for node modules that
+may be built natively, of the platform and node version - so an install whose dependencies are missing restores them
+from the cache instead of fetching and building them again. The cache directory can be local or shared between hosts,
+e.g. on NFS.
+
+Only dependencies that this host installed with the dependency set's install command are stored. The release archive
+ships the node_modules and bower_components of the build host, which were not built for this host's platform and node
+version (e.g. bcrypt's native binding) and include devDependencies, so a shipped tree is used as it is but never
+cached under this host's key.
+
+Each cache entry is a directory of gzipped tarballs, one per top-level package, so that they can be created and
+extracted in parallel, and an index.json listing them. Entries are written to a temporary directory and renamed into
+place, and dependencies are extracted to a temporary directory and renamed over the install's, so an interrupted store
+or restore leaves nothing half written
+'''
+
+import hashlib as hashlib
+import json as json
+import os as os
+import platform as platform
+import shutil as shutil
+import subprocess as subprocess
+import time as time
+import uuid as uuid
+
+import dedup as dedup
+import events as events
+import fleet as fleet
+import general as general
+
+CONST_CACHE_VERSION = 1
+CONST_INDEX_FILE_NAME = 'index.json'
+CONST_DEFAULT_CACHE_DIR = '~/.cache/login-fiddle/dependencies'
+
+# ignored_entries are in the dependency directory but are part of the application, e.g. the node_modules/app symlink,
+# and files matching excluded_patterns are written by the install (see lib/assets.py), so neither are cached
+CONST_DEPENDENCY_SETS = [
+  {
+    'name': 'server',
+    'manifest_rel_path': 'server/package.json',
+    'dir_rel_path': 'server/node_modules',
+    'ignored_entries': ['app'],
+    'excluded_patterns': [],
+    'native': True,
+    'install_command': ['npm', 'install', '--production']
+  },
+  {
+    'name': 'client',
+    'manifest_rel_path': 'client/bower.json',
+    'dir_rel_path': 'client/bower_components',
+    'ignored_entries': [],
+    'excluded_patterns': ['*.gz'],
+    'native': False,
+    'install_command': ['bower', 'install', '--production', '--allow-root']
+  }
+]
+
+CONST_RESTORED = 'restored from cache'
+CONST_INSTALLED_AND_STORED = 'installed and stored in cache'
+CONST_PRESENT = 'present in the install, not cached as it was not installed on this host'
+
+def cache_dir_from_answers(answers_dict):
+  '''
+  Returns the dependency cache directory, which can be overridden by dependency_cache_dir in an answers file
+  '''
+  cache_dir_path = (answers_dict or {}).get('dependency_cache_dir') or CONST_DEFAULT_CACHE_DIR
+  return os.path.expanduser(cache_dir_path)
+
+def node_version():
+  try:
+    return subprocess.check_output(['node', '--version']).strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+def dependency_key(install_dir_path, dependency_set):
+  '''
+  Returns the cache key of dependency_set in install_dir_path: the sha256 of its manifest's sha256 and, for native
+  dependencies, of the platform and node version
+  '''
+  manifest_path = os.path.join(install_dir_path, dependency_set['manifest_rel_path'])
+  key_inputs = {'manifest_sha256': dedup.file_sha256(manifest_path)}
+  if dependency_set['native']:
+    key_inputs['platform'] = platform.system() + '-' + platform.machine()
+    key_inputs['node_version'] = node_version()
+  return hashlib.sha256(json.dumps(key_inputs, sort_keys=True)).hexdigest()
+
+def cache_entry_path(cache_dir_path, dependency_set, key):
+  return os.path.join(cache_dir_path, 'v' + str(CONST_CACHE_VERSION), dependency_set['name'], key)
+
+def dependency_entries(dir_path, dependency_set):
+  '''
+  Returns the names of the packages in the dependency directory dir_path, empty if it does not exist
+  '''
+  if not os.path.isdir(dir_path):
+    return []
+  return sorted([entry for entry in os.listdir(dir_path) if entry not in dependency_set['ignored_entries']])
+
+
+
+def run_tar(tar_args):
+  '''
+  Runs tar with tar_args, raising an error if it fails
+  '''
+  start_time = time.time()
+  exit_status = subprocess.call(['tar'] + tar_args)
+  events.record_subprocess(['tar'] + tar_args, exit_status, time.time() - start_time)
+  if exit_status != 0:
+    raise Exception(
+      'Error:\n' +
+      'tar ' + ' '.join(tar_args) + ' exited with status ' + str(exit_status)
+    )
+
+def run_in_parallel(task, targets, concurrency, description):
+  events_context = events.current_context()
+  def run_task(target):
+    with events.attach(events_context):
+      task(target)
+
+  results = fleet.run_waves(run_task, targets, concurrency, canary_count=0)
+  failures = [result for result in results if result['status'] != fleet.CONST_SUCCEEDED]
+  if failures:
+    raise Exception(
+      'Error:\n' +
+      'Could not ' + description + ':\n' +
+      '\n'.join([str(failure['target']) + ': ' + failure['error'] for failure in failures])
+    )
+
+
+
+def store(dir_path, entry_path, dependency_set, concurrency):
+  '''
+  Stores the packages in dir_path as the cache entry at entry_path, one tarball per package, up to concurrency at a time
+  '''
+  entries = dependency_entries(dir_path, dependency_set)
+  archives = [{'entry': entry, 'archive': str(index) + '.tar.gz'} for (index, entry) in enumerate(entries)]
+  temp_entry_path = entry_path + '.tmp-' + str(uuid.uuid4())
+  os.makedirs(temp_entry_path)
+  try:
+    run_in_parallel(
+      lambda archive: run_tar(['--exclude=' + pattern for pattern in dependency_set['excluded_patterns']] +
+        ['-czf', os.path.join(temp_entry_path, archive['archive']), '-C', dir_path, archive['entry']]),
+      archives, concurrency, 'archive ' + dir_path
+    )
+    general.write_file_atomically(os.path.join(temp_entry_path, CONST_INDEX_FILE_NAME),
+      json.dumps({'version': CONST_CACHE_VERSION, 'archives': archives}, indent=2, separators=(',', ': ')) + '\n')
+    if os.path.exists(entry_path): # stored by another install in the meantime
+      shutil.rmtree(temp_entry_path)
+    else:
+      os.rename(temp_entry_path, entry_path)
+  except:
+    if os.path.exists(temp_entry_path):
+      shutil.rmtree(temp_entry_path)
+    raise
+
+def restore(entry_path, dir_path, dependency_set, concurrency):
+  '''
+  Replaces the packages in dir_path with those of the cache entry at entry_path, extracting up to concurrency tarballs
+  at a time. The ignored entries of dir_path are kept
+  '''
+  with open(os.path.join(entry_path, CONST_INDEX_FILE_NAME), 'r') as index_file:
+    archives = json.load(index_file)['archives']
+  temp_dir_path = dir_path.rstrip(os.sep) + '.restore-' + str(uuid.uuid4())
+  os.makedirs(temp_dir_path)
+  try:
+    run_in_parallel(
+      lambda archive: run_tar(['-xzf', os.path.join(entry_path, archive['archive']), '-C', temp_dir_path]),
+      archives, concurrency, 'extract ' + entry_path
+    )
+  except:
+    shutil.rmtree(temp_dir_path)
+    raise
+  if os.path.isdir(dir_path):
+    for entry in dependency_set['ignored_entries']:
+      if os.path.lexists(os.path.join(dir_path, entry)):
+        os.rename(os.path.join(dir_path, entry), os.path.join(temp_dir_path, entry))
+    shutil.rmtree(dir_path)
+  os.rename(temp_dir_path, dir_path)
+
+
+
+def install_dependency_set(install_dir_path, dependency_set, cache_dir_path, concurrency=4):
+  '''
+  Makes sure the dependencies of dependency_set are in install_dir_path: present dependencies (e.g. shipped in the
+  release archive) are left as they are, missing ones are restored from the cache or, if they are not cached,
+  installed with the dependency set's install command and then stored. Returns what was done (one of the CONST_*
+  outcomes)
+  '''
+  dir_path = os.path.join(install_dir_path, dependency_set['dir_rel_path'])
+  if dependency_entries(dir_path, dependency_set):
+    return CONST_PRESENT
+  entry_path = cache_entry_path(cache_dir_path, dependency_set, dependency_key(install_dir_path, dependency_set))
+  if os.path.isfile(os.path.join(entry_path, CONST_INDEX_FILE_NAME)):
+    with events.step('restore ' + dependency_set['name']):
+      restore(entry_path, dir_path, dependency_set, concurrency)
+    return CONST_RESTORED
+  else:
+    with events.step('install ' + dependency_set['name']):
+      install_command = dependency_set['install_command']
+      print('Running: ' + ' '.join(install_command))
+      start_time = time.time()
+      try:
+        exit_status = subprocess.call(install_command, cwd=os.path.dirname(dir_path))
+      except OSError as e:
+        raise Exception(
+          'Error:\n' +
+          'Could not run ' + ' '.join(install_command) + ' to install the missing ' + dependency_set['dir_rel_path'] +
+          ': ' + str(e)
+        )
+      events.record_subprocess(install_command, exit_status, time.time() - start_time)
+      if exit_status != 0:
+        raise Exception(
+          'Error:\n' +
+          ' '.join(install_command) + ' exited with status ' + str(exit_status)
+        )
+  if not os.path.isdir(os.path.dirname(entry_path)):
+    os.makedirs(os.path.dirname(entry_path))
+  with events.step('store ' + dependency_set['name']):
+    store(dir_path, entry_path, dependency_set, concurrency)
+  return CONST_INSTALLED_AND_STORED
+
+
+
+if __name__ == '__main__':
+  print('This file is not configured to be run separately; tests will come at a later date')
@@ -0,0 +1,254 @@
+'''
+Timing and structured event logging for the install, upgrade and configuration phases
+
+A run (e.g. one install_app) is made of nested steps. Each step records its wall time, CPU time (of this process and of
+its finished subprocesses), the exit status of every subprocess it ran and the bytes it wrote to files, and emits
+step_started / step_finished events as JSON lines to the run's event log. When the run ends the finished steps are
+printed slowest first. Code that is not running in a run (e.g. a lib function used on its own) records nothing
+
+CPU times are read for the whole process, so a step that ran at the same time as another step on another thread (that
+is neither its parent nor its child) would be charged the CPU of both. Such steps record their CPU times as None, with
+cpu_attributable false, and only the steps around them (e.g. the run itself) have their CPU times
+
+The current run and step are tracked per thread; code that runs steps on other threads passes them current_context()
+and enters it with attach()
+'''
+
+import contextlib as contextlib
+import json as json
+import os as os
+import socket as socket
+import threading as threading
+import time as time
+import uuid as uuid
+
+CONST_EVENT_LOG_VERSION = 1
+CONST_STATUS_SUCCEEDED = 'succeeded'
+CONST_STATUS_FAILED = 'failed'
+
+thread_state = threading.local()
+
+class EventLog:
+  '''
+  A JSON-lines event log file shared by every step of a run, which may be written to from many threads
+  '''
+  def __init__(self, log_path, run_name):
+    self.log_path = log_path
+    self.run_name = run_name
+    self.run_id = str(uuid.uuid4())
+    self.finished_steps = []
+    self.running_steps = []
+    self.lock = threading.Lock()
+    log_dir_path = os.path.dirname(log_path)
+    if log_dir_path and not os.path.isdir(log_dir_path):
+      os.makedirs(log_dir_path)
+    self.log_file = open(log_path, 'a')
+
+  def __repr__(self):
+    return 'log_path=' + repr(self.log_path) + ',run_name=' + repr(self.run_name) + ',run_id=' + repr(self.run_id)
+
+  def emit(self, event, fields):
+    '''
+    Appends an event with the given fields dict to the log, flushing it so that a failed run's log is complete
+    '''
+    record = {'version': CONST_EVENT_LOG_VERSION, 'time': time.time(), 'run_id': self.run_id, 'run': self.run_name,
+      'host': socket.gethostname(), 'event': event}
+    record.update(fields)
+    with self.lock:
+      self.log_file.write(json.dumps(record, sort_keys=True) + '\n')
+      self.log_file.flush()
+
+  def start_step(self, started_step):
+    '''
+    Adds started_step to the running steps, marking it and any running step that is not its parent as overlapping
+    '''
+    with self.lock:
+      for running_step in self.running_steps:
+        if not started_step.is_within(running_step):
+          running_step.overlapped = True
+          started_step.overlapped = True
+      self.running_steps.append(started_step)
+
+  def finish_step(self, finished_step, step_record):
+    with self.lock:
+      self.running_steps.remove(finished_step)
+      self.finished_steps.append(step_record)
+
+  def close(self):
+    self.log_file.close()
+
+
+
+class Step:
+  '''
+  The running totals of one step, also added to each of its parent steps
+  '''
+  def __init__(self, name, parent):
+    self.name = name
+    self.path = name if parent is None else parent.path + '/' + name
+    self.parent = parent
+    self.subprocesses = []
+    self.bytes_written = 0
+    self.overlapped = False
+
+  def __repr__(self):
+    return 'path=' + repr(self.path)
+
+  def is_within(self, other_step):
+    '''
+    Returns whether this step is other_step or one of its children, at any depth
+    '''
+    step = self
+    while step is not None:
+      if step is other_step:
+        return True
+      step = step.parent
+    return False
+
+  def add_subprocess(self, subprocess_record):
+    step = self
+    while step is not None:
+      step.subprocesses.append(subprocess_record)
+      step = step.parent
+
+  def add_bytes_written(self, byte_count):
+    step = self
+    while step is not None:
+      step.bytes_written += byte_count
+      step = step.parent
+
+
+
+def current_context():
+  '''
+  Returns the (event log, step) this thread is running in, (None, None) outside a run
+  '''
+  return (getattr(thread_state, 'event_log', None), getattr(thread_state, 'step', None))
+
+@contextlib.contextmanager
+def attach(context):
+  '''
+  Runs the body in context (from current_context, usually on another thread)
+  '''
+  previous_context = current_context()
+  (thread_state.event_log, thread_state.step) = context
+  try:
+    yield
+  finally:
+    (thread_state.event_log, thread_state.step) = previous_context
+
+def cpu_seconds():
+  '''
+  Returns (CPU seconds of this process, CPU seconds of its finished subprocesses)
+  '''
+  times = os.times()
+  return (times[0] + times[1], times[2] + times[3])
+
+
+
+@contextlib.contextmanager
+def step(name):
+  '''
+  Runs the body as a step of the current run, recording its timings, subprocesses and bytes written. Does nothing
+  outside a run
+  '''
+  (event_log, parent_step) = current_context()
+  if event_log is None:
+    yield
+    return
+  current_step = Step(name, parent_step)
+  event_log.start_step(current_step)
+  event_log.emit('step_started', {'step': current_step.path})
+  start_time = time.time()
+  (start_cpu_seconds, start_child_cpu_seconds) = cpu_seconds()
+  thread_state.step = current_step
+  error = None
+  try:
+    yield
+  except BaseException as e:
+    error = e
+    raise
+  finally:
+    thread_state.step = parent_step
+    (end_cpu_seconds, end_child_cpu_seconds) = cpu_seconds()
+    cpu_attributable = not current_step.overlapped
+    step_record = {
+      'step': current_step.path,
+      'status': CONST_STATUS_SUCCEEDED if error is None else CONST_STATUS_FAILED,
+      'error': None if error is None else str(error),
+      'wall_seconds': time.time() - start_time,
+      'cpu_seconds': end_cpu_seconds - start_cpu_seconds if cpu_attributable else None,
+      'child_cpu_seconds': end_child_cpu_seconds - start_child_cpu_seconds if cpu_attributable else None,
+      'cpu_attributable': cpu_attributable,
+      'bytes_written': current_step.bytes_written,
+      'subprocesses': current_step.subprocesses
+    }
+    event_log.emit('step_finished', step_record)
+    event_log.finish_step(current_step, step_record)
+
+def record_subprocess(command, exit_status, seconds):
+  '''
+  Records that the current step ran command (a list) and that it exited with exit_status after seconds
+  '''
+  (event_log, current_step) = current_context()
+  if event_log is None:
+    return
+  subprocess_record = {'command': ' '.join(command), 'exit_status': exit_status, 'seconds': seconds}
+  event_log.emit('subprocess_finished', dict(subprocess_record, step=current_step.path if current_step else None))
+  if current_step is not None:
+    current_step.add_subprocess(subprocess_record)
+
+def record_bytes_written(byte_count):
+  '''
+  Records that the current step wrote byte_count bytes to a file
+  '''
+  (event_log, current_step) = current_context()
+  if current_step is not None:
+    current_step.add_bytes_written(byte_count)
+
+
+
+def format_cpu_seconds(seconds):
+  return '         -' if seconds is None else '%10.2f' % seconds
+
+def print_summary(event_log):
+  '''
+  Prints the run's finished steps, slowest first. The CPU times of steps that overlapped other steps (see above) are
+  shown as -
+  '''
+  print('******************************************************************')
+  print('  ' + event_log.run_name.upper() + ' TIMINGS (SLOWEST FIRST)')
+  print('******************************************************************')
+  print('    wall s     cpu s   child s       bytes  subprocs  failed  status     step')
+  for step_record in sorted(event_log.finished_steps, key=lambda step_record: -step_record['wall_seconds']):
+    failed_subprocesses = [sp for sp in step_record['subprocesses'] if sp['exit_status'] != 0]
+    print(('%10.2f' % step_record['wall_seconds']) + format_cpu_seconds(step_record['cpu_seconds']) +
+      format_cpu_seconds(step_record['child_cpu_seconds']) + str(step_record['bytes_written']).rjust(12) +
+      str(len(step_record['subprocesses'])).rjust(10) + str(len(failed_subprocesses)).rjust(8) + '  ' +
+      step_record['status'].ljust(10) + ' ' + step_record['step'])
+  print('Event log: ' + event_log.log_path)
+
+@contextlib.contextmanager
+def run(log_path, run_name):
+  '''
+  Runs the body as a run named run_name (which is also its outermost step) logging to log_path, and prints the summary
+  of its steps when it finishes or fails. If this thread is already in a run, the body is just a step of that run
+  '''
+  if current_context()[0] is not None:
+    with step(run_name):
+      yield
+    return
+  event_log = EventLog(log_path, run_name)
+  try:
+    with attach((event_log, None)):
+      with step(run_name):
+        yield
+  finally:
+    print('')
+    print_summary(event_log)
+    event_log.close()
+
+
+
+if __name__ == '__main__':
+  print('This file is not configured to be run separately; tests will come at a later date')
@@ -0,0 +1,67 @@
+'''
+Runs a task against many targets on a bounded thread pool, canary targets first and then the rest in waves
+'''
+
+import multiprocessing.pool as pool
+import time as time
+
+CONST_SUCCEEDED = 'succeeded'
+CONST_FAILED = 'failed'
+CONST_SKIPPED = 'skipped'
+
+def run_target(task, target):
+  '''
+  Runs task(target), returning a result dict of the target, its status, any error message and the elapsed seconds
+  '''
+  start_time = time.time()
+  try:
+    task(target)
+    return {'target': target, 'status': CONST_SUCCEEDED, 'error': None, 'seconds': time.time() - start_time}
+  except Exception as e:
+    return {'target': target, 'status': CONST_FAILED, 'error': str(e), 'seconds': time.time() - start_time}
+
+
+
+def split_into_waves(targets, canary_count, wave_size):
+  '''
+  Splits targets into a list of waves: the first canary_count targets and then waves of at most wave_size targets
+  (all of the remaining targets if wave_size is None)
+  '''
+  waves = []
+  if canary_count > 0:
+    waves.append(targets[:canary_count])
+  remaining_targets = targets[canary_count:]
+  if wave_size is None or wave_size < 1:
+    wave_size = max(len(remaining_targets), 1)
+  for wave_start in range(0, len(remaining_targets), wave_size):
+    waves.append(remaining_targets[wave_start:wave_start + wave_size])
+  return waves
+
+
+
+def run_waves(task, targets, concurrency, canary_count=1, wave_size=None):
+  '''
+  Runs task(target) for every target, at most concurrency at a time, returning a list of result dicts (see run_target)
+  in the same order as targets. Each wave finishes before the next starts, and once any target in a wave fails the
+  targets in later waves are skipped
+  '''
+  results = []
+  failed = False
+  thread_pool = pool.ThreadPool(max(concurrency, 1))
+  try:
+    for wave in split_into_waves(targets, canary_count, wave_size):
+      if failed:
+        results.extend([{'target': target, 'status': CONST_SKIPPED, 'error': None, 'seconds': 0} for target in wave])
+        continue
+      wave_results = thread_pool.map(lambda target: run_target(task, target), wave)
+      results.extend(wave_results)
+      failed = any([wave_result['status'] == CONST_FAILED for wave_result in wave_results])
+  finally:
+    thread_pool.close()
+    thread_pool.join()
+  return results
+
+
+
+if __name__ == '__main__':
+  print('This file is not configured to be run separately; tests will come at a later date')
@@ -1,6 +1,10 @@
 import os as os
 import re as re
 import subprocess as subprocess
+import stat as stat
+import tempfile as tempfile
+
+import events as events
 
 def prompt_for_text(prompt='Data? ', default_string=None, validator_regexp_string='^.*$'):
   '''
@@ -81,23 +85,113 @@ def prompt_for_confirm(prompt=None, resp=None):
 
 
 
-def value_from_file_string(regex_match_string, file_as_string, file_path='file', name='Property'):
-  #### Check that regex_match_string matches once and once only
-  if len(re.findall(regex_match_string, file_as_string)) > 1:
+compiled_pattern_cache = {}
+
+def compiled_pattern(regex_string):
+  '''
+  Returns regex_string compiled, compiling each distinct pattern only once per process
+  '''
+  if regex_string not in compiled_pattern_cache:
+    compiled_pattern_cache[regex_string] = re.compile(regex_string)
+  return compiled_pattern_cache[regex_string]
+
+
+
+def first_two_matches(regex_match_string, file_as_string):
+  '''
+  Returns a list of the first (at most) two match objects for regex_match_string in file_as_string, scanning the string
+  once and stopping as soon as a second match is found. A caller requiring a unique match checks for a list of length 1
+  '''
+  matches = []
+  for match in compiled_pattern(regex_match_string).finditer(file_as_string):
+    matches.append(match)
+    if len(matches) == 2:
+      break
+  return matches
+
+
+
+def unique_match_from_file_string(regex_match_string, file_as_string, file_path='file', name='Property'):
+  '''
+  Returns the match object for the one and only match of regex_match_string in file_as_string, its offsets can be used
+  to splice a new value into the string. Raises an error if there are no matches or more than one match
+  '''
+  matches = first_two_matches(regex_match_string, file_as_string)
+  if len(matches) > 1:
     raise Exception(
       'Error:\n' +
       name + ' could not be extracted because there are multiple matches for the pattern ' +
       '"' + regex_match_string + '" in ' + file_path
     )
-  elif len(re.findall(regex_match_string, file_as_string)) == 0:
+  elif len(matches) == 0:
     raise Exception(
       'Error:\n' +
       name + ' could not be extracted because there are no matches for the pattern ' +
       '"' + regex_match_string + '" in ' + file_path
     )
   else:
-    #### Extract current value
-    return re.match('.*' + regex_match_string + '.*', file_as_string, re.DOTALL).group(1)
+    return matches[0]
+
+
+
+def value_from_file_string(regex_match_string, file_as_string, file_path='file', name='Property'):
+  return unique_match_from_file_string(regex_match_string, file_as_string, file_path, name).group(1)
+
+
+
+def splice_match_group(file_as_string, match, value, group=1):
+  '''
+  Returns file_as_string with the text captured by group of match (taken from file_as_string) replaced by value
+  '''
+  return file_as_string[:match.start(group)] + value + file_as_string[match.end(group):]
+
+
+
+def write_file_atomically(file_path, file_as_string, new_file_mode=0644):
+  '''
+  Replaces the contents of file_path with file_as_string so that readers only ever see the old or the new contents
+
+  The new contents are written and fsync'd to a temporary file in the same directory, which is then renamed over
+  file_path. The permissions of an existing file are preserved, a new file is created with new_file_mode (rw-r--r--
+  by default). The directory is fsync'd so the rename is durable
+  '''
+  file_path = os.path.realpath(file_path)
+  dir_path = os.path.dirname(file_path)
+  (temp_fd, temp_file_path) = tempfile.mkstemp(prefix='.' + os.path.basename(file_path) + '.', dir=dir_path)
+  try:
+    with os.fdopen(temp_fd, 'w') as temp_file:
+      temp_file.write(file_as_string)
+      temp_file.flush()
+      os.fsync(temp_file.fileno())
+    if os.path.exists(file_path):
+      os.chmod(temp_file_path, stat.S_IMODE(os.stat(file_path).st_mode))
+    else:
+      os.chmod(temp_file_path, new_file_mode)
+    os.rename(temp_file_path, file_path)
+  except:
+    if os.path.exists(temp_file_path):
+      os.unlink(temp_file_path)
+    raise
+  dir_fd = os.open(dir_path, os.O_RDONLY)
+  try:
+    os.fsync(dir_fd)
+  finally:
+    os.close(dir_fd)
+  events.record_bytes_written(len(file_as_string))
+
+
+
+def write_file_if_changed(file_path, file_as_string, new_file_mode=0644):
+  '''
+  Atomically writes file_as_string to file_path (see write_file_atomically) unless the file already has exactly those
+  contents, in which case it is left untouched (keeping its mtime and inode). Returns True if the file was written
+  '''
+  if os.path.isfile(file_path):
+    with open(file_path, 'r') as current_file:
+      if current_file.read() == file_as_string:
+        return False
+  write_file_atomically(file_path, file_as_string, new_file_mode)
+  return True
 
 
 
@@ -0,0 +1,246 @@
+'''
+Generates HTTP load against a running application and summarises the response latencies
+
+Each worker thread has its own client (one connection, reused if keep_alive, and its own session cookies) and runs the
+configured scenarios in a weighted random mix until the duration is up. A scenario makes one or more requests and each
+request is recorded against the request's name, so that e.g. the login scenario reports login and logout separately
+'''
+
+import Cookie as Cookie
+import httplib as httplib
+import math as math
+import random as random
+import socket as socket
+import ssl as ssl
+import threading as threading
+import time as time
+import urllib as urllib
+import urlparse as urlparse
+
+CONST_DEFAULT_SCENARIO_WEIGHTS = {'entries_all': 1, 'entries_by_tag': 4, 'tags': 2, 'session': 2, 'login': 1}
+CONST_PERCENTILES = [50, 95, 99]
+CONST_REQUEST_TIMEOUT_SECONDS = 30
+
+class Client:
+  '''
+  An HTTP(S) client with one connection, which is reused between requests if keep_alive, and a cookie jar
+  '''
+  def __init__(self, base_url, keep_alive=True, verify_tls=False):
+    parsed_url = urlparse.urlparse(base_url)
+    self.scheme = parsed_url.scheme
+    self.host = parsed_url.hostname
+    self.port = parsed_url.port
+    self.keep_alive = keep_alive
+    self.verify_tls = verify_tls
+    self.connection = None
+    self.cookies = {}
+
+  def connect(self):
+    if self.scheme == 'https':
+      if self.verify_tls:
+        context = ssl.create_default_context()
+      else:
+        context = ssl._create_unverified_context() # the installed application's certificate is usually self-signed
+      connection = httplib.HTTPSConnection(self.host, self.port, timeout=CONST_REQUEST_TIMEOUT_SECONDS, context=context)
+    else:
+      connection = httplib.HTTPConnection(self.host, self.port, timeout=CONST_REQUEST_TIMEOUT_SECONDS)
+    connection.connect()
+    # Without this small requests on a reused connection can wait on delayed ACKs, adding ~40ms to their latency
+    connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return connection
+
+  def close(self):
+    if self.connection is not None:
+      self.connection.close()
+      self.connection = None
+
+  def request(self, method, path, form=None, headers=None):
+    '''
+    Makes a request with any extra headers and reads the whole response, returning its status. Redirects are not
+    followed
+    '''
+    headers = dict(headers or {})
+    headers['Connection'] = 'keep-alive' if self.keep_alive else 'close'
+    body = None
+    if form is not None:
+      body = urllib.urlencode(form)
+      headers['Content-Type'] = 'application/x-www-form-urlencoded'
+    if self.cookies:
+      headers['Cookie'] = '; '.join([name + '=' + value for (name, value) in self.cookies.items()])
+    if self.connection is None:
+      self.connection = self.connect()
+    try:
+      self.connection.request(method, path, body, headers)
+      response = self.connection.getresponse()
+      response.read()
+    except:
+      self.close()
+      raise
+    for set_cookie_header in [value for (name, value) in response.getheaders() if name == 'set-cookie']:
+      cookie = Cookie.SimpleCookie()
+      cookie.load(set_cookie_header)
+      self.cookies.update([(name, morsel.value) for (name, morsel) in cookie.items()])
+    if not self.keep_alive or response.getheader('connection', '').lower() == 'close':
+      self.close()
+    return response.status
+
+
+
+def timed_request(client, name, method, path, form=None, headers=None):
+  '''
+  Returns a request record tuple of (name, status, seconds); status is None if the request failed without a response
+  '''
+  start_time = time.time()
+  try:
+    status = client.request(method, path, form, headers)
+  except Exception:
+    status = None
+  return (name, status, time.time() - start_time)
+
+def entries_all_scenario(client, rng, options):
+  return [timed_request(client, 'entries_all', 'GET', '/api/entry')]
+
+def entries_by_tag_scenario(client, rng, options):
+  tag_string = rng.choice(options['tag_strings'])
+  return [timed_request(client, 'entries_by_tag', 'GET', '/api/entry/' + urllib.quote(tag_string, safe=''))]
+
+def tags_scenario(client, rng, options):
+  return [timed_request(client, 'tags', 'GET', '/api/tag')]
+
+def session_scenario(client, rng, options):
+  return [timed_request(client, 'session', 'GET', '/api/session')]
+
+def login_scenario(client, rng, options):
+  '''
+  Logs in with the local account and logs out again, as logging in requires a logged out session
+  '''
+  records = [timed_request(client, 'login', 'POST', '/api/user/access/local/login', {
+    'local_email': options['login_email'],
+    'local_password': options['login_password']
+  })]
+  records.append(timed_request(client, 'logout', 'GET', '/api/user/logout'))
+  return records
+
+CONST_SCENARIOS = {
+  'entries_all': entries_all_scenario,
+  'entries_by_tag': entries_by_tag_scenario,
+  'tags': tags_scenario,
+  'session': session_scenario,
+  'login': login_scenario
+}
+
+# The statuses each request is expected to respond with; logging in and out redirect to the util success route
+CONST_EXPECTED_STATUSES = {
+  'entries_all': [200],
+  'entries_by_tag': [200],
+  'tags': [200],
+  'session': [200],
+  'login': [302],
+  'logout': [302]
+}
+
+
+
+def scenario_picker(scenario_weights, rng):
+  '''
+  Returns a function that returns a random scenario name, weighted by scenario_weights
+  '''
+  weighted_names = []
+  for (scenario_name, weight) in sorted(scenario_weights.items()):
+    if scenario_name not in CONST_SCENARIOS:
+      raise Exception(
+        'Error:\n' +
+        'Unknown scenario "' + scenario_name + '", expected one of: ' + ', '.join(sorted(CONST_SCENARIOS.keys()))
+      )
+    weighted_names.extend([scenario_name] * int(weight))
+  if not weighted_names:
+    raise Exception(
+      'Error:\n' +
+      'No scenarios to run'
+    )
+  return lambda: rng.choice(weighted_names)
+
+def run_worker(worker_number, base_url, scenario_weights, options, warmup_end_time, end_time, records):
+  rng = random.Random(options['random_seed'] + worker_number)
+  pick_scenario = scenario_picker(scenario_weights, rng)
+  client = Client(base_url, keep_alive=options['keep_alive'], verify_tls=options['verify_tls'])
+  worker_records = []
+  try:
+    while time.time() < end_time:
+      scenario_records = CONST_SCENARIOS[pick_scenario()](client, rng, options)
+      if time.time() >= warmup_end_time:
+        worker_records.extend(scenario_records)
+  finally:
+    client.close()
+  records.extend(worker_records)
+
+def run_load(base_url, scenario_weights, concurrency, duration_seconds, warmup_seconds=0, options=None):
+  '''
+  Runs concurrency workers against base_url for warmup_seconds and then duration_seconds, returning the request
+  records (see timed_request) made after the warmup and the measured wall time in seconds. options is a dict of
+  keep_alive, verify_tls, random_seed, tag_strings (for entries_by_tag) and login_email and login_password (for login)
+  '''
+  options = dict(options or {})
+  options.setdefault('keep_alive', True)
+  options.setdefault('verify_tls', False)
+  options.setdefault('random_seed', 0)
+  records = []
+  start_time = time.time()
+  warmup_end_time = start_time + warmup_seconds
+  end_time = warmup_end_time + duration_seconds
+  workers = [
+    threading.Thread(
+      target=run_worker,
+      args=(worker_number, base_url, scenario_weights, options, warmup_end_time, end_time, records)
+    )
+    for worker_number in range(concurrency)
+  ]
+  for worker in workers:
+    worker.daemon = True
+    worker.start()
+  for worker in workers:
+    worker.join()
+  return (records, time.time() - warmup_end_time)
+
+
+
+def percentile(sorted_values, percent):
+  '''
+  Returns the nearest-rank percent percentile of sorted_values, or None if there are none
+  '''
+  if not sorted_values:
+    return None
+  rank = int(math.ceil(percent / 100.0 * len(sorted_values)))
+  return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+def summarise_records(records, wall_seconds):
+  '''
+  Returns a dict of {request name: summary} of the request count, error count (no response or an unexpected status),
+  status counts, throughput and latency statistics in milliseconds for each request name in records
+  '''
+  records_by_name = {}
+  for record in records:
+    records_by_name.setdefault(record[0], []).append(record)
+  summaries = {}
+  for (name, name_records) in sorted(records_by_name.items()):
+    latencies = sorted([record[2] * 1000.0 for record in name_records])
+    status_counts = {}
+    for record in name_records:
+      status_key = str(record[1]) if record[1] is not None else 'no_response'
+      status_counts[status_key] = status_counts.get(status_key, 0) + 1
+    summary = {
+      'requests': len(name_records),
+      'errors': len([record for record in name_records if record[1] not in CONST_EXPECTED_STATUSES[name]]),
+      'status_counts': status_counts,
+      'throughput_rps': len(name_records) / wall_seconds if wall_seconds > 0 else None,
+      'latency_ms': {'min': latencies[0], 'mean': sum(latencies) / len(latencies), 'max': latencies[-1]}
+    }
+    for percent in CONST_PERCENTILES:
+      summary['latency_ms']['p' + str(percent)] = percentile(latencies, percent)
+    summaries[name] = summary
+  return summaries
+
+
+
+if __name__ == '__main__':
+  print('This file is not configured to be run separately; tests will come at a later date')
@@ -0,0 +1,312 @@
+'''
+Streams the application's logs and summarises them: line counts by level and module, request rates, per-route status
+counts and response time histograms, and bursts of errors
+
+Reads the lines written by the app logger (see server/app/util/logger) - "<timestamp> <LEVEL> [<module>] <message>" -
+and by the request logger, whose level is EXPRESS and whose module is the client address (see
+server/app/config/logger.js), with or without pm2's date prefix, so it reads the app, requests and node logs as well as
+pm2.log. Lines that match neither are counted as unparsed. Files are read a chunk at a time, and gzipped files (e.g.
+rotated archives) are decompressed as they are read, so memory use does not grow with the size of the logs - only with
+the number of minutes, routes and modules in them.
+
+In incremental mode the offset read up to in each file is saved in a state file, keyed by the file's device and inode so
+that a file renamed by log rotation is resumed where it was left, and only what was written since is summarised. A
+file that is shorter than its saved offset has been truncated and is read from its start. Gzipped files are not
+appended to, so they are read once, in full. Compressing a rotated file makes a new file (and inode), whose lines may
+already have been read from the live file, so incremental runs should not be given the gzipped archives of the logs
+they follow (see logstats.py)
+'''
+
+import bisect as bisect
+import calendar as calendar
+import gzip as gzip
+import json as json
+import os as os
+import re as re
+import time as time
+
+import general as general
+
+CONST_CHUNK_BYTES = 1024 * 1024
+CONST_STATE_VERSION = 1
+CONST_LATENCY_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+CONST_PERCENTILES = [50, 95, 99]
+CONST_ERROR_LEVELS = ['ERROR', 'FATAL']
+CONST_REQUEST_LEVEL = 'EXPRESS'
+CONST_BURST_WINDOW_SECONDS = 60 # errors less than this far apart are in the same burst
+CONST_BURST_MIN_ERRORS = 10
+
+# pm2's log_date_format (see scripts/pm2-config.json) prefix, then the app and request loggers' lines
+CONST_PM2_PREFIX_PATTERN = re.compile(r'\d{4}-\d\d-\d\d \d\d:\d\d(?::\d\d)? [+-]\d\d:?\d\d: ')
+CONST_LINE_PATTERN = re.compile(r'(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)(?:\.\d+)? ([A-Z]+) \[([^\]]*)\] ?(.*)')
+CONST_REQUEST_PATTERN = re.compile(r'"([A-Z]+) (\S+) HTTP/[\d.]+" (\d{3})?\s*(?:(\d+(?:\.\d+)?)ms)?')
+CONST_ID_SEGMENT_PATTERN = re.compile(r'^(\d+|[0-9a-fA-F-]{16,})$')
+
+def new_stats():
+  return {
+    'lines': 0,
+    'unparsed_lines': 0,
+    'first_time': None,
+    'last_time': None,
+    'levels': {},
+    'modules': {},
+    'requests_per_minute': {},
+    'routes': {},
+    'errors_per_second': {}
+  }
+
+def route_of(method, url):
+  '''
+  Returns the route of a request, its method and path without the query string and with ids replaced with :id
+  '''
+  path = url.split('?', 1)[0]
+  return method + ' ' + '/'.join([':id' if CONST_ID_SEGMENT_PATTERN.match(segment) else segment
+    for segment in path.split('/')])
+
+def record_error(stats, second, source):
+  errors = stats['errors_per_second'].setdefault(second, {})
+  errors[source] = errors.get(source, 0) + 1
+
+def add_request(stats, second, message):
+  request_match = CONST_REQUEST_PATTERN.match(message)
+  if request_match is None:
+    return
+  (method, url, status, response_ms) = request_match.groups()
+  minute = second[:16]
+  stats['requests_per_minute'][minute] = stats['requests_per_minute'].get(minute, 0) + 1
+  route = stats['routes'].setdefault(route_of(method, url), {
+    'count': 0,
+    'statuses': {},
+    'timed': 0,
+    'total_ms': 0.0,
+    'max_ms': 0.0,
+    'histogram': [0] * (len(CONST_LATENCY_BUCKETS_MS) + 1)
+  })
+  route['count'] += 1
+  status = status or '-'
+  route['statuses'][status] = route['statuses'].get(status, 0) + 1
+  if status.startswith('5'):
+    record_error(stats, second, route_of(method, url))
+  if response_ms is not None:
+    response_ms = float(response_ms)
+    route['timed'] += 1
+    route['total_ms'] += response_ms
+    route['max_ms'] = max(route['max_ms'], response_ms)
+    route['histogram'][bisect.bisect_left(CONST_LATENCY_BUCKETS_MS, response_ms)] += 1
+
+def add_line(stats, line):
+  '''
+  Adds one log line (without its line ending) to stats
+  '''
+  stats['lines'] += 1
+  prefix_match = CONST_PM2_PREFIX_PATTERN.match(line)
+  line_match = CONST_LINE_PATTERN.match(line, prefix_match.end() if prefix_match else 0)
+  if line_match is None:
+    stats['unparsed_lines'] += 1
+    return
+  (second, level, module, message) = line_match.groups()
+  if stats['first_time'] is None or second < stats['first_time']:
+    stats['first_time'] = second
+  if stats['last_time'] is None or second > stats['last_time']:
+    stats['last_time'] = second
+  stats['levels'][level] = stats['levels'].get(level, 0) + 1
+  if level == CONST_REQUEST_LEVEL:
+    add_request(stats, second, message)
+    return
+  module_stats = stats['modules'].setdefault(module, {'lines': 0, 'errors': 0})
+  module_stats['lines'] += 1
+  if level in CONST_ERROR_LEVELS:
+    module_stats['errors'] += 1
+    record_error(stats, second, module)
+
+
+
+def read_lines(file_path, offset=0):
+  '''
+  Yields (line, offset after the line) for every complete line of the file at file_path from offset onwards, reading
+  CONST_CHUNK_BYTES at a time. A last line without a line ending is still being written, so it is not yielded. Gzipped
+  files are read from their start and their offsets are of their uncompressed contents
+  '''
+  if file_path.endswith('.gz'):
+    log_file = gzip.open(file_path, 'rb')
+    offset = 0
+  else:
+    log_file = open(file_path, 'rb')
+    log_file.seek(offset)
+  try:
+    remainder = ''
+    for chunk in iter(lambda: log_file.read(CONST_CHUNK_BYTES), ''):
+      lines = (remainder + chunk).split('\n')
+      remainder = lines.pop()
+      for line in lines:
+        offset += len(line) + 1
+        yield (line.rstrip('\r'), offset)
+  finally:
+    log_file.close()
+
+def file_key(file_path):
+  file_stat = os.stat(file_path)
+  return str(file_stat.st_dev) + ':' + str(file_stat.st_ino)
+
+def read_state(state_path):
+  if state_path is None or not os.path.isfile(state_path):
+    return {'version': CONST_STATE_VERSION, 'files': {}}
+  with open(state_path, 'r') as state_file:
+    state = json.load(state_file)
+  if state.get('version') != CONST_STATE_VERSION:
+    raise Exception(
+      'Error:\n' +
+      'Log offsets state "' + state_path + '" has unsupported version ' + repr(state.get('version'))
+    )
+  return state
+
+def write_state(state_path, state):
+  general.write_file_atomically(state_path,
+    json.dumps(state, indent=2, separators=(',', ': '), sort_keys=True) + '\n')
+
+def summarise_files(file_paths, state_path=None):
+  '''
+  Returns the stats of the lines in file_paths, and a list of {'path', 'start_offset', 'end_offset', 'lines'} of what
+  was read from each. If state_path is given, each file is read from the offset saved in it (see the module docstring)
+  and the offsets read up to are saved back
+  '''
+  state = read_state(state_path)
+  stats = new_stats()
+  files = []
+  for file_path in file_paths:
+    key = file_key(file_path)
+    saved_offset = state['files'].get(key, {}).get('offset', 0)
+    if file_path.endswith('.gz') and key in state['files']:
+      files.append({'path': file_path, 'start_offset': saved_offset, 'end_offset': saved_offset, 'lines': 0})
+      continue
+    start_offset = saved_offset if saved_offset <= os.path.getsize(file_path) else 0
+    end_offset = start_offset
+    line_count = 0
+    for (line, end_offset) in read_lines(file_path, start_offset):
+      add_line(stats, line)
+      line_count += 1
+    files.append({'path': file_path, 'start_offset': start_offset, 'end_offset': end_offset, 'lines': line_count})
+    state['files'][key] = {'path': file_path, 'offset': end_offset}
+  if state_path is not None:
+    present_keys = set([file_key(file_path) for file_path in file_paths])
+    state['files'] = dict([(key, entry) for (key, entry) in state['files'].items()
+      if key in present_keys or os.path.exists(entry['path'])])
+    write_state(state_path, state)
+  return (stats, files)
+
+
+
+def histogram_percentile(histogram, count, percent):
+  '''
+  Returns the upper bound in milliseconds of the histogram bucket holding the nearest-rank percent percentile, None for
+  the last, unbounded bucket
+  '''
+  rank = max(int(-(-percent * count // 100)), 1)
+  cumulative = 0
+  for (bucket_index, bucket_count) in enumerate(histogram):
+    cumulative += bucket_count
+    if cumulative >= rank:
+      return CONST_LATENCY_BUCKETS_MS[bucket_index] if bucket_index < len(CONST_LATENCY_BUCKETS_MS) else None
+  return None
+
+def second_timestamp(second):
+  return calendar.timegm(time.strptime(second, '%Y-%m-%d %H:%M:%S'))
+
+def error_bursts(errors_per_second, window_seconds=CONST_BURST_WINDOW_SECONDS, min_errors=CONST_BURST_MIN_ERRORS):
+  '''
+  Returns the bursts of errors - runs of errors less than window_seconds apart - with at least min_errors errors, as
+  {'start', 'end', 'errors', 'sources'} dicts where sources are the modules or routes with the most errors in the burst
+  '''
+  bursts = []
+  current = None
+  for second in sorted(errors_per_second.keys()) + [None]:
+    if second is not None and current is not None and \
+      second_timestamp(second) - second_timestamp(current['end']) < window_seconds:
+      current['end'] = second
+    else:
+      if current is not None and current['errors'] >= min_errors:
+        current['sources'] = [source for (source, count) in
+          sorted(current['sources'].items(), key=lambda item: (-item[1], item[0]))][:3]
+        bursts.append(current)
+      if second is None:
+        break
+      current = {'start': second, 'end': second, 'errors': 0, 'sources': {}}
+    for (source, count) in errors_per_second[second].items():
+      current['errors'] += count
+      current['sources'][source] = current['sources'].get(source, 0) + count
+  return bursts
+
+def build_report(stats, files, window_seconds=CONST_BURST_WINDOW_SECONDS, min_errors=CONST_BURST_MIN_ERRORS):
+  '''
+  Returns the JSON serialisable report of stats (see summarise_files)
+  '''
+  requests_per_minute = stats['requests_per_minute']
+  request_count = sum(requests_per_minute.values())
+  peak_minute = max(requests_per_minute.keys(), key=lambda minute: requests_per_minute[minute]) \
+    if requests_per_minute else None
+  routes = {}
+  for (route, route_stats) in stats['routes'].items():
+    routes[route] = {
+      'count': route_stats['count'],
+      'statuses': route_stats['statuses'],
+      'timed': route_stats['timed'],
+      'mean_ms': route_stats['total_ms'] / route_stats['timed'] if route_stats['timed'] else None,
+      'max_ms': route_stats['max_ms'] if route_stats['timed'] else None,
+      'histogram': dict(zip(['<=' + str(bound) for bound in CONST_LATENCY_BUCKETS_MS] +
+        ['>' + str(CONST_LATENCY_BUCKETS_MS[-1])], route_stats['histogram']))
+    }
+    for percent in CONST_PERCENTILES:
+      routes[route]['p' + str(percent) + '_ms'] = histogram_percentile(route_stats['histogram'],
+        route_stats['timed'], percent) if route_stats['timed'] else None
+  return {
+    'files': files,
+    'lines': stats['lines'],
+    'unparsed_lines': stats['unparsed_lines'],
+    'first_time': stats['first_time'],
+    'last_time': stats['last_time'],
+    'levels': stats['levels'],
+    'modules': stats['modules'],
+    'requests': {
+      'count': request_count,
+      'minutes': len(requests_per_minute),
+      'mean_per_minute': float(request_count) / len(requests_per_minute) if requests_per_minute else None,
+      'peak_minute': peak_minute,
+      'peak_per_minute': requests_per_minute[peak_minute] if peak_minute else None
+    },
+    'routes': routes,
+    'error_bursts': error_bursts(stats['errors_per_second'], window_seconds, min_errors)
+  }
+
+def print_report(report, top_count=10):
+  print('Read ' + str(report['lines']) + ' line(s) (' + str(report['unparsed_lines']) + ' unparsed) from ' +
+    str(len(report['files'])) + ' file(s), ' + str(report['first_time']) + ' to ' + str(report['last_time']))
+  print('Levels: ' + ', '.join([level + ' ' + str(count) for (level, count) in sorted(report['levels'].items())]))
+  requests = report['requests']
+  if requests['count']:
+    print('Requests: %d over %d minute(s) with requests, %.1f/minute, peaking at %d/minute at %s' % (
+      requests['count'], requests['minutes'], requests['mean_per_minute'], requests['peak_per_minute'],
+      requests['peak_minute']))
+    print('%-40s %8s %8s %8s %8s %8s  %s' % ('route', 'count', 'mean ms', 'p50 <=', 'p95 <=', 'p99 <=', 'statuses'))
+    for (route, route_report) in sorted(report['routes'].items(), key=lambda item: -item[1]['count'])[:top_count]:
+      print('%-40s %8d %8s %8s %8s %8s  %s' % (
+        route[:40],
+        route_report['count'],
+        '-' if route_report['mean_ms'] is None else '%.1f' % route_report['mean_ms'],
+        route_report['p50_ms'] or '-',
+        route_report['p95_ms'] or '-',
+        route_report['p99_ms'] or '-',
+        ', '.join([status + ' ' + str(count) for (status, count) in sorted(route_report['statuses'].items())])
+      ))
+  print('Busiest modules: ' + ', '.join([module + ' ' + str(module_stats['lines']) + ' (' +
+    str(module_stats['errors']) + ' errors)' for (module, module_stats) in
+    sorted(report['modules'].items(), key=lambda item: -item[1]['lines'])[:top_count]]))
+  if not report['error_bursts']:
+    print('No error bursts')
+  for burst in report['error_bursts']:
+    print('Error burst: ' + str(burst['errors']) + ' error(s) from ' + burst['start'] + ' to ' + burst['end'] +
+      ', mostly ' + ', '.join(burst['sources']))
+
+
+
+if __name__ == '__main__':
+  print('This file is not configured to be run separately; tests will come at a later date')
@@ -0,0 +1,160 @@
+'''
+Loads the configure.yaml manifest of inputs and outputs
+
+Parsing YAML is slow, so the validated manifest is cached as JSON next to the YAML file, keyed by a hash of the YAML
+file's contents. yaml is only imported when the cache is missing or stale, and then the C loader is used if available
+'''
+
+import hashlib as hashlib
+import json as json
+import os.path as path
+import re as re
+
+import general as general
+
+CONST_MANIFEST_CACHE_VERSION = 2
+CONST_INPUT_KEYS = ['valkey', 'name', 'desc', 'current_val_rel_filepath', 'current_val_regex', 'validation_regex']
+CONST_OUTPUT_KEYS = ['output_rel_filepath', 'output_regex_string', 'value_template']
+
+def manifest_cache_path(manifest_path):
+  return manifest_path + '.cache.json'
+
+
+
+def value_template_valkeys(value_template):
+  '''
+  Returns the list of input valkeys used by value_template, e.g. ['db_name'] for '%(db_name)s'
+  '''
+  return re.findall('%\(([a-zA-Z_]+)\)s', value_template)
+
+
+
+def parse_manifest_yaml(manifest_string):
+  import yaml as yaml
+  return yaml.load(manifest_string, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+
+
+
+def compile_manifest(manifest_data, manifest_path='configure.yaml'):
+  '''
+  Validates the parsed manifest_data, returning a manifest dict of {'inputs': [input dict], 'outputs': [output dict]}
+  where each output dict also lists the input valkeys its value_template uses under 'valkeys' and its optional
+  state_valkey, the valkey its value is saved under in the configuration state (see lib/configstate.py), or None.
+  Raises an error if a key is missing, a regex does not compile, a valkey is defined twice or a value_template uses an
+  undefined valkey
+  '''
+  inputs = []
+  valkeys = set()
+  for ival in manifest_data['inputs']:
+    check_has_keys(ival, CONST_INPUT_KEYS, manifest_path)
+    if ival['valkey'] in valkeys:
+      raise Exception(
+        'Error:\n' +
+        '"' + ival['valkey'] + '" already defined in inputs'
+      )
+    check_compiles(ival['current_val_regex'], manifest_path)
+    check_compiles(ival['validation_regex'], manifest_path)
+    valkeys.add(ival['valkey'])
+    inputs.append(dict([(key, ival[key]) for key in CONST_INPUT_KEYS]))
+
+  outputs = []
+  state_valkeys = set()
+  for oval in manifest_data['outputs']:
+    check_has_keys(oval, CONST_OUTPUT_KEYS, manifest_path)
+    check_compiles(oval['output_regex_string'], manifest_path)
+    output = dict([(key, oval[key]) for key in CONST_OUTPUT_KEYS])
+    output['valkeys'] = value_template_valkeys(oval['value_template'])
+    output['state_valkey'] = oval.get('state_valkey')
+    if output['state_valkey'] is not None:
+      if output['state_valkey'] in valkeys or output['state_valkey'] in state_valkeys:
+        raise Exception(
+          'Error:\n' +
+          '"' + output['state_valkey'] + '" already defined in inputs or by another output'
+        )
+      state_valkeys.add(output['state_valkey'])
+    for valkey in output['valkeys']:
+      if valkey not in valkeys:
+        raise Exception(
+          'Error:\n' +
+          '"' + valkey + '" does not exist in inputs'
+        )
+    outputs.append(output)
+  return {'inputs': inputs, 'outputs': outputs}
+
+def check_has_keys(manifest_entry, keys, manifest_path):
+  for key in keys:
+    if key not in manifest_entry:
+      raise Exception(
+        'Error:\n' +
+        repr(manifest_entry) + ' in ' + manifest_path + ' does not have a "' + key + '"'
+      )
+
+def check_compiles(regex_string, manifest_path):
+  try:
+    general.compiled_pattern(regex_string)
+  except re.error as e:
+    raise Exception(
+      'Error:\n' +
+      'The pattern "' + regex_string + '" in ' + manifest_path + ' is not a valid regex: ' + str(e)
+    )
+
+
+
+def read_manifest_cache(cache_path, manifest_hash):
+  '''
+  Returns the cached manifest dict if cache_path exists and was written for manifest_hash, otherwise None
+  '''
+  if not path.isfile(cache_path):
+    return None
+  try:
+    with open(cache_path, 'r') as cache_file:
+      cache_data = json.load(cache_file)
+  except ValueError:
+    return None
+  if cache_data.get('version') != CONST_MANIFEST_CACHE_VERSION or cache_data.get('manifest_hash') != manifest_hash:
+    return None
+  return encode_strings(cache_data['manifest'])
+
+def encode_strings(data):
+  '''
+  Returns data with the unicode strings json loads converted to UTF-8 byte strings, like the rest of the file handling
+  '''
+  if isinstance(data, dict):
+    return dict([(encode_strings(key), encode_strings(value)) for (key, value) in data.items()])
+  elif isinstance(data, list):
+    return [encode_strings(item) for item in data]
+  elif isinstance(data, unicode):
+    return data.encode('utf-8')
+  return data
+
+def write_manifest_cache(cache_path, manifest_hash, manifest):
+  '''
+  Writes the manifest cache, warning rather than failing if it cannot be written (e.g. a read only install directory)
+  '''
+  cache_data = {'version': CONST_MANIFEST_CACHE_VERSION, 'manifest_hash': manifest_hash, 'manifest': manifest}
+  try:
+    general.write_file_atomically(cache_path, json.dumps(cache_data, separators=(',', ':')))
+  except (IOError, OSError) as e:
+    print('Warning: could not write manifest cache ' + cache_path + ': ' + str(e))
+
+
+
+def load_manifest(manifest_path):
+  '''
+  Returns the compiled manifest dict (see compile_manifest) for the YAML file at manifest_path, from the cache if it is
+  up to date
+  '''
+  with open(manifest_path, 'rb') as manifest_file:
+    manifest_string = manifest_file.read()
+  manifest_hash = hashlib.sha1(manifest_string).hexdigest()
+  cache_path = manifest_cache_path(manifest_path)
+  manifest = read_manifest_cache(cache_path, manifest_hash)
+  if manifest is None:
+    manifest = compile_manifest(encode_strings(parse_manifest_yaml(manifest_string)), manifest_path)
+    write_manifest_cache(cache_path, manifest_hash, manifest)
+  return manifest
+
+
+
+if __name__ == '__main__':
+  print('This file is not configured to be run separately; tests will come at a later date')
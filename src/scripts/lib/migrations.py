@@ -0,0 +1,205 @@
+'''
+Numbered, online schema migrations for upgrades
+
+A new install's schema is created from the Sequelize models (see install.initialise_schema), which drops every table, so
+an upgrade instead applies the migrations that the database has not had yet. The versions applied are recorded in the
+schema's schema_migrations table; a new install records every migration as applied, as its schema is already current.
+
+A migration is a dict of a version number, a name and a list of steps, run in order:
+- {'sql': [statements], 'transactional': True} runs the statements in one psql session, in one transaction unless
+  transactional is False (e.g. for CREATE INDEX CONCURRENTLY)
+- {'backfill': {'table', 'set', 'where', 'batch_size', 'key'}} runs UPDATE table SET set on batch_size rows matching
+  where at a time, each batch committing on its own, until no rows match. where must stop matching a row once it has
+  been updated (e.g. new_column IS NULL). key is the table's primary key column, id by default
+
+For example, adding a column that the running release does not use yet, filling it in and then giving it a default:
+  {'version': 1, 'name': 'entry body length', 'steps': [
+    {'sql': ['ALTER TABLE entry ADD COLUMN body_length integer;']},
+    {'backfill': {'table': 'entry', 'set': 'body_length = length(body)', 'where': 'body_length IS NULL',
+      'batch_size': 5000}},
+    {'sql': ['ALTER TABLE entry ALTER COLUMN body_length SET DEFAULT 0;']}
+  ]}
+
+Every session runs as the application's database user with the schema on its search path and a lock timeout, so that a
+statement waiting behind the running application's queries for a lock fails (and is retried) instead of blocking them.
+Steps should be safe to run again, as a migration that fails part way is run again from its first step
+'''
+
+import time as time
+
+import db as db
+
+CONST_VERSION_TABLE = 'schema_migrations'
+CONST_LOCK_TIMEOUT_MS = 5000
+CONST_LOCK_RETRIES = 3
+CONST_LOCK_RETRY_PAUSE_SECONDS = 5
+CONST_DEFAULT_BATCH_SIZE = 1000
+CONST_LOCK_TIMEOUT_ERROR = 'lock timeout'
+
+def quote_literal(value):
+  return "'" + str(value).replace("'", "''") + "'"
+
+def session_statements(user, schema, lock_timeout_ms):
+  '''
+  Returns the statements that start every migration session: run as user, in schema, with a lock timeout
+  '''
+  return [
+    'SET ROLE ' + user + ';',
+    'SET search_path TO ' + schema + ';',
+    'SET lock_timeout = ' + str(int(lock_timeout_ms)) + ';'
+  ]
+
+def validate_migrations(migrations):
+  '''
+  Raises an error if the migrations' versions are not unique and in increasing order
+  '''
+  versions = [migration['version'] for migration in migrations]
+  if versions != sorted(set(versions)):
+    raise Exception(
+      'Error:\n' +
+      'Migration versions must be unique and in increasing order, got: ' + ', '.join([str(v) for v in versions])
+    )
+
+
+
+def ensure_version_table(user, schema, database, psql_command=None):
+  db.execute_statements(session_statements(user, schema, CONST_LOCK_TIMEOUT_MS) + [
+    'CREATE TABLE IF NOT EXISTS ' + CONST_VERSION_TABLE + ' (version integer PRIMARY KEY, name text NOT NULL, ' +
+    'applied_at timestamp with time zone NOT NULL DEFAULT now(), seconds double precision);'
+  ], database=database, transactional=True, psql_command=psql_command)
+
+def version_table_exists(schema, database, psql_command=None):
+  rows = db.query('SELECT count(*) FROM pg_tables WHERE schemaname = ' + quote_literal(schema) + ' AND tablename = ' +
+    quote_literal(CONST_VERSION_TABLE) + ';', database, psql_command)
+  return int(rows[0][0]) > 0
+
+def applied_versions(schema, database, psql_command=None):
+  '''
+  Returns the set of migration versions applied to schema
+  '''
+  if not version_table_exists(schema, database, psql_command):
+    return set()
+  rows = db.query('SELECT version FROM ' + schema + '.' + CONST_VERSION_TABLE + ';', database, psql_command)
+  return set([int(row[0]) for row in rows])
+
+def pending_migrations(migrations, versions):
+  return [migration for migration in migrations if migration['version'] not in versions]
+
+def record_statement(migration, seconds):
+  return 'INSERT INTO ' + CONST_VERSION_TABLE + ' (version, name, seconds) VALUES (' + str(migration['version']) + \
+    ', ' + quote_literal(migration['name']) + ', ' + ('NULL' if seconds is None else '%.3f' % seconds) + ');'
+
+
+
+def backfill_statement(backfill):
+  '''
+  Returns the statement that updates one batch of backfill and returns the number of rows it updated
+  '''
+  key = backfill.get('key', 'id')
+  batch_size = int(backfill.get('batch_size', CONST_DEFAULT_BATCH_SIZE))
+  return 'WITH updated AS (UPDATE ' + backfill['table'] + ' SET ' + backfill['set'] + ' WHERE ' + key + \
+    ' IN (SELECT ' + key + ' FROM ' + backfill['table'] + ' WHERE ' + backfill['where'] + ' LIMIT ' + \
+    str(batch_size) + ') RETURNING 1) SELECT count(*) FROM updated;'
+
+def describe_step(step):
+  if 'backfill' in step:
+    return 'backfill, ' + str(step['backfill'].get('batch_size', CONST_DEFAULT_BATCH_SIZE)) + ' rows per batch: ' + \
+      backfill_statement(step['backfill'])
+  return ('' if step.get('transactional', True) else 'not in a transaction: ') + ' '.join(step['sql'])
+
+def print_plan(migrations, applied):
+  '''
+  Prints the migrations that would be applied, and their steps
+  '''
+  pending = pending_migrations(migrations, applied)
+  print('Applied migrations: ' + (', '.join([str(v) for v in sorted(applied)]) if applied else 'none'))
+  if not pending:
+    print('No migrations to apply')
+  for migration in pending:
+    print('Migration ' + str(migration['version']) + ': ' + migration['name'])
+    for (step_index, step) in enumerate(migration['steps']):
+      print('  (' + str(step_index + 1) + ') ' + describe_step(step))
+
+
+
+def with_lock_retries(run, description, retries=CONST_LOCK_RETRIES):
+  '''
+  Returns run(), running it again (up to retries times) if it fails because it timed out waiting for a lock
+  '''
+  attempt = 0
+  while True:
+    try:
+      return run()
+    except Exception as e:
+      if CONST_LOCK_TIMEOUT_ERROR not in str(e) or attempt >= retries:
+        raise
+      attempt += 1
+      print('Timed out waiting for a lock on ' + description + ', retrying in ' +
+        str(CONST_LOCK_RETRY_PAUSE_SECONDS * attempt) + 's (' + str(attempt) + '/' + str(retries) + ')')
+      time.sleep(CONST_LOCK_RETRY_PAUSE_SECONDS * attempt)
+
+def run_backfill(backfill, user, schema, database, psql_command, lock_timeout_ms):
+  '''
+  Runs backfill a batch at a time, each in its own session and transaction, until a batch updates no rows. Returns the
+  number of rows updated
+  '''
+  sql = ' '.join(session_statements(user, schema, lock_timeout_ms) + [backfill_statement(backfill)])
+  total_rows = 0
+  while True:
+    rows = with_lock_retries(lambda: db.query(sql, database, psql_command), 'a backfill batch of ' + backfill['table'])
+    batch_rows = int(rows[-1][0])
+    total_rows += batch_rows
+    if batch_rows == 0:
+      return total_rows
+    print('Backfilled ' + str(total_rows) + ' row(s) of ' + backfill['table'])
+    if backfill.get('pause_seconds'):
+      time.sleep(backfill['pause_seconds'])
+
+def plan(migrations, schema, database, psql_command=None):
+  '''
+  Prints and returns the migrations that have not been applied to schema, in version order. Makes no changes
+  '''
+  validate_migrations(migrations)
+  applied = applied_versions(schema, database, psql_command)
+  print_plan(migrations, applied)
+  return pending_migrations(migrations, applied)
+
+def apply(pending, user, schema, database, psql_command=None, lock_timeout_ms=CONST_LOCK_TIMEOUT_MS):
+  '''
+  Applies the pending migrations (see plan) in order, recording each once all of its steps have run
+  '''
+  ensure_version_table(user, schema, database, psql_command)
+  for migration in pending:
+    print('Applying migration ' + str(migration['version']) + ': ' + migration['name'])
+    start_time = time.time()
+    for step in migration['steps']:
+      if 'backfill' in step:
+        run_backfill(step['backfill'], user, schema, database, psql_command, lock_timeout_ms)
+      else:
+        with_lock_retries(lambda: db.execute_statements(
+          session_statements(user, schema, lock_timeout_ms) + step['sql'],
+          database=database,
+          transactional=step.get('transactional', True),
+          psql_command=psql_command
+        ), 'migration ' + str(migration['version']))
+    db.execute_statements(
+      session_statements(user, schema, lock_timeout_ms) + [record_statement(migration, time.time() - start_time)],
+      database=database, transactional=True, psql_command=psql_command
+    )
+
+def stamp(migrations, user, schema, database, psql_command=None):
+  '''
+  Records every migration as applied without running it, for a schema that was just created from the models
+  '''
+  validate_migrations(migrations)
+  ensure_version_table(user, schema, database, psql_command)
+  db.execute_statements(
+    session_statements(user, schema, CONST_LOCK_TIMEOUT_MS) + ['DELETE FROM ' + CONST_VERSION_TABLE + ';'] +
+      [record_statement(migration, None) for migration in migrations],
+    database=database, transactional=True, psql_command=psql_command
+  )
+
+
+
+if __name__ == '__main__':
+  print('This file is not configured to be run separately; tests will come at a later date')
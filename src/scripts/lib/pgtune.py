@@ -0,0 +1,128 @@
+'''
+Recommends Postgres server settings for the host it shares with the application and applies them with ALTER SYSTEM
+
+A stock Postgres uses 128MB of shared buffers and 4MB of work memory whatever the host, so the entry/tag joins spill to
+disk and are planned as if there were no OS cache. The recommendations follow the usual rules for a dedicated web
+application database: a quarter of the memory for shared buffers, three quarters as the effective cache size, work
+memory that every application connection (workers x pool size) can use at once in a few sorts or hashes, and parallel
+workers from the CPU count. As Postgres shares the host with the application, the memory is the host's memory less the
+application's share (see lib/pm2.py).
+
+ALTER SYSTEM writes the settings to postgresql.auto.conf, so they can be undone with ALTER SYSTEM RESET. Settings that
+the server does not have (older versions) are not changed. The configuration is reloaded afterwards, but settings such
+as shared_buffers only apply once the server is restarted, which is left to the user
+'''
+
+import db as db
+import pm2 as pm2
+
+CONST_SETTINGS = [
+  'shared_buffers', 'effective_cache_size', 'work_mem', 'maintenance_work_mem', 'max_worker_processes',
+  'max_parallel_workers', 'max_parallel_workers_per_gather'
+]
+CONST_SETTINGS_QUERY = """
+SELECT name, setting, coalesce(unit, ''), context FROM pg_settings WHERE name IN ({names}) ORDER BY name;
+"""
+CONST_UNIT_KB = {'kB': 1, '8kB': 8, 'MB': 1024, '16MB': 16 * 1024, 'GB': 1024 * 1024}
+CONST_MIN_WORK_MEM_KB = 4 * 1024 # the Postgres default
+CONST_MAX_MAINTENANCE_WORK_MEM_KB = 2 * 1024 * 1024
+CONST_SORTS_PER_QUERY = 3 # sorts and hashes a query may run at once, each using work_mem
+CONST_MAX_PARALLEL_WORKERS_PER_GATHER = 4
+CONST_MIN_WORKER_PROCESSES = 8 # the Postgres default, also used by extensions and logical replication
+
+def recommend_settings(cpu_count, memory_bytes, connections):
+  '''
+  Returns {setting name: value in kB or count} for a host with cpu_count CPUs and memory_bytes of memory, of which the
+  application's share (see pm2.CONST_NODE_MEMORY_SHARE) is left to the application, serving connections connections
+  '''
+  memory_kb = int(memory_bytes * (1 - pm2.CONST_NODE_MEMORY_SHARE) / 1024)
+  shared_buffers_kb = memory_kb / 4
+  parallel_workers_per_gather = min(CONST_MAX_PARALLEL_WORKERS_PER_GATHER, cpu_count / 2)
+  work_mem_kb = (memory_kb - shared_buffers_kb) / (max(connections, 1) * CONST_SORTS_PER_QUERY) / \
+    max(parallel_workers_per_gather, 1)
+  return {
+    'shared_buffers': shared_buffers_kb,
+    'effective_cache_size': memory_kb * 3 / 4,
+    'work_mem': max(work_mem_kb, CONST_MIN_WORK_MEM_KB),
+    'maintenance_work_mem': min(memory_kb / 16, CONST_MAX_MAINTENANCE_WORK_MEM_KB),
+    'max_worker_processes': max(cpu_count, CONST_MIN_WORKER_PROCESSES),
+    'max_parallel_workers': cpu_count,
+    'max_parallel_workers_per_gather': parallel_workers_per_gather
+  }
+
+def current_settings(psql_command=None):
+  '''
+  Returns {setting name: {'value', 'memory', 'restart'}} of the settings in CONST_SETTINGS that the server has, where
+  memory settings' values are in kB and restart is whether the server has to be restarted for a change to apply
+  '''
+  rows = db.query(CONST_SETTINGS_QUERY.replace('{names}', ', '.join(["'" + name + "'" for name in CONST_SETTINGS])),
+    psql_command=psql_command)
+  settings = {}
+  for (name, setting, unit, context) in rows:
+    settings[name] = {
+      'value': int(setting) * CONST_UNIT_KB.get(unit, 1),
+      'memory': unit in CONST_UNIT_KB,
+      'restart': context == 'postmaster'
+    }
+  return settings
+
+def format_value(value, memory):
+  if not memory:
+    return str(value)
+  if value % (1024 * 1024) == 0:
+    return str(value / (1024 * 1024)) + 'GB'
+  if value % 1024 == 0:
+    return str(value / 1024) + 'MB'
+  return str(value) + 'kB'
+
+
+
+def settings_diff(current, recommended):
+  '''
+  Returns the changes from current (see current_settings) to recommended (see recommend_settings), as a list of
+  {'name', 'current', 'recommended', 'restart'} dicts with formatted values, for the settings the server has
+  '''
+  changes = []
+  for name in CONST_SETTINGS:
+    if name not in current or name not in recommended:
+      continue
+    if current[name]['memory']:
+      recommended_value = recommended[name] / 1024 * 1024 # whole MB, as it is shown
+    else:
+      recommended_value = recommended[name]
+    if current[name]['value'] != recommended_value:
+      changes.append({
+        'name': name,
+        'current': format_value(current[name]['value'], current[name]['memory']),
+        'recommended': format_value(recommended_value, current[name]['memory']),
+        'restart': current[name]['restart']
+      })
+  return changes
+
+def print_diff(changes):
+  if not changes:
+    print('The server already has the recommended settings')
+    return
+  print('%-32s %12s    %s' % ('setting', 'current', 'recommended'))
+  for change in changes:
+    print(('%-32s %12s -> %-12s%s' % (change['name'], change['current'], change['recommended'],
+      '  (on restart)' if change['restart'] else '')).rstrip())
+
+def apply_changes(changes, psql_command=None):
+  '''
+  Writes changes (see settings_diff) with ALTER SYSTEM and reloads the server's configuration. ALTER SYSTEM cannot run
+  in a transaction, so the statements are not transactional
+  '''
+  db.execute_statements(
+    ['ALTER SYSTEM SET ' + change['name'] + " = '" + change['recommended'] + "';" for change in changes] +
+      ['SELECT pg_reload_conf();'],
+    psql_command=psql_command
+  )
+  restart_names = [change['name'] for change in changes if change['restart']]
+  if restart_names:
+    print('Restart Postgres (e.g. sudo service postgresql restart) for ' + ', '.join(restart_names) + ' to apply')
+
+
+
+if __name__ == '__main__':
+  print('This file is not configured to be run separately; tests will come at a later date')
@@ -0,0 +1,136 @@
+'''
+Generates the production pm2 configuration from the host's resources and registers it with pm2
+
+The pm2-config.json shipped in scripts/ is a development configuration: one instance and watching the whole tree for
+changes. For production the instance count is derived from the CPU count (leaving a core for postgres on larger hosts),
+each instance is restarted if it grows past its share of the host's memory and watching is disabled - or, if enabled,
+limited to the server code
+'''
+
+import json as json
+import multiprocessing as multiprocessing
+import os as os
+import subprocess as subprocess
+import time as time
+
+import events as events
+import general as general
+
+CONST_PM2_CONFIG_REL_PATH = 'scripts/pm2-config.json'
+CONST_PM2_COMMAND = ['pm2']
+
+CONST_NODE_MEMORY_SHARE = 0.5 # of the host's memory, the rest is left for postgres, redis and the OS
+CONST_MIN_MAX_MEMORY_MB = 128
+CONST_MAX_MAX_MEMORY_MB = 1024
+CONST_KILL_TIMEOUT_MS = 5000 # time an instance has to finish its requests on a graceful reload before it is killed
+CONST_LISTEN_TIMEOUT_MS = 8000 # time a reloaded instance has to start listening before the old one is stopped anyway
+CONST_WATCH_PATHS = ['server/app']
+CONST_IGNORE_WATCH = ['[\\/\\\\]\\./', 'node_modules', 'bower_components', 'logs']
+
+# The settings that can be overridden with the pm2 dict of an answers file
+CONST_SETTING_KEYS = ['instances', 'max_memory_restart', 'watch', 'kill_timeout', 'listen_timeout']
+
+def host_resources():
+  '''
+  Returns (CPU count, total memory in bytes) of this host
+  '''
+  memory_bytes = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+  return (multiprocessing.cpu_count(), memory_bytes)
+
+def recommended_settings(cpu_count, memory_bytes):
+  '''
+  Returns the recommended pm2 settings dict (see CONST_SETTING_KEYS) for a host with cpu_count CPUs and memory_bytes of
+  memory
+  '''
+  instances = cpu_count - 1 if cpu_count > 2 else cpu_count
+  max_memory_mb = int(memory_bytes * CONST_NODE_MEMORY_SHARE / instances / (1024 * 1024))
+  max_memory_mb = max(CONST_MIN_MAX_MEMORY_MB, min(CONST_MAX_MAX_MEMORY_MB, max_memory_mb))
+  return {
+    'instances': instances,
+    'max_memory_restart': str(max_memory_mb) + 'M',
+    'watch': False,
+    'kill_timeout': CONST_KILL_TIMEOUT_MS,
+    'listen_timeout': CONST_LISTEN_TIMEOUT_MS
+  }
+
+
+
+def build_config(base_config, settings, app_path):
+  '''
+  Returns the pm2 configuration dict built from base_config (the shipped pm2-config.json) and settings, run from
+  app_path (the application symlink, so that the configuration stays valid across upgrades)
+  '''
+  pm2_config = dict(base_config)
+  pm2_config['cwd'] = app_path
+  pm2_config['exec_mode'] = 'cluster_mode'
+  pm2_config['instances'] = int(settings['instances'])
+  pm2_config['max_memory_restart'] = str(settings['max_memory_restart'])
+  pm2_config['kill_timeout'] = int(settings['kill_timeout'])
+  pm2_config['listen_timeout'] = int(settings['listen_timeout'])
+  if settings['watch']:
+    pm2_config['watch'] = list(CONST_WATCH_PATHS)
+    pm2_config['ignore_watch'] = list(CONST_IGNORE_WATCH)
+  else:
+    pm2_config['watch'] = False
+    pm2_config.pop('ignore_watch', None)
+  return pm2_config
+
+def settings_with_overrides(settings, overrides):
+  '''
+  Returns a copy of settings with the values in overrides, raising an error for any unknown setting
+  '''
+  unknown_keys = sorted(set(overrides.keys()) - set(CONST_SETTING_KEYS))
+  if unknown_keys:
+    raise Exception(
+      'Error:\n' +
+      'Unknown pm2 setting(s) ' + ', '.join(unknown_keys) + ', expected: ' + ', '.join(CONST_SETTING_KEYS)
+    )
+  result = dict(settings)
+  result.update(overrides)
+  return result
+
+
+
+def write_config(install_dir_path, pm2_config):
+  '''
+  Writes pm2_config over the install's pm2-config.json unless it is unchanged, returning (its path, whether it was
+  written)
+  '''
+  pm2_config_path = os.path.join(install_dir_path, CONST_PM2_CONFIG_REL_PATH)
+  pm2_config_string = json.dumps(pm2_config, indent=2, separators=(',', ': '), sort_keys=True) + '\n'
+  return (pm2_config_path, general.write_file_if_changed(pm2_config_path, pm2_config_string))
+
+def read_config(install_dir_path):
+  with open(os.path.join(install_dir_path, CONST_PM2_CONFIG_REL_PATH), 'r') as pm2_config_file:
+    return json.load(pm2_config_file)
+
+def pm2_command_from_answers(answers_dict):
+  '''
+  Returns the pm2 command to run as a list, which can be overridden by pm2_command in an answers file
+  '''
+  if answers_dict is not None and answers_dict.get('pm2_command'):
+    return list(answers_dict['pm2_command'])
+  return list(CONST_PM2_COMMAND)
+
+def register_config(pm2_config_path, pm2_command=None):
+  '''
+  Starts the application with pm2 from pm2_config_path, or gracefully reloads it (one instance at a time) if it is
+  already running, and saves pm2's process list so that it is restored when pm2 restarts
+  '''
+  if pm2_command is None:
+    pm2_command = CONST_PM2_COMMAND
+  for pm2_args in [['startOrGracefulReload', pm2_config_path], ['save']]:
+    print('Running: ' + ' '.join(list(pm2_command) + pm2_args))
+    start_time = time.time()
+    exit_status = subprocess.call(list(pm2_command) + pm2_args)
+    events.record_subprocess(list(pm2_command) + pm2_args, exit_status, time.time() - start_time)
+    if exit_status != 0:
+      raise Exception(
+        'Error:\n' +
+        'pm2 ' + pm2_args[0] + ' exited with status ' + str(exit_status)
+      )
+
+
+
+if __name__ == '__main__':
+  print('This file is not configured to be run separately; tests will come at a later date')
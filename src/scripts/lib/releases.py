@@ -0,0 +1,170 @@
+'''
+Atomic application symlink swaps and the release history used to roll them back
+
+The history of an application symlink is kept next to it in <symlink path>.releases.json as a list of the install
+directories it has pointed to, oldest first, so the last entry is the current release
+
+The files of a release's dependency trees may be hardlinked to, and shared with, the other retained releases (see
+lib/dedup.py). They are read-only and must only be replaced, never written to in place, e.g. npm rebuild should only be
+run in a release that is not linked to another one
+'''
+
+import json as json
+import os as os
+import shutil as shutil
+import time as time
+import uuid as uuid
+
+import general as general
+
+CONST_RELEASE_HISTORY_VERSION = 1
+CONST_INSTALL_MARKER_REL_PATH = 'scripts/install.py' # only directories with this in them are removed as releases
+
+def release_history_path(symlink_path):
+  return symlink_path.rstrip(os.sep) + '.releases.json'
+
+
+
+def read_release_history(symlink_path):
+  '''
+  Returns the release history of symlink_path as a list of {'target_path': ..., 'activated_at': ...} dicts, oldest
+  first, or an empty list if there is no history
+  '''
+  history_path = release_history_path(symlink_path)
+  if not os.path.isfile(history_path):
+    return []
+  with open(history_path, 'r') as history_file:
+    history_data = json.load(history_file)
+  if history_data.get('version') != CONST_RELEASE_HISTORY_VERSION:
+    raise Exception(
+      'Error:\n' +
+      'Release history "' + history_path + '" has unsupported version ' + repr(history_data.get('version'))
+    )
+  return history_data['releases']
+
+def write_release_history(symlink_path, releases):
+  general.write_file_atomically(
+    release_history_path(symlink_path),
+    json.dumps({'version': CONST_RELEASE_HISTORY_VERSION, 'releases': releases}, indent=2)
+  )
+
+def record_release(symlink_path, target_path):
+  '''
+  Appends target_path to the release history of symlink_path as the current release
+  '''
+  releases = read_release_history(symlink_path)
+  releases.append({'target_path': target_path, 'activated_at': time.strftime('%Y-%m-%dT%H:%M:%S%z')})
+  write_release_history(symlink_path, releases)
+
+
+
+def swap_symlink(symlink_path, target_path):
+  '''
+  Points symlink_path at target_path without symlink_path ever not existing: a new symlink is created next to it and
+  renamed over it, which is atomic. Returns the path symlink_path pointed to before the swap, or None
+  '''
+  symlink_path = symlink_path.rstrip(os.sep)
+  previous_target_path = os.readlink(symlink_path) if os.path.islink(symlink_path) else None
+  temp_symlink_path = symlink_path + '.tmp-' + str(uuid.uuid4())
+  os.symlink(target_path, temp_symlink_path)
+  try:
+    os.rename(temp_symlink_path, symlink_path)
+  except:
+    os.unlink(temp_symlink_path)
+    raise
+  return previous_target_path
+
+
+
+def activate_release(symlink_path, target_path):
+  '''
+  Atomically points symlink_path at target_path and records it in the release history. If the symlink has no history
+  yet (e.g. it was created by an older install.py) the release it pointed to is recorded first so it can be rolled
+  back to
+  '''
+  symlink_path = symlink_path.rstrip(os.sep)
+  previous_target_path = swap_symlink(symlink_path, target_path)
+  if previous_target_path is not None and len(read_release_history(symlink_path)) == 0:
+    record_release(symlink_path, previous_target_path)
+  record_release(symlink_path, target_path)
+  return previous_target_path
+
+
+
+def rollback_release(symlink_path):
+  '''
+  Atomically points symlink_path back at the release before the current one and removes the current release from the
+  history. Returns the path rolled back to. Raises an error if symlink_path does not point at the last release in the
+  history (e.g. after a manual swap or an interrupted upgrade), as the history no longer says what came before it
+  '''
+  symlink_path = symlink_path.rstrip(os.sep)
+  releases = read_release_history(symlink_path)
+  if len(releases) < 2:
+    raise Exception(
+      'Error:\n' +
+      'Could not roll back - "' + symlink_path + '" has no earlier release in ' + release_history_path(symlink_path)
+    )
+  current_target_path = os.path.realpath(symlink_path)
+  if current_target_path != os.path.realpath(releases[-1]['target_path']):
+    raise Exception(
+      'Error:\n' +
+      'Could not roll back - "' + symlink_path + '" points at "' + current_target_path + '" but the last release in ' +
+        release_history_path(symlink_path) + ' is "' + releases[-1]['target_path'] + '"'
+    )
+  previous_target_path = releases[-2]['target_path']
+  if not os.path.exists(previous_target_path):
+    raise Exception(
+      'Error:\n' +
+      'Could not roll back - previous release "' + previous_target_path + '" does not exist'
+    )
+  swap_symlink(symlink_path, previous_target_path)
+  write_release_history(symlink_path, releases[:-1])
+  return previous_target_path
+
+
+
+def prunable_releases(symlink_path, keep_count):
+  '''
+  Returns the install directories in the release history of symlink_path other than the keep_count most recently
+  activated ones, never including the release symlink_path points to
+  '''
+  symlink_path = symlink_path.rstrip(os.sep)
+  current_target_path = os.path.realpath(symlink_path)
+  kept_target_paths = [current_target_path]
+  prunable_target_paths = []
+  for release in reversed(read_release_history(symlink_path)):
+    target_path = os.path.realpath(release['target_path'])
+    if target_path in kept_target_paths or target_path in prunable_target_paths:
+      continue
+    if len(kept_target_paths) < keep_count:
+      kept_target_paths.append(target_path)
+    else:
+      prunable_target_paths.append(target_path)
+  return prunable_target_paths
+
+def prune_releases(symlink_path, keep_count):
+  '''
+  Removes the install directories of all but the keep_count most recent releases of symlink_path (see
+  prunable_releases) and their entries in the release history, so that they can no longer be rolled back to. Files
+  hardlinked to later releases (see lib/dedup.py) stay in those. Returns the paths removed
+  '''
+  symlink_path = symlink_path.rstrip(os.sep)
+  removed_target_paths = []
+  for target_path in prunable_releases(symlink_path, keep_count):
+    if not os.path.exists(target_path):
+      removed_target_paths.append(target_path)
+    elif not os.path.isfile(os.path.join(target_path, CONST_INSTALL_MARKER_REL_PATH)):
+      print('Warning: not removing release "' + target_path + '", it does not look like an install directory')
+    else:
+      print('Removing release ' + target_path)
+      shutil.rmtree(target_path)
+      removed_target_paths.append(target_path)
+  releases = [release for release in read_release_history(symlink_path)
+    if os.path.realpath(release['target_path']) not in removed_target_paths]
+  write_release_history(symlink_path, releases)
+  return removed_target_paths
+
+
+
+if __name__ == '__main__':
+  print('This file is not configured to be run separately; tests will come at a later date')
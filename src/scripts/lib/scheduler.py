@@ -0,0 +1,151 @@
+'''
+Runs a graph of tasks on a bounded thread pool, each task as soon as the tasks it depends on have succeeded
+
+A task is a dict of an id, the ids of the tasks it runs after, the resources it needs and a run function. A resource is
+just a name, e.g. console for tasks that prompt the user; tasks that need the same resource never run at the same time.
+Ready tasks are started in the order they are listed. Once a task fails no more tasks are started, the running ones are
+waited for and the tasks that were not started are skipped.
+
+Afterwards the critical path - the chain of tasks that finished last, each waiting on the one before it as a dependency
+or for a resource - shows which tasks the total time was spent waiting on
+'''
+
+import multiprocessing.pool as pool
+import Queue as Queue
+import time as time
+
+import events as events
+import fleet as fleet
+
+CONST_POLL_SECONDS = 1 # how often the scheduler wakes while waiting, so that it can be interrupted
+
+def validate_tasks(tasks):
+  '''
+  Raises an error if the task ids are not unique, a task runs after an unknown task or the tasks' dependencies have a
+  cycle
+  '''
+  task_ids = [task['id'] for task in tasks]
+  duplicate_ids = sorted(set([task_id for task_id in task_ids if task_ids.count(task_id) > 1]))
+  if duplicate_ids:
+    raise Exception(
+      'Error:\n' +
+      'Duplicate task id(s): ' + ', '.join(duplicate_ids)
+    )
+  for task in tasks:
+    unknown_ids = [dependency_id for dependency_id in task.get('after', []) if dependency_id not in task_ids]
+    if unknown_ids:
+      raise Exception(
+        'Error:\n' +
+        'Task "' + task['id'] + '" runs after unknown task(s): ' + ', '.join(unknown_ids)
+      )
+  ordered_ids = set()
+  remaining_tasks = list(tasks)
+  while remaining_tasks:
+    ready_tasks = [task for task in remaining_tasks if set(task.get('after', [])) <= ordered_ids]
+    if not ready_tasks:
+      raise Exception(
+        'Error:\n' +
+        'Task dependencies have a cycle between: ' + ', '.join([task['id'] for task in remaining_tasks])
+      )
+    ordered_ids.update([task['id'] for task in ready_tasks])
+    remaining_tasks = [task for task in remaining_tasks if task['id'] not in ordered_ids]
+
+
+
+def run_graph(tasks, concurrency):
+  '''
+  Runs every task whose dependencies succeeded, at most concurrency at a time, returning a list of result dicts (see
+  fleet.run_target, with the task id as the target and the task's start time) in the same order as tasks. Tasks run in
+  the caller's event context (see lib/events.py)
+  '''
+  validate_tasks(tasks)
+  events_context = events.current_context()
+  completed = Queue.Queue()
+  def run_task(task):
+    started_at = time.time()
+    with events.attach(events_context):
+      result = fleet.run_target(lambda target: task['run'](), task['id'])
+    result['started_at'] = started_at
+    completed.put(result)
+
+  results = {}
+  running_ids = set()
+  held_resources = set()
+  failed = False
+  thread_pool = pool.ThreadPool(max(concurrency, 1))
+  try:
+    while True:
+      for task in tasks:
+        if failed or len(running_ids) >= max(concurrency, 1):
+          break
+        if task['id'] in results or task['id'] in running_ids or held_resources & set(task.get('resources', [])):
+          continue
+        if not all([results.get(dependency_id, {}).get('status') == fleet.CONST_SUCCEEDED
+          for dependency_id in task.get('after', [])]):
+          continue
+        running_ids.add(task['id'])
+        held_resources.update(task.get('resources', []))
+        thread_pool.apply_async(run_task, (task,))
+      if not running_ids:
+        break
+      try:
+        result = completed.get(True, CONST_POLL_SECONDS)
+      except Queue.Empty:
+        continue
+      task = [task for task in tasks if task['id'] == result['target']][0]
+      running_ids.remove(task['id'])
+      held_resources.difference_update(task.get('resources', []))
+      results[task['id']] = result
+      failed = failed or result['status'] == fleet.CONST_FAILED
+  finally:
+    thread_pool.close()
+    thread_pool.join()
+  return [results.get(task['id'], {'target': task['id'], 'status': fleet.CONST_SKIPPED, 'error': None, 'seconds': 0,
+    'started_at': None}) for task in tasks]
+
+
+
+def critical_path(tasks, results):
+  '''
+  Returns the results (see run_graph) of the chain of tasks that finished last: the last task to finish, the task it
+  waited on that finished last - a dependency, or a task that held a resource it needs - and so on, first task first
+  '''
+  results_by_id = dict([(result['target'], result) for result in results if result['started_at'] is not None])
+  tasks_by_id = dict([(task['id'], task) for task in tasks])
+  def finished_at(task_id):
+    return results_by_id[task_id]['started_at'] + results_by_id[task_id]['seconds']
+
+  def waited_on(task_id):
+    task = tasks_by_id[task_id]
+    return [other_id for other_id in results_by_id if other_id in task.get('after', []) or (
+      set(tasks_by_id[other_id].get('resources', [])) & set(task.get('resources', [])) and
+      other_id != task_id and finished_at(other_id) <= results_by_id[task_id]['started_at']
+    )]
+
+  path = []
+  candidate_ids = results_by_id.keys()
+  while candidate_ids:
+    task_id = max(candidate_ids, key=finished_at)
+    path.insert(0, results_by_id[task_id])
+    candidate_ids = waited_on(task_id)
+  return path
+
+def print_critical_path(tasks, results):
+  path = critical_path(tasks, results)
+  if not path:
+    return
+  started_results = [result for result in results if result['started_at'] is not None]
+  wall_seconds = max([result['started_at'] + result['seconds'] for result in started_results]) - \
+    min([result['started_at'] for result in started_results])
+  print('Critical path (%.2fs of %.2fs wall time, %.2fs if run one at a time):' % (
+    sum([result['seconds'] for result in path]),
+    wall_seconds,
+    sum([result['seconds'] for result in started_results])
+  ))
+  for result in path:
+    print('  %-24s %8.2fs  %s' % (result['target'], result['seconds'], result['status']))
+
+
+
+if __name__ == '__main__':
+  print('This file is not configured to be run separately; tests will come at a later date')
@@ -0,0 +1,187 @@
+'''
+Loads synthetic entries, tags and entry_tag rows into the database for load testing
+
+Rows are generated lazily and streamed to psql's COPY ... FROM STDIN, so memory use does not grow with the number of
+rows. Row ids are derived from the row number, which lets the entry_tag rows be generated without keeping the entry or
+tag ids in memory. Each entry is tagged with a number of distinct tags around fanout_mean, chosen either uniformly or
+with a zipf (a few very popular tags, a long tail of rare ones) distribution of tag popularity
+'''
+
+import bisect as bisect
+import datetime as datetime
+import random as random
+import subprocess as subprocess
+import tempfile as tempfile
+import time as time
+
+import db as db
+import events as events
+
+CONST_TAG_DISTRIBUTIONS = ['uniform', 'zipf']
+CONST_ZIPF_EXPONENT = 1.1
+CONST_BODY_WORDS = (
+  'lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore et dolore magna '
+  'aliqua enim ad minim veniam quis nostrud exercitation ullamco laboris nisi aliquip ex ea commodo consequat'
+).split()
+CONST_FIRST_DATE = datetime.datetime(2015, 1, 1)
+CONST_DATE_RANGE_SECONDS = 365 * 24 * 60 * 60
+CONST_ROW_TIMESTAMP = '2015-01-01 00:00:00+00'
+CONST_WRITE_BUFFER_BYTES = 1 << 16
+
+def row_uuid(table_number, row_number):
+  '''
+  Returns a UUID string unique to row_number of table_number, in the random (version 4) UUID format
+  '''
+  return '%08x-0000-4000-8000-%012x' % (table_number, row_number)
+
+def entry_id(entry_number):
+  return row_uuid(1, entry_number)
+
+def tag_id(tag_number):
+  return row_uuid(2, tag_number)
+
+
+
+def tag_rows(tag_count):
+  for tag_number in xrange(tag_count):
+    yield (tag_id(tag_number), 'tag_' + str(tag_number), CONST_ROW_TIMESTAMP, CONST_ROW_TIMESTAMP)
+
+def entry_rows(entry_count, rng):
+  for entry_number in xrange(entry_count):
+    entry_date = CONST_FIRST_DATE + datetime.timedelta(seconds=rng.randint(0, CONST_DATE_RANGE_SECONDS))
+    body = 'Entry ' + str(entry_number) + ' ' + ' '.join([rng.choice(CONST_BODY_WORDS) for i in range(12)])
+    yield (entry_id(entry_number), entry_date.strftime('%Y-%m-%d %H:%M:%S+00'), body, CONST_ROW_TIMESTAMP,
+      CONST_ROW_TIMESTAMP)
+
+def tag_picker(tag_count, tag_distribution, rng):
+  '''
+  Returns a function that returns a random tag number, distributed according to tag_distribution
+  '''
+  if tag_distribution == 'uniform':
+    return lambda: rng.randrange(tag_count)
+  cumulative_weights = []
+  total_weight = 0.0
+  for tag_number in xrange(tag_count):
+    total_weight += 1.0 / ((tag_number + 1) ** CONST_ZIPF_EXPONENT)
+    cumulative_weights.append(total_weight)
+  return lambda: min(bisect.bisect_left(cumulative_weights, rng.random() * total_weight), tag_count - 1)
+
+def entry_tag_rows(entry_count, tag_count, fanout_mean, tag_distribution, rng):
+  '''
+  Yields entry_tag rows, tagging each entry with between 0 and 2 * fanout_mean distinct tags
+  '''
+  pick_tag = tag_picker(tag_count, tag_distribution, rng)
+  max_fanout = min(int(round(2 * fanout_mean)), tag_count)
+  for entry_number in xrange(entry_count):
+    fanout = rng.randint(0, max_fanout)
+    if fanout * 2 > tag_count:
+      # Rejection sampling distinct tags from a skewed distribution is slow when most of the tags are needed
+      tag_numbers = rng.sample(xrange(tag_count), fanout)
+    else:
+      tag_numbers = set()
+      while len(tag_numbers) < fanout:
+        tag_numbers.add(pick_tag())
+    for tag_number in sorted(tag_numbers):
+      yield (entry_id(entry_number), tag_id(tag_number), CONST_ROW_TIMESTAMP, CONST_ROW_TIMESTAMP)
+
+
+
+def copy_chunks(qualified_table, columns, rows):
+  '''
+  Yields the psql input for a COPY of rows (tuples of strings containing no tabs, newlines or backslashes)
+  '''
+  yield 'COPY ' + qualified_table + ' (' + ', '.join(columns) + ') FROM STDIN;\n'
+  for row in rows:
+    yield '\t'.join(row) + '\n'
+  yield '\\.\n'
+
+def seed_chunks(schema, entry_count, tag_count, fanout_mean, tag_distribution, random_seed):
+  yield '\\set ON_ERROR_STOP on\n'
+  yield '\\timing on\n'
+  for chunk in copy_chunks(schema + '.tag', ['id', 'value', 'sq_created_at', 'sq_updated_at'], tag_rows(tag_count)):
+    yield chunk
+  for chunk in copy_chunks(
+    schema + '.entry',
+    ['id', 'date', 'body', 'sq_created_at', 'sq_updated_at'],
+    entry_rows(entry_count, random.Random(random_seed))
+  ):
+    yield chunk
+  for chunk in copy_chunks(
+    schema + '.entry_tag',
+    ['entry_id', 'tag_id', 'sq_created_at', 'sq_updated_at'],
+    entry_tag_rows(entry_count, tag_count, fanout_mean, tag_distribution, random.Random(random_seed + 1))
+  ):
+    yield chunk
+  yield 'ANALYZE ' + schema + '.tag;\n'
+  yield 'ANALYZE ' + schema + '.entry;\n'
+  yield 'ANALYZE ' + schema + '.entry_tag;\n'
+
+
+
+def seed_database(schema, database, entry_count, tag_count, fanout_mean=2.0, tag_distribution='zipf',
+  random_seed=0, psql_command=None):
+  '''
+  Loads entry_count entries and tag_count tags, tagged as described at the top of this file, into the (empty) tables of
+  schema in one transaction and then ANALYZEs them. Raises an error if psql fails
+  '''
+  if tag_distribution not in CONST_TAG_DISTRIBUTIONS:
+    raise Exception(
+      'Error:\n' +
+      'Unknown tag distribution "' + tag_distribution + '", expected one of: ' + ', '.join(CONST_TAG_DISTRIBUTIONS)
+    )
+  if tag_count < 1 and fanout_mean > 0:
+    raise Exception(
+      'Error:\n' +
+      'Cannot tag entries without any tags'
+    )
+  if psql_command is None:
+    psql_command = db.CONST_PSQL_COMMAND
+  command = list(psql_command) + ['--no-psqlrc', '--single-transaction', '--dbname', database]
+  print('Seeding ' + str(entry_count) + ' entries and ' + str(tag_count) + ' tags (' + tag_distribution +
+    ' tag distribution, mean fanout ' + str(fanout_mean) + ') with: ' + ' '.join(command))
+
+  # psql's output goes to temporary files rather than pipes so that it can never block the rows being written to it
+  start_time = time.time()
+  with tempfile.TemporaryFile() as psql_stdout_file:
+    with tempfile.TemporaryFile() as psql_stderr_file:
+      psql_process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=psql_stdout_file, stderr=psql_stderr_file)
+      try:
+        buffered_chunks = []
+        buffered_bytes = 0
+        for chunk in seed_chunks(schema, entry_count, tag_count, fanout_mean, tag_distribution, random_seed):
+          buffered_chunks.append(chunk)
+          buffered_bytes += len(chunk)
+          if buffered_bytes >= CONST_WRITE_BUFFER_BYTES:
+            psql_process.stdin.write(''.join(buffered_chunks))
+            buffered_chunks = []
+            buffered_bytes = 0
+        psql_process.stdin.write(''.join(buffered_chunks))
+      except IOError:
+        pass # psql exited early, its exit status and stderr are reported below
+      finally:
+        try:
+          psql_process.stdin.close()
+        except IOError:
+          pass
+      psql_process.wait()
+      events.record_subprocess(command, psql_process.returncode, time.time() - start_time)
+      psql_stdout_file.seek(0)
+      psql_stderr_file.seek(0)
+      psql_stdout = psql_stdout_file.read()
+      psql_stderr = psql_stderr_file.read()
+
+  for line in psql_stdout.splitlines():
+    if line.startswith('COPY ') or line.startswith('ANALYZE') or line.startswith('Time: '):
+      print('  ' + line)
+  if psql_process.returncode != 0:
+    raise Exception(
+      'Error:\n' +
+      'Seeding failed, psql exited with status ' + str(psql_process.returncode) + '\n' +
+      psql_stderr.strip()
+    )
+  print('Seeding finished in %.2fs' % (time.time() - start_time))
+
+
+
+if __name__ == '__main__':
+  print('This file is not configured to be run separately; tests will come at a later date')
@@ -0,0 +1,255 @@
+'''
+Warms up a release on side ports and waits until it is ready, before it is swapped in to serve the application's users
+
+The release is started with node on free ports (see server/app/server.js), next to the running application, and then
+runs the warmup script's requests in rounds: every request once per client, the clients running at the same time. The
+first round also requests the static assets under the script's static prefixes (see lib/assets.py), to load them into
+the page cache. The release is ready once the p95 latency of a round's requests has been at most max_latency_ms for
+settle_rounds rounds in a row. A request that fails, the server exiting or the latency not settling in time fails the
+warmup.
+
+The side server shares the application's database and session store, so its first queries also load the entry and tag
+tables into the database's cache, and it uses up to a DB pool of connections (see server/app/config/database.js) while
+it runs.
+
+The latency gate measures the side server, which is stopped before pm2 reloads the application. The pm2 instances start
+with their own module cache and DB pool, so only what they share with the side server is warm: the page cache of the
+release's files and static assets and the database's cache. Each instance opens its minimum DB pool connections before
+it listens (see server/app/server.js), but its first requests still run unoptimised code
+'''
+
+import json as json
+import os as os
+import socket as socket
+import subprocess as subprocess
+import threading as threading
+import time as time
+
+import assets as assets
+import configstate as configstate
+import general as general
+import loadgen as loadgen
+
+CONST_WARMUP_SCRIPT_REL_PATH = 'scripts/warmup.json'
+CONST_HTTP_PORT_ENV_NAME = 'LOGIN_FIDDLE_HTTP_PORT'
+CONST_HTTPS_PORT_ENV_NAME = 'LOGIN_FIDDLE_HTTPS_PORT'
+CONST_SERVER_START_TIMEOUT_SECONDS = 30
+
+# The settings of a warmup script and their defaults
+CONST_SCRIPT_DEFAULTS = {
+  'requests': [],
+  'static_prefixes': [],
+  'concurrency': 4,
+  'max_latency_ms': 100,
+  'settle_rounds': 3,
+  'timeout_seconds': 120
+}
+CONST_REQUEST_KEYS = ['name', 'method', 'path', 'statuses']
+
+def start_server(install_dir_path, host, port, log_file, env=None):
+  '''
+  Starts the application in install_dir_path, with any extra environment variables in env, and waits until it accepts
+  connections on host:port, returning its process. Raises an error if something is already listening on host:port, as
+  its connections could not be told apart from the started server's, or if it exits or does not start listening in time
+  '''
+  if is_listening(host, port):
+    raise Exception(
+      'Error:\n' +
+      'Could not start the server in ' + install_dir_path + ' - ' + host + ':' + str(port) + ' is already in use'
+    )
+  print('Starting server in ' + install_dir_path + ', logging to ' + log_file.name)
+  server_env = dict(os.environ)
+  server_env.update(env or {})
+  server_process = subprocess.Popen(['node', 'server/app/server.js'], cwd=install_dir_path, stdout=log_file,
+    stderr=subprocess.STDOUT, env=server_env)
+  deadline = time.time() + CONST_SERVER_START_TIMEOUT_SECONDS
+  while time.time() < deadline:
+    if server_process.poll() is not None:
+      raise Exception(
+        'Error:\n' +
+        'Server exited with status ' + str(server_process.returncode) + ' before listening, see ' + log_file.name
+      )
+    if is_listening(host, port):
+      return server_process
+    time.sleep(0.2)
+  server_process.terminate()
+  raise Exception(
+    'Error:\n' +
+    'Server did not listen on ' + host + ':' + str(port) + ' within ' + str(CONST_SERVER_START_TIMEOUT_SECONDS) + 's'
+  )
+
+def is_listening(host, port):
+  '''
+  Returns whether something accepts connections on host:port
+  '''
+  try:
+    socket.create_connection((host, port), timeout=1).close()
+    return True
+  except socket.error:
+    return False
+
+def read_server_configuration(install_dir_path):
+  '''
+  Returns (host, HTTPS port) of the install's server, from its configuration state (see lib/configstate.py) or, if it
+  has none, read from server/app/config/server.js
+  '''
+  saved_values = configstate.read_values_with(install_dir_path, ['server_host', 'https_port'])
+  if saved_values is not None:
+    return (saved_values[0], int(saved_values[1]))
+  server_config_path = 'server/app/config/server.js'
+  with open(os.path.join(install_dir_path, server_config_path), 'r') as server_config_file:
+    curr_file_as_string = server_config_file.read()
+  host = general.value_from_file_string('server_host: \'([^\']*)\'', curr_file_as_string, server_config_path, 'Host')
+  port = general.value_from_file_string('https_port: ([0-9]+)', curr_file_as_string, server_config_path, 'Port')
+  return (host, int(port))
+
+def free_ports(host, count):
+  '''
+  Returns count different ports that nothing is listening on at host. Every socket is held open until all of the
+  ports have been picked, so that the same port cannot be picked twice
+  '''
+  port_sockets = []
+  try:
+    for port_number in range(count):
+      port_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+      port_sockets.append(port_socket)
+      port_socket.bind((host, 0))
+    return [port_socket.getsockname()[1] for port_socket in port_sockets]
+  finally:
+    for port_socket in port_sockets:
+      port_socket.close()
+
+def side_server_env(http_port, https_port):
+  '''
+  Returns the environment variables that start the application on http_port and https_port instead of the configured
+  ports
+  '''
+  return {CONST_HTTP_PORT_ENV_NAME: str(http_port), CONST_HTTPS_PORT_ENV_NAME: str(https_port)}
+
+
+
+def load_script(script_path):
+  '''
+  Returns the warmup script at script_path with the defaults of any settings it does not have (see
+  CONST_SCRIPT_DEFAULTS). Raises an error for unknown settings or requests without a name or path
+  '''
+  with open(script_path, 'r') as script_file:
+    script_settings = json.load(script_file)
+  unknown_keys = sorted(set(script_settings.keys()) - set(CONST_SCRIPT_DEFAULTS.keys()))
+  if unknown_keys:
+    raise Exception(
+      'Error:\n' +
+      'Unknown warmup setting(s) ' + ', '.join(unknown_keys) + ' in ' + script_path + ', expected: ' +
+        ', '.join(sorted(CONST_SCRIPT_DEFAULTS.keys()))
+    )
+  script = dict(CONST_SCRIPT_DEFAULTS)
+  script.update(script_settings)
+  for request in script['requests']:
+    if not request.get('name') or not request.get('path') or set(request.keys()) - set(CONST_REQUEST_KEYS):
+      raise Exception(
+        'Error:\n' +
+        'Warmup request ' + json.dumps(request, sort_keys=True) + ' in ' + script_path + ' must have a name and ' +
+          'path and may only have: ' + ', '.join(CONST_REQUEST_KEYS)
+      )
+  return script
+
+def script_requests(script):
+  '''
+  Returns the requests of script as (name, method, path, headers, expected statuses) tuples
+  '''
+  return [(request['name'], request.get('method', 'GET'), request['path'], None, request.get('statuses', [200]))
+    for request in script['requests']]
+
+def static_asset_requests(install_dir_path, static_prefixes):
+  '''
+  Returns requests (see script_requests) for the static assets of install_dir_path's asset manifest under any of
+  static_prefixes, accepting gzip so that their precompressed siblings are read
+  '''
+  return [(url_path, 'GET', url_path, {'Accept-Encoding': 'gzip'}, [200])
+    for url_path in sorted(assets.read_manifest(install_dir_path)['assets'].keys())
+    if any([url_path.startswith(prefix) for prefix in static_prefixes])]
+
+
+
+def run_round(base_url, requests, concurrency, verify_tls=False):
+  '''
+  Makes every request in requests once per client, with concurrency clients at a time, returning the request records
+  (see loadgen.timed_request)
+  '''
+  records = []
+  def run_client():
+    client = loadgen.Client(base_url, keep_alive=True, verify_tls=verify_tls)
+    client_records = []
+    try:
+      for (name, method, path, headers, statuses) in requests:
+        client_records.append(loadgen.timed_request(client, name, method, path, headers=headers))
+    finally:
+      client.close()
+    records.extend(client_records)
+
+  clients = [threading.Thread(target=run_client) for client_number in range(max(concurrency, 1))]
+  for client in clients:
+    client.daemon = True
+    client.start()
+  for client in clients:
+    client.join()
+  return records
+
+def failed_records(records, requests):
+  '''
+  Returns the records of requests that had no response or a status that their request (see script_requests) does not
+  expect
+  '''
+  expected_statuses = dict([(request[0], request[4]) for request in requests])
+  return [record for record in records if record[1] not in expected_statuses[record[0]]]
+
+def wait_until_ready(base_url, script, static_requests=None, verify_tls=False, server_process=None):
+  '''
+  Runs rounds of the requests of script (see load_script) against base_url until the release is ready, the first round
+  with static_requests as well. Returns the number of rounds run. Raises an error if a request fails, server_process
+  exits or the latency does not settle within the script's timeout_seconds
+  '''
+  requests = script_requests(script)
+  if not requests:
+    raise Exception(
+      'Error:\n' +
+      'The warmup script has no requests to measure the latency of'
+    )
+  deadline = time.time() + script['timeout_seconds']
+  settled_rounds = 0
+  round_number = 0
+  while settled_rounds < script['settle_rounds']:
+    if time.time() >= deadline:
+      raise Exception(
+        'Error:\n' +
+        'Warmup latency did not settle to a p95 of at most ' + str(script['max_latency_ms']) + 'ms for ' +
+          str(script['settle_rounds']) + ' rounds within ' + str(script['timeout_seconds']) + 's'
+      )
+    round_number += 1
+    round_requests = requests + (static_requests or []) if round_number == 1 else requests
+    records = run_round(base_url, round_requests, script['concurrency'], verify_tls)
+    if server_process is not None and server_process.poll() is not None:
+      raise Exception(
+        'Error:\n' +
+        'Server exited with status ' + str(server_process.returncode) + ' during the warmup'
+      )
+    failures = failed_records(records, round_requests)
+    if failures:
+      raise Exception(
+        'Error:\n' +
+        'Warmup request(s) failed in round ' + str(round_number) + ':\n' +
+        '\n'.join(sorted(set([name + ': ' + (str(status) if status is not None else 'no response')
+          for (name, status, seconds) in failures])))
+      )
+    latencies = sorted([seconds * 1000.0 for (name, status, seconds) in records
+      if name in [request[0] for request in requests]])
+    p95 = loadgen.percentile(latencies, 95)
+    settled_rounds = settled_rounds + 1 if p95 <= script['max_latency_ms'] else 0
+    print('Round %d: %d request(s), p95 %.1fms, max %.1fms%s' % (round_number, len(records), p95, latencies[-1],
+      ' (settled)' if settled_rounds else ''))
+  return round_number
+
+
+
+if __name__ == '__main__':
+  print('This file is not configured to be run separately; tests will come at a later date')
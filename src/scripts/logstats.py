@@ -0,0 +1,74 @@
+'''
+Summarises the application's logs: request rates, per-route response times, errors by module and bursts of errors
+
+Reads the given log files, or the request and app logs (and their rotated archives) in the logs directory of an install,
+a chunk at a time (see lib/logstats.py), so multi-GB logs can be summarised without loading them. pm2.log repeats the
+app log's lines, so it is only read if given. With --state, only what was written since the last run with the same
+state file is read and summarised, e.g. to check on a live incident every few minutes. The gzipped archives in the logs
+directory are then not read: log rotation compresses a file into a new one, so its lines were already read from the
+live log. Gzipped files given on the command line are read once.
+
+Assumptions:
+- That the logs were written by the application's loggers, see server/app/util/logger
+'''
+
+#!/usr/bin/python
+
+import argparse as argparse
+import glob as glob
+import json as json
+import os as os
+
+import lib.logstats as logstats
+
+CONST_DEFAULT_LOG_NAMES = ['login-fiddle.requests.log', 'login-fiddle.app.log']
+
+def install_log_paths(install_dir_path, include_gzipped=True):
+  '''
+  Returns the paths of the request and app logs of install_dir_path and their rotated archives, oldest first, without
+  the gzipped archives unless include_gzipped
+  '''
+  log_paths = []
+  for log_name in CONST_DEFAULT_LOG_NAMES:
+    archive_paths = sorted(glob.glob(os.path.join(install_dir_path, 'logs', log_name + '?*')))
+    log_paths.extend([archive_path for archive_path in archive_paths
+      if include_gzipped or not archive_path.endswith('.gz')])
+    if os.path.isfile(os.path.join(install_dir_path, 'logs', log_name)):
+      log_paths.append(os.path.join(install_dir_path, 'logs', log_name))
+  return log_paths
+
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Summarises the application\'s logs')
+  parser.add_argument('log_paths', nargs='*', help='Log files to read, plain or gzipped')
+  parser.add_argument('--install-dir', help='Application install directory, to read the request and app logs of')
+  parser.add_argument('--state', help='File of the offsets read up to, to only read what was written since then')
+  parser.add_argument('--burst-window', type=float, default=logstats.CONST_BURST_WINDOW_SECONDS,
+    help='Seconds between errors for them to be in the same burst')
+  parser.add_argument('--burst-min-errors', type=int, default=logstats.CONST_BURST_MIN_ERRORS,
+    help='Number of errors for a burst to be reported')
+  parser.add_argument('--top', type=int, default=10, help='Number of routes and modules to show')
+  parser.add_argument('--output', help='File to write the JSON report to')
+  args = parser.parse_args()
+
+  log_paths = list(args.log_paths)
+  if args.install_dir is not None:
+    log_paths.extend(install_log_paths(args.install_dir, args.state is None))
+    if args.state is not None:
+      print('Not reading the gzipped archives in ' + os.path.join(args.install_dir, 'logs') + ', their lines were ' +
+        'read from the live logs before they were rotated')
+  if not log_paths:
+    parser.error('no log files given or found, give log files or --install-dir')
+
+  (stats, files) = logstats.summarise_files(log_paths, args.state)
+  report = logstats.build_report(stats, files, args.burst_window, args.burst_min_errors)
+  print('******************************************************************')
+  print('  LOG SUMMARY')
+  print('******************************************************************')
+  logstats.print_report(report, args.top)
+  print('******************************************************************')
+  if args.output is not None:
+    with open(args.output, 'w') as output_file:
+      output_file.write(json.dumps(report, indent=2, separators=(',', ': '), sort_keys=True) + '\n')
+    print('Wrote: ' + args.output)
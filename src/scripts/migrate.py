@@ -0,0 +1,34 @@
+'''
+Applies the schema migrations that an installed application's database has not had yet
+
+Reads the database name, user and schema from the install directory's configuration, shows the migrations that would be
+applied (see CONST_DB_MIGRATIONS in install.py and lib/migrations.py) and applies them. upgrade.py does the same as one
+of its steps; this script is for showing the plan ahead of an upgrade with --plan, or re-running a failed migration.
+Does not restart the webservers.
+
+Assumptions:
+- That the application has been installed using install.py
+'''
+
+#!/usr/bin/python
+
+import argparse as argparse
+
+import lib.answers as answers
+import install as install
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Applies the pending schema migrations to an installed application')
+  parser.add_argument('install_dir_path', help='Application install directory')
+  parser.add_argument('--plan', action='store_true', help='Only show the migrations that would be applied')
+  parser.add_argument('--answers', help='YAML or JSON answers file to migrate without prompting')
+  args = parser.parse_args()
+
+  answers_dict = None
+  if args.answers is not None:
+    answers_dict = answers.load_answers(args.answers)
+  install.migrate_database(
+    install_dir_path=args.install_dir_path,
+    answers_dict=answers_dict,
+    dry_run=args.plan
+  )
@@ -0,0 +1,65 @@
+'''
+Rolls an upgraded application back to the release it was upgraded from
+
+After prompting for the application directory symlink (e.g. /opt/login-fiddle/app), this script atomically points the
+symlink back at the previous release recorded by install.py and upgrade.py. Does not re-run configuration, does not
+make any changes to the database and does not restart the webservers.
+
+Assumptions:
+- That the application was installed using install.py and upgraded using upgrade.py
+'''
+
+#!/usr/bin/python
+
+import argparse as argparse
+import os as os
+
+import lib.answers as answers
+import lib.general as general
+import lib.releases as releases
+
+def prompt_for_rollback_symlink():
+  return general.prompt_for_text('Enter the application symlink path: ').strip()
+
+
+
+def rollback_app(app_symlink_path):
+  '''
+  Points the application symlink back at the previous release, returning its path
+  '''
+  return releases.rollback_release(app_symlink_path)
+
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Rolls an upgraded application back to its previous release')
+  parser.add_argument('--answers', help='YAML or JSON answers file with the app_symlink_path to roll back')
+  args = parser.parse_args()
+
+  answers_dict = None
+  if args.answers is not None:
+    answers_dict = answers.load_answers(args.answers)
+    app_symlink_path = answers.get_option(answers_dict, 'app_symlink_path')
+  else:
+    app_symlink_path = prompt_for_rollback_symlink()
+
+  release_history = releases.read_release_history(app_symlink_path)
+  if len(release_history) < 2:
+    print('There is no earlier release of ' + app_symlink_path + ' to roll back to')
+  else:
+    print('\nYou have elected to roll back:')
+    print('- application symlink path: ' + app_symlink_path)
+    print('- from current release:     ' + os.readlink(app_symlink_path.rstrip(os.sep)))
+    print('- to previous release:      ' + release_history[-2]['target_path'])
+    if answers_dict is not None or general.prompt_for_confirm('Is this correct?', None):
+      rollback_app(app_symlink_path)
+      print('')
+      print('******************************************************************')
+      print('******************************************************************')
+      print('******************************************************************')
+      print('                        ROLLBACK COMPLETE')
+      print('******************************************************************')
+      print('******************************************************************')
+      print('******************************************************************')
+    else:
+      print('Aborting')
@@ -0,0 +1,63 @@
+'''
+Loads synthetic data into an installed application's database for load testing
+
+Reads the database name and schema from the install directory's configuration and bulk loads the requested number of
+entries and tags (see lib/seed.py). The tables must already exist, e.g. from install.py, and are emptied first if
+--truncate is given. Does not restart the webservers.
+
+Assumptions:
+- That the application has been installed using install.py
+'''
+
+#!/usr/bin/python
+
+import argparse as argparse
+
+import lib.answers as answers
+import lib.db as db
+import lib.seed as seed
+import install as install
+
+def truncate_tables(schema, database, psql_command):
+  db.execute_statements(
+    ['TRUNCATE TABLE ' + schema + '.entry_tag, ' + schema + '.entry, ' + schema + '.tag;'],
+    database=database,
+    psql_command=psql_command
+  )
+
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Loads synthetic data into an installed application\'s database')
+  parser.add_argument('install_dir_path', help='Application install directory')
+  parser.add_argument('--entries', type=int, required=True, help='Number of entries to create')
+  parser.add_argument('--tags', type=int, required=True, help='Number of tags to create')
+  parser.add_argument('--fanout', type=float, default=2.0, help='Mean number of tags per entry')
+  parser.add_argument('--distribution', choices=seed.CONST_TAG_DISTRIBUTIONS, default='zipf',
+    help='Distribution of tag popularity')
+  parser.add_argument('--random-seed', type=int, default=0, help='Seed for the random data, for repeatable runs')
+  parser.add_argument('--truncate', action='store_true', help='Empty the entry, tag and entry_tag tables first')
+  parser.add_argument('--answers', help='YAML or JSON answers file, only its psql_command is used')
+  args = parser.parse_args()
+
+  answers_dict = None
+  if args.answers is not None:
+    answers_dict = answers.load_answers(args.answers)
+  psql_command = db.psql_command_from_answers(answers_dict)
+  (user, pw, name, schema) = install.read_db_configuration(args.install_dir_path)
+
+  print('******************************************************************')
+  print('  SEEDING DB ' + name + ' (SCHEMA ' + schema + ')')
+  print('******************************************************************')
+  if args.truncate:
+    truncate_tables(schema, name, psql_command)
+  seed.seed_database(
+    schema=schema,
+    database=name,
+    entry_count=args.entries,
+    tag_count=args.tags,
+    fanout_mean=args.fanout,
+    tag_distribution=args.distribution,
+    random_seed=args.random_seed,
+    psql_command=psql_command
+  )
@@ -1,9 +1,14 @@
 '''
 Upgrades an existing application, reading from the current configuration and writing to the new one
 
-After prompting for the application directory symlink (e.g. /opt/login-fiddle/app), this script guides the user
-through any configuration changes and updates the symlink to point to the install location that this script is in. Does
-not make any changes to the database. Does not restart the webservers.
+After prompting for the application directory symlink (e.g. /opt/login-fiddle/app), this script restores any missing
+dependencies from the dependency cache, guides the user through any configuration changes, applies any pending schema
+migrations (see lib/migrations.py), builds any missing database indexes without blocking writes, precompresses the
+static assets, generates the pm2 configuration for this host, hardlinks the files that are unchanged from the current
+release, optionally starts the upgraded application on side ports and warms it up until its latency settles (see
+lib/warmup.py; this warms the page and database caches, the pm2 instances started afterwards are still cold) and only
+then updates the symlink to point to the install location that this script is in. Does not make any other
+changes to the database. Only reloads the webservers (gracefully, through pm2) and removes old releases if asked to.
 
 Assumptions:
 - That the application has been installed using install.py
@@ -11,10 +16,20 @@ Assumptions:
 
 #!/usr/bin/python
 
+import argparse as argparse
 import os as os
+import tempfile as tempfile
 
+import lib.answers as answers
+import lib.dedup as dedup
+import lib.events as events
 import lib.general as general
+import lib.releases as releases
+import lib.warmup as warmup
 import configure as configure
+import install as install
+
+CONST_KEEP_RELEASES = 3 # when prompted, the current release and two to roll back to
 
 def prompt_for_upgrade_directories():
   install_dir_path = general.prompt_for_text('Enter the upgraded application install directory path: ').strip()
@@ -25,55 +40,234 @@ def prompt_for_upgrade_directories():
 
 def update_symlink(symlink_path, target_path):
   '''
-  Updates the symlink that is at symlink_path to point to target_path
+  Atomically updates the symlink that is at symlink_path to point to target_path, recording target_path in the release
+  history so that the upgrade can be rolled back with rollback.py
   Raises errors if either the symlink_path or target_path do not exist
   '''
+  symlink_path = symlink_path.rstrip(os.sep)
   if not os.path.exists(target_path):
     raise Exception(
       'Error:\n' +
       'Could not update symlink - target path "' + target_path + '" does not exist'
     )
-  if os.path.lexists(symlink_path) and os.path.islink(symlink_path):
-    os.unlink(symlink_path)
-  else:
+  if not os.path.islink(symlink_path):
     raise Exception(
       'Error:\n' +
-      'Could not update symlink - symlink path "' + symlink + '" does not exist or is not a symlink'
+      'Could not update symlink - symlink path "' + symlink_path + '" does not exist or is not a symlink'
     )
-  os.symlink(target_path, symlink_path)
+  releases.activate_release(symlink_path, target_path)
 
 
 
-def upgrade_app(install_dir_path, app_symlink_path):
+def deduplicate_release(install_dir_path, app_symlink_path, answers_dict=None):
   '''
-  Migrates the application's configuration and updates the application symlink.
+  Hardlinks the files of the upgraded install's dependency trees that are unchanged from the release app_symlink_path
+  points to, making them read-only (see lib/dedup.py). They are then shared with the releases that can be rolled back
+  to, so they must never be written to in place
   '''
-  configure.configure_app(
-    current_value_install_dir=app_symlink_path,
-    output_value_install_dir=install_dir_path
+  print('******************************************************************')
+  print('  DEDUPLICATING RELEASE')
+  print('******************************************************************')
+  symlink_path = app_symlink_path.rstrip(os.sep)
+  previous_release_path = os.path.realpath(symlink_path) if os.path.islink(symlink_path) else None
+  if previous_release_path == os.path.realpath(install_dir_path):
+    previous_release_path = None
+  result = dedup.deduplicate_release(
+    release_dir_path=install_dir_path,
+    previous_release_dir_path=previous_release_path,
+    concurrency=int(answers.get_option(answers_dict or {}, 'dedup_concurrency', 4))
   )
+  print('Linked ' + str(result['linked_files']) + ' of ' + str(result['files']) + ' files (' +
+    str(result['linked_bytes']) + ' bytes) to ' + str(previous_release_path))
+  print('******************************************************************')
+  print('')
+  print('')
+  print('')
 
-  update_symlink(
-    symlink_path=app_symlink_path,
-    target_path=install_dir_path
-  )
+def warmup_release(install_dir_path, answers_dict=None):
+  '''
+  Starts the upgraded install on side ports and runs the warmup script (warmup_script in the answers file, or the
+  install's scripts/warmup.json) against it until its latency settles (see lib/warmup.py), so that it is only swapped
+  in once it is ready. Only run if warmup_release is set in the answers file (the script's max_latency_ms depends on
+  the host, so it is opt in for unattended upgrades) or the user confirms. Raises an error, stopping the upgrade before
+  the symlink is updated, if the release does not become ready. The latency gate measures the side server, which is
+  stopped before register_pm2 reloads the application: the pm2 instances start with their own module cache and DB
+  pool, and only the page cache and the database's cache are warm for them
+  '''
+  if answers_dict is not None:
+    run_warmup = answers.get_option(answers_dict, 'warmup_release', False)
+  else:
+    run_warmup = general.prompt_for_confirm('Warm up the upgraded application on side ports before swapping it in?',
+      True)
+  if not run_warmup:
+    return
+  print('******************************************************************')
+  print('  WARMING UP RELEASE')
+  print('******************************************************************')
+  script_path = (answers_dict or {}).get('warmup_script') or \
+    os.path.join(install_dir_path, warmup.CONST_WARMUP_SCRIPT_REL_PATH)
+  script = warmup.load_script(script_path)
+  (host, https_port) = warmup.read_server_configuration(install_dir_path)
+  (side_http_port, side_https_port) = warmup.free_ports(host, 2)
+  side_http_port = int((answers_dict or {}).get('warmup_http_port') or side_http_port)
+  side_https_port = int((answers_dict or {}).get('warmup_https_port') or side_https_port)
+  server_log_file = tempfile.NamedTemporaryFile(prefix='login-fiddle-warmup-', suffix='.log', delete=False)
+  server_process = None
+  try:
+    server_process = warmup.start_server(install_dir_path, host, side_https_port, server_log_file,
+      warmup.side_server_env(side_http_port, side_https_port))
+    print('Warming up https://' + host + ':' + str(side_https_port) + ' with ' + script_path)
+    round_count = warmup.wait_until_ready(
+      base_url='https://' + host + ':' + str(side_https_port),
+      script=script,
+      static_requests=warmup.static_asset_requests(install_dir_path, script['static_prefixes']),
+      server_process=server_process
+    )
+    print('Ready after ' + str(round_count) + ' round(s)')
+  finally:
+    if server_process is not None and server_process.poll() is None:
+      server_process.terminate()
+      server_process.wait()
+    server_log_file.close()
+  print('******************************************************************')
+  print('')
+  print('')
+  print('')
+
+def prune_releases(app_symlink_path, answers_dict=None):
+  '''
+  Removes all but the most recent releases of app_symlink_path, if the answers (keep_releases) or the user ask to
+  '''
+  if answers_dict is not None:
+    keep_count = answers_dict.get('keep_releases')
+  elif general.prompt_for_confirm('Remove releases older than the last ' + str(CONST_KEEP_RELEASES) +
+    ' (they can no longer be rolled back to)?', False):
+    keep_count = CONST_KEEP_RELEASES
+  else:
+    keep_count = None
+  if keep_count is None:
+    return
+  if int(keep_count) < 1:
+    raise Exception(
+      'Error:\n' +
+      'keep_releases must be at least 1, the current release is always kept'
+    )
+  removed_paths = releases.prune_releases(app_symlink_path, int(keep_count))
+  print('Removed ' + str(len(removed_paths)) + ' release(s), keeping the last ' + str(keep_count))
+
+
+
+def upgrade_app(install_dir_path, app_symlink_path, answers_dict=None):
+  '''
+  Restores any missing dependencies, migrates the application's configuration, applies any pending schema migrations,
+  builds any missing or invalid indexes in the upgraded install's index plan, precompresses the static assets, generates
+  the pm2 configuration, hardlinks the files unchanged from the current release, warms up the upgraded install until it
+  is ready, updates the application symlink and optionally reloads the application with pm2 and removes old releases.
+  If answers_dict (see lib/answers.py) is given, nothing is prompted for
+  '''
+  with events.run(install.event_log_path(install_dir_path, answers_dict), 'upgrade'):
+    with events.step('install_dependencies'):
+      install.install_dependencies(
+        install_dir_path=install_dir_path,
+        answers_dict=answers_dict
+      )
+
+    with events.step('configure'):
+      configure.configure_app(
+        current_value_install_dir=app_symlink_path,
+        output_value_install_dir=install_dir_path,
+        answers_dict=answers_dict
+      )
+
+    with events.step('migrate_database'):
+      install.migrate_database(
+        install_dir_path=install_dir_path,
+        answers_dict=answers_dict,
+        dry_run=not answers.get_option(answers_dict or {}, 'migrate_database', True)
+      )
+
+    if answers_dict is not None:
+      build_indexes = answers.get_option(answers_dict, 'build_indexes', True)
+    else:
+      build_indexes = general.prompt_for_confirm('Build missing database indexes (does not block writes)?', True)
+    if build_indexes:
+      with events.step('build_indexes'):
+        install.execute_additional_db_tasks(
+          install_dir_path=install_dir_path,
+          answers_dict=answers_dict
+        )
+
+    with events.step('precompress_assets'):
+      install.precompress_assets(
+        install_dir_path=install_dir_path,
+        answers_dict=answers_dict
+      )
+
+    with events.step('configure_pm2'):
+      pm2_config_path = install.configure_pm2(
+        install_dir_path=install_dir_path,
+        app_symlink_path=app_symlink_path,
+        answers_dict=answers_dict
+      )
+
+    with events.step('deduplicate_release'):
+      deduplicate_release(
+        install_dir_path=install_dir_path,
+        app_symlink_path=app_symlink_path,
+        answers_dict=answers_dict
+      )
+
+    with events.step('warmup_release'):
+      warmup_release(
+        install_dir_path=install_dir_path,
+        answers_dict=answers_dict
+      )
+
+    with events.step('update_symlink'):
+      update_symlink(
+        symlink_path=app_symlink_path,
+        target_path=install_dir_path
+      )
+
+    with events.step('register_pm2'):
+      install.register_pm2(
+        pm2_config_path=pm2_config_path,
+        answers_dict=answers_dict
+      )
+
+    with events.step('prune_releases'):
+      prune_releases(
+        app_symlink_path=app_symlink_path,
+        answers_dict=answers_dict
+      )
 
 
 
 if __name__ == '__main__':
-  print('NB: Usually the upgraded application install directory is the parent of directory of this script')
-  (install_dir_path, app_symlink_path) = prompt_for_upgrade_directories()
-  while not general.prompt_for_confirm('Is this correct?', False):
+  parser = argparse.ArgumentParser(description='Upgrades an existing application')
+  parser.add_argument('--answers', help='YAML or JSON answers file to upgrade from without prompting')
+  args = parser.parse_args()
+
+  answers_dict = None
+  if args.answers is not None:
+    answers_dict = answers.load_answers(args.answers)
+    install_dir_path = answers.get_option(answers_dict, 'install_dir_path')
+    app_symlink_path = answers.get_option(answers_dict, 'app_symlink_path')
+  else:
+    print('NB: Usually the upgraded application install directory is the parent of directory of this script')
     (install_dir_path, app_symlink_path) = prompt_for_upgrade_directories()
+    while not general.prompt_for_confirm('Is this correct?', False):
+      (install_dir_path, app_symlink_path) = prompt_for_upgrade_directories()
 
   print('\nYou have entered:')
   print('- upgraded application install directory path: ' + install_dir_path)
   print('- application symlink path:                    ' + app_symlink_path)
-  if general.prompt_for_confirm('Is this correct?', None):
+  if answers_dict is not None or general.prompt_for_confirm('Is this correct?', None):
     print('')
     upgrade_app(
       install_dir_path=install_dir_path,
-      app_symlink_path=app_symlink_path
+      app_symlink_path=app_symlink_path,
+      answers_dict=answers_dict
     )
     print('')
     print('')
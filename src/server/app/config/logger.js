@@ -6,7 +6,9 @@ var moment = require('moment');
  * Logger-specific configuration
  */
 module.exports = {
-  express_format: ':date EXPRESS [:remote-addr] ":method :url HTTP/:http-version" :status ":referrer" ":user-agent"',
+  // Requests are logged when they finish, with their response time for scripts/logstats.py
+  express_format: ':date EXPRESS [:remote-addr] ":method :url HTTP/:http-version" :status :response-timems ' +
+    '":referrer" ":user-agent"',
   custom_tokens: [{
     token: ':date',
     replacement: function replacement() {
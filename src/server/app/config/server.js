@@ -17,4 +17,7 @@ module.exports = {
   util_route_failure: '/api/util/failure', // constant
   q_longStackSupport: false, // configure.py: server
   static_max_age: 1000, // configure.py: server
+  db_pool_open_timeout: 5000, // constant; ms, less than pm2's listen_timeout (see scripts/lib/pm2.py)
+  static_fingerprinted_max_age: 365 * 24 * 60 * 60 * 1000, // constant; for assets requested with their content hash
+  asset_manifest_path: path.join(__dirname, '..', '..', '..', 'client', 'asset-manifest.json'), // constant
 };
@@ -20,6 +20,7 @@ var RedisStore = require('connect-redis')(session);
 var server_config = require('app/config/server');
 var user_config = require('app/config/user');
 var auth_module = require('app/util/auth');
+var static_assets = require('app/util/static_assets');
 var logger_module = require('app/util/logger');
 var logger = logger_module.get('app/server');
 
@@ -36,11 +37,16 @@ process.on('uncaughtException', function(err) {
 
 Error.stackTraceLimit = Infinity;
 q.longStackSupport = server_config.q_longStackSupport;
-https_redirect(server_config.http_port, server_config.https_port).server();
-logger.info('HttpsRedirectServer redirecting from ' + server_config.http_port + ' to ' + server_config.https_port);
+// The ports can be overridden so that a release can be warmed up next to the running one (see scripts/lib/warmup.py)
+var http_port = process.env.LOGIN_FIDDLE_HTTP_PORT || server_config.http_port;
+var https_port = process.env.LOGIN_FIDDLE_HTTPS_PORT || server_config.https_port;
+https_redirect(http_port, https_port).server();
+logger.info('HttpsRedirectServer redirecting from ' + http_port + ' to ' + https_port);
 var https_server = create_https_server();
-https_server.listen(server_config.https_port, function() {
-  logger.info('Express HTTPS server listening on port ' + server_config.https_port);
+open_db_pool().fin(function() {
+  https_server.listen(https_port, function() {
+    logger.info('Express HTTPS server listening on port ' + https_port);
+  });
 });
 
 
@@ -61,7 +67,7 @@ function configure_app_middleware(app) {
   app.use(log4js.connectLogger(logger_module.get_log4js('connect-appender'), {
     level: 'auto',
     layout: 'basic',
-    immediate: true,
+    immediate: false,
     format: logger_config.express_format,
     tokens: logger_config.custom_tokens
   }));
@@ -76,11 +82,11 @@ function configure_app_middleware(app) {
   // (3) Serve static routes
   app.use(compression());
   app.use(serve_favicon(path.join(server_config.client_root, 'assets', 'images', 'favicons', 'favicon.ico')));
-  app.use('/assets', express.static(path.join(server_config.client_root, 'assets'),
-    { maxAge: server_config.static_max_age }));
-  app.use('/bower_components', express.static(path.join(server_config.client_root, 'bower_components'),
-    { maxAge: server_config.static_max_age }));
-  app.use('/js', express.static(path.join(server_config.client_root, 'js'), { maxAge: server_config.static_max_age }));
+  ['/assets', '/bower_components', '/js'].forEach(function(url_prefix) {
+    var root_dir = path.join(server_config.client_root, url_prefix);
+    app.use(url_prefix, static_assets.serve_precompressed(url_prefix, root_dir));
+    app.use(url_prefix, express.static(root_dir, { maxAge: server_config.static_max_age }));
+  });
 
   // (4) Cookies and sessions
   app.use(session({
@@ -107,11 +113,20 @@ function configure_app_middleware(app) {
   // (5) Serve dynamic routes
   app.use('/api', require('app/api/router'));
 
-  // (6) Fall back to always sending index.html - it should handle 404's
+  // (6) Fall back to always sending index.html - it should handle 404's. With an asset manifest its asset URLs are
+  // fingerprinted, so it is read once
+  var index_html_path = path.join(server_config.client_root, 'index.html');
+  var index_html = static_assets.has_manifest() ?
+    static_assets.get_fingerprinted_html(fs.readFileSync(index_html_path, 'utf8')) : null;
   app.use(function(req, res, next) {
     logger.debug('client request ' + req.originalUrl + ' (route: ' + JSON.stringify(req.route) +
       ') has fallen through to index.html catch');
-    res.sendFile(path.join(server_config.client_root, 'index.html'));
+    if(index_html !== null) {
+      res.type('html').send(index_html);
+    }
+    else {
+      res.sendFile(index_html_path);
+    }
   });
 
   // (7) Error handling
@@ -121,6 +136,32 @@ function configure_app_middleware(app) {
 
 
 
+/**
+ * Opens the DB pool's minimum number of connections before the server listens, so that its first requests do not wait
+ * on new connections. On a graceful reload pm2 only stops an old instance once the new one listens, so requests are
+ * not sent to an instance with an empty pool. Gives up after server_config.db_pool_open_timeout, as the server should
+ * still listen (and report its DB errors per request) if the database is slow or down
+ * @return {Object} Promise that is resolved once the connections are open or opening them has failed or timed out
+ */
+function open_db_pool() {
+  var database_config = require('app/config/database');
+  var pr = require('app/util/pr');
+  var queries = [];
+  for(var i = 0; i < database_config.pool.minConnections; i++) {
+    queries.push(pr.sq.query('SELECT 1'));
+  }
+  return q.all(queries)
+  .timeout(server_config.db_pool_open_timeout)
+  .then(function() {
+    logger.info('Opened ' + queries.length + ' DB pool connection(s)');
+  })
+  .fail(function(err) {
+    logger.warn('Could not open the DB pool connections before listening: ' + err.message);
+  });
+}
+
+
+
 /**
  * Creates HTTPS server object for application
  * @return {Object} Express server object with initialised middleware
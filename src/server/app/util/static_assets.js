@@ -0,0 +1,108 @@
+'use strict';
+
+var fs = require('fs');
+var path = require('path');
+
+var server_config = require('app/config/server');
+var logger_module = require('app/util/logger');
+var logger = logger_module.get('app/util/static_assets');
+
+
+
+var local = {
+  /**
+   * Returns the assets of the manifest written by scripts/install.py (see scripts/lib/assets.py), keyed by URL path:
+   * { '/js/main.js': { hash: ..., bytes: ..., gzip_bytes: ... or null } }. Returns {} if there is no manifest, e.g.
+   * in development, in which case the static roots are served as they are
+   */
+  read_manifest_assets: function read_manifest_assets() {
+    var manifest;
+    try {
+      manifest = JSON.parse(fs.readFileSync(server_config.asset_manifest_path, 'utf8'));
+    }
+    catch(err) {
+      logger.info('No asset manifest at ' + server_config.asset_manifest_path + ' (' + err.message + '), serving ' +
+        'static assets without precompression or fingerprinting');
+      return {};
+    }
+    logger.info('Serving ' + Object.keys(manifest.assets).length + ' static assets from the asset manifest');
+    return manifest.assets;
+  },
+
+  /**
+   * Returns the URL path of req relative to the static root, decoded, or null if it cannot be decoded
+   */
+  get_decoded_path: function get_decoded_path(req) {
+    try {
+      return decodeURIComponent(req.path);
+    }
+    catch(err) {
+      return null;
+    }
+  }
+};
+
+var manifest_assets = local.read_manifest_assets();
+
+
+
+module.exports = {
+  /**
+   * Returns middleware for the static root at root_dir served at url_prefix (e.g. '/js'), to be mounted in front of its
+   * express.static middleware. For files in the asset manifest it:
+   * - Serves the precompressed .gz sibling to clients that accept gzip, so that the file isn't gzipped per request
+   * - Caches the file for static_fingerprinted_max_age if it was requested with its content hash (?v=<hash>, see
+   *   get_fingerprinted_html), as its URL changes whenever its contents do
+   * Requests for anything else fall through to the next middleware
+   */
+  serve_precompressed: function serve_precompressed(url_prefix, root_dir) {
+    return function serve_precompressed_asset(req, res, next) {
+      if(req.method !== 'GET' && req.method !== 'HEAD') {
+        return next();
+      }
+      var rel_path = local.get_decoded_path(req);
+      var asset = rel_path === null ? undefined : manifest_assets[url_prefix + rel_path];
+      if(!asset) {
+        return next();
+      }
+      var file_path = path.join(root_dir, rel_path);
+      var options = {
+        maxAge: req.query.v === asset.hash ? server_config.static_fingerprinted_max_age : server_config.static_max_age
+      };
+      if(asset.gzip_bytes !== null) {
+        res.vary('Accept-Encoding');
+        if(req.acceptsEncodings('gzip', 'identity') === 'gzip') {
+          res.type(path.extname(file_path));
+          res.set('Content-Encoding', 'gzip');
+          file_path = file_path + '.gz';
+        }
+      }
+      res.sendFile(file_path, options, function(err) {
+        if(err && !res.headersSent) {
+          logger.warn('Could not serve ' + file_path + ', falling back to the static root: ' + err.message);
+          res.removeHeader('Content-Encoding');
+          res.removeHeader('Content-Type');
+          next();
+        }
+      });
+    };
+  },
+
+  /**
+   * Returns html with the content hash added to the URL of every local src and href in the asset manifest, e.g.
+   * src="/js/main.js" becomes src="/js/main.js?v=<hash>". Returns html unchanged if there is no manifest
+   */
+  get_fingerprinted_html: function get_fingerprinted_html(html) {
+    return html.replace(/(src|href)="(\/[^"?#]+)"/g, function(match, attribute, url_path) {
+      var asset = manifest_assets[url_path];
+      return asset ? attribute + '="' + url_path + '?v=' + asset.hash + '"' : match;
+    });
+  },
+
+  /**
+   * Returns whether there is an asset manifest
+   */
+  has_manifest: function has_manifest() {
+    return Object.keys(manifest_assets).length > 0;
+  }
+};
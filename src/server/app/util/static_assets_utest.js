@@ -0,0 +1,153 @@
+// Allow statements that are not assignments or function calls (e.g. should statements)
+/* jshint -W030 */
+
+'use strict';
+
+var fs = require('fs');
+var os = require('os');
+var path = require('path');
+
+require('should');
+var sinon = require('sinon');
+
+var server_config = require('app/config/server');
+
+var manifest_path = path.join(os.tmpdir(), 'login-fiddle-static-assets-utest-' + process.pid + '.json');
+var root_dir = path.join('/srv', 'client', 'js');
+var main_hash = 'a1b2c3';
+
+var original_manifest_path = server_config.asset_manifest_path;
+var static_assets;
+var serve_precompressed;
+var req = {};
+var res = {};
+var next;
+
+describe('app/util/static_assets', function() {
+  before(function() {
+    fs.writeFileSync(manifest_path, JSON.stringify({
+      assets: {
+        '/js/main.js': { hash: main_hash, bytes: 2048, gzip_bytes: 512 },
+        '/js/tiny.js': { hash: 'd4e5f6', bytes: 64, gzip_bytes: null }
+      }
+    }));
+    server_config.asset_manifest_path = manifest_path;
+    delete require.cache[require.resolve('app/util/static_assets')];
+    static_assets = require('app/util/static_assets');
+    serve_precompressed = static_assets.serve_precompressed('/js', root_dir);
+  });
+
+  after(function() {
+    fs.unlinkSync(manifest_path);
+    server_config.asset_manifest_path = original_manifest_path;
+    delete require.cache[require.resolve('app/util/static_assets')];
+  });
+
+  beforeEach(function() {
+    req = {
+      method: 'GET',
+      path: '/main.js',
+      query: {},
+      acceptsEncodings: sinon.stub().returns('gzip')
+    };
+    res = {
+      headersSent: false,
+      vary: sinon.spy(),
+      type: sinon.spy(),
+      set: sinon.spy(),
+      removeHeader: sinon.spy(),
+      sendFile: sinon.spy()
+    };
+    next = sinon.spy();
+  });
+
+  describe('module.exports.serve_precompressed', function() {
+    it('sends the .gz sibling with Content-Encoding gzip and Vary to clients that accept gzip', function() {
+      serve_precompressed(req, res, next);
+      res.vary.calledWith('Accept-Encoding').should.be.true;
+      res.set.calledWith('Content-Encoding', 'gzip').should.be.true;
+      res.type.calledWith('.js').should.be.true;
+      res.sendFile.calledOnce.should.be.true;
+      res.sendFile.firstCall.args[0].should.equal(path.join(root_dir, 'main.js') + '.gz');
+      next.called.should.be.false;
+    });
+
+    it('sends the uncompressed file with Vary to clients that do not accept gzip', function() {
+      req.acceptsEncodings = sinon.stub().returns('identity');
+      serve_precompressed(req, res, next);
+      res.vary.calledWith('Accept-Encoding').should.be.true;
+      res.set.called.should.be.false;
+      res.sendFile.firstCall.args[0].should.equal(path.join(root_dir, 'main.js'));
+    });
+
+    it('sends the uncompressed file without Vary if the asset has no .gz sibling', function() {
+      req.path = '/tiny.js';
+      serve_precompressed(req, res, next);
+      res.vary.called.should.be.false;
+      res.set.called.should.be.false;
+      res.sendFile.firstCall.args[0].should.equal(path.join(root_dir, 'tiny.js'));
+    });
+
+    it('caches for static_fingerprinted_max_age only if ?v= matches the content hash', function() {
+      req.query.v = main_hash;
+      serve_precompressed(req, res, next);
+      res.sendFile.firstCall.args[1].maxAge.should.equal(server_config.static_fingerprinted_max_age);
+
+      req.query.v = 'stale';
+      serve_precompressed(req, res, next);
+      res.sendFile.secondCall.args[1].maxAge.should.equal(server_config.static_max_age);
+
+      delete req.query.v;
+      serve_precompressed(req, res, next);
+      res.sendFile.thirdCall.args[1].maxAge.should.equal(server_config.static_max_age);
+    });
+
+    it('calls next for assets that are not in the manifest', function() {
+      req.path = '/other.js';
+      serve_precompressed(req, res, next);
+      next.calledOnce.should.be.true;
+      res.sendFile.called.should.be.false;
+    });
+
+    it('calls next for requests that are not GET or HEAD', function() {
+      req.method = 'POST';
+      serve_precompressed(req, res, next);
+      next.calledOnce.should.be.true;
+      res.sendFile.called.should.be.false;
+    });
+
+    it('calls next for paths that cannot be decoded', function() {
+      req.path = '/%E0%A4%A.js';
+      serve_precompressed(req, res, next);
+      next.calledOnce.should.be.true;
+      res.sendFile.called.should.be.false;
+    });
+
+    it('removes the gzip headers and calls next if the file cannot be sent', function() {
+      serve_precompressed(req, res, next);
+      res.sendFile.firstCall.args[2](new Error('ENOENT'));
+      res.removeHeader.calledWith('Content-Encoding').should.be.true;
+      res.removeHeader.calledWith('Content-Type').should.be.true;
+      next.calledOnce.should.be.true;
+    });
+  });
+
+  describe('module.exports.get_fingerprinted_html', function() {
+    it('adds the content hash to the src and href of assets in the manifest', function() {
+      static_assets.get_fingerprinted_html('<script src="/js/main.js"></script><link href="/js/tiny.js">')
+        .should.equal('<script src="/js/main.js?v=' + main_hash + '"></script><link href="/js/tiny.js?v=d4e5f6">');
+    });
+
+    it('leaves URLs that are not in the manifest or already have a query unchanged', function() {
+      var html = '<script src="/js/other.js"></script><script src="/js/main.js?v=old"></script>' +
+        '<a href="https://example.com/js/main.js">';
+      static_assets.get_fingerprinted_html(html).should.equal(html);
+    });
+  });
+
+  describe('module.exports.has_manifest', function() {
+    it('returns true if the manifest has assets', function() {
+      static_assets.has_manifest().should.be.true;
+    });
+  });
+});